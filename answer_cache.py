@@ -0,0 +1,114 @@
+import hashlib
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from functools import lru_cache
+
+import numpy as np
+
+
+ANSWER_CACHE_THRESHOLD = float(os.getenv("ANSWER_CACHE_THRESHOLD", "0.95"))
+ANSWER_CACHE_TTL = float(os.getenv("ANSWER_CACHE_TTL", str(24 * 3600)))
+ANSWER_CACHE_MAX_ENTRIES = int(os.getenv("ANSWER_CACHE_MAX_ENTRIES", "1000"))
+
+# Follow-ups like "what about in children?" or "is it dangerous?" only make sense with the chat so far.
+# Pronouns alone are too common ("how long does it take for iron to work?"), so they only count in
+# short questions; openers and explicit back-references count in any question.
+FOLLOW_UP_OPENER = re.compile(
+    r"^\s*(and|also|but|so|then|what about|how about|what if|what else|tell me more|more on|elaborate|"
+    r"can you elaborate|explain (it|that|this) (more|again)|why is that)\b",
+    re.IGNORECASE,
+)
+BACK_REFERENCE = re.compile(
+    r"\b(above|previous(ly)?|earlier|you (said|mentioned|told|wrote)|the same|"
+    r"(this|that|these|those) (condition|disease|illness|medicine|medication|drug|treatment|test|symptoms?|"
+    r"results?|values?|ones?))\b",
+    re.IGNORECASE,
+)
+PRONOUN = re.compile(r"\b(it|its|it's|this|that|these|those|they|them|their|he|she|him|her)\b", re.IGNORECASE)
+SHORT_QUESTION_WORDS = 8
+
+
+def context_ids(context_docs):
+    # Content hashes, so a rebuilt index with different chunks never matches an old entry
+    return tuple(hashlib.sha1(doc.encode("utf-8")).hexdigest()[:16] for doc in context_docs)
+
+
+def is_context_dependent(query, history):
+    if not history:
+        return False
+    if FOLLOW_UP_OPENER.search(query) or BACK_REFERENCE.search(query):
+        return True
+    return len(query.split()) <= SHORT_QUESTION_WORDS and bool(PRONOUN.search(query))
+
+
+class SemanticAnswerCache:
+    # Process-wide cache of RAG answers. A lookup hits when the query embedding is within
+    # `threshold` cosine similarity of a cached one *and* retrieval returned the same chunks.
+
+    def __init__(self, threshold=ANSWER_CACHE_THRESHOLD, ttl=ANSWER_CACHE_TTL, max_entries=ANSWER_CACHE_MAX_ENTRIES):
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.entries = OrderedDict()  # key -> (unit embedding, context ids, answer, created)
+        self.lock = threading.Lock()
+        self.next_key = 0
+        self.hits = 0
+        self.misses = 0
+        self.bypassed = 0
+        self.evictions = 0
+        self.last_similarity = None
+
+    def get(self, embedding, ids):
+        query = self._unit(embedding)
+        now = time.time()
+        with self.lock:
+            for key in [key for key, entry in self.entries.items() if now - entry[3] > self.ttl]:
+                del self.entries[key]
+            best_key, best_similarity = None, -1.0
+            for key, (vector, entry_ids, _, _) in self.entries.items():
+                if entry_ids != ids:
+                    continue
+                similarity = float(np.dot(vector, query))
+                if similarity > best_similarity:
+                    best_key, best_similarity = key, similarity
+            self.last_similarity = best_similarity if best_key is not None else None
+            if best_key is None or best_similarity < self.threshold:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(best_key)
+            self.hits += 1
+            return self.entries[best_key][2]
+
+    def put(self, embedding, ids, answer):
+        with self.lock:
+            self.entries[self.next_key] = (self._unit(embedding), ids, answer, time.time())
+            self.next_key += 1
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def bypass(self):
+        with self.lock:
+            self.bypassed += 1
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {"entries": len(self.entries), "hits": self.hits, "misses": self.misses,
+                    "bypassed": self.bypassed, "evictions": self.evictions,
+                    "hit_rate": self.hits / lookups if lookups else 0.0,
+                    "threshold": self.threshold, "last_similarity": self.last_similarity}
+
+    @staticmethod
+    def _unit(embedding):
+        vector = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+
+@lru_cache(maxsize=None)
+def get_answer_cache():
+    return SemanticAnswerCache()
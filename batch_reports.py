@@ -0,0 +1,171 @@
+import argparse
+import json
+import logging
+import multiprocessing
+import os
+import random
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+
+from llm import rate_limit_delay
+from llm_scheduler import PRIORITY_BATCH
+from report_analysis import extract_text, flag_abnormalities, summarize
+from report_cache import content_hash
+
+
+logger = logging.getLogger(__name__)
+
+OUTPUT_PATH="batch_results.jsonl"
+LLM_CONCURRENCY=4
+LLM_RETRIES=5
+MAX_BACKOFF=120
+
+
+# Step 1: Find the reports
+def list_reports(paths):
+    # Files as given, directories searched recursively for PDFs
+    reports=[]
+    for path in paths:
+        if os.path.isdir(path):
+            for root, _, names in os.walk(path):
+                reports.extend(os.path.join(root, name) for name in names if name.lower().endswith(".pdf"))
+        else:
+            reports.append(path)
+    return sorted(dict.fromkeys(os.path.abspath(path) for path in reports))
+
+def load_done(output_path):
+    # Reports already written successfully. A line cut short by a crash is dropped from the file,
+    # so appending continues from a clean line boundary.
+    done=set()
+    if not os.path.exists(output_path):
+        return done
+    with open(output_path, "rb") as f:
+        data=f.read()
+    end=0
+    for line in data.splitlines(keepends=True):
+        try:
+            record=json.loads(line)
+        except ValueError:
+            break
+        if not line.endswith(b"\n"):
+            break
+        end+=len(line)
+        if record.get("status") == "ok":
+            done.add(record["path"])
+    if end < len(data):
+        logger.warning("Dropping a partial record at the end of %s", output_path)
+        with open(output_path, "r+b") as f:
+            f.truncate(end)
+    return done
+
+
+# Step 2: Extraction and flags, in worker processes
+def analyze_file(path):
+    # Runs in a worker process; OCR is done in-process since the pool already spreads the reports
+    started=time.perf_counter()
+    record={"path": path}
+    try:
+        with open(path, "rb") as f:
+            pdf_bytes=f.read()
+        record["sha256"]=content_hash(pdf_bytes)
+        text=extract_text(pdf_bytes, record["sha256"], inline=True)
+        if not text:
+            raise ValueError("no extractable text")
+        record["flags"]=flag_abnormalities(text, record["sha256"])
+        record["status"]="ok"
+    except Exception as e:
+        record.update(status="error", stage="extract", error=f"{type(e).__name__}: {e}")
+        text=None
+    record["timings"]={"extract": time.perf_counter() - started}
+    return record, text
+
+
+# Step 3: Summaries, with bounded concurrency and retries
+def summarize_with_retries(record, text, retries=LLM_RETRIES):
+    started=time.perf_counter()
+    timings={}
+    for attempt in range(retries + 1):
+        try:
+            # Lowest priority in the LLM scheduler (llm_scheduler.py)
+            record["summary"]=summarize(text, record["sha256"], timings, priority=PRIORITY_BATCH)
+            record["timings"].update(summary=time.perf_counter() - started, provider=timings.get("provider"))
+            return record
+        except Exception as e:
+            if attempt == retries:
+                record.update(status="error", stage="summary", error=f"{type(e).__name__}: {e}")
+                return record
+            # Rate limits wait as long as the provider asks; other failures back off exponentially.
+            # Jitter keeps the workers from retrying in lockstep.
+            delay=rate_limit_delay(e)
+            backoff=min(MAX_BACKOFF, 2 ** attempt)
+            delay=max(delay or 0.0, backoff) * random.uniform(0.8, 1.2)
+            logger.warning("Summary of %s failed (%s), retrying in %.1fs", record["path"], e, delay)
+            time.sleep(delay)
+
+
+# Step 4: Run everything, one JSONL record per report as it finishes
+def run_batch(paths, output_path=OUTPUT_PATH, workers=None, llm_concurrency=LLM_CONCURRENCY,
+              summaries=True, retries=LLM_RETRIES):
+    workers=workers or os.cpu_count() or 1
+    done=load_done(output_path)
+    todo=deque(path for path in list_reports(paths) if path not in done)
+    stats={"skipped": len(done), "ok": 0, "error": 0}
+    print(f"{len(todo)} reports to analyze, {len(done)} already in {output_path}")
+
+    # spawn: forking while the LLM threads run is unsafe
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as extract_pool, \
+            ThreadPoolExecutor(max_workers=llm_concurrency) as llm_pool, \
+            open(output_path, "a", encoding="utf-8") as out:
+
+        def write(record):
+            out.write(json.dumps(record) + "\n")
+            # Flushed per record: after a crash, everything written so far is skipped on restart
+            out.flush()
+            stats[record["status"]]+=1
+
+        extracting=set()
+        summarizing=set()
+        while todo or extracting or summarizing:
+            # Keep a bounded window in flight, so texts waiting for the LLM don't pile up in memory
+            while todo and len(extracting) < workers * 2 and len(summarizing) < llm_concurrency * 4:
+                extracting.add(extract_pool.submit(analyze_file, todo.popleft()))
+            finished, _ = wait(extracting | summarizing, return_when=FIRST_COMPLETED)
+            for future in finished:
+                if future in extracting:
+                    extracting.discard(future)
+                    record, text = future.result()
+                    if summaries and record["status"] == "ok":
+                        summarizing.add(llm_pool.submit(summarize_with_retries, record, text, retries))
+                    else:
+                        write(record)
+                else:
+                    summarizing.discard(future)
+                    write(future.result())
+    return stats
+
+
+if __name__ == "__main__":
+    parser=argparse.ArgumentParser(description="Analyze a backlog of lab report PDFs without the UI, one JSONL record per report")
+    parser.add_argument("paths", nargs="*", help="PDF files or directories (searched recursively)")
+    parser.add_argument("--files-from", default=None, help="text file with one PDF path per line")
+    parser.add_argument("--output", default=OUTPUT_PATH, help="JSONL output; reports already in it are skipped")
+    parser.add_argument("--workers", type=int, default=None, help="extraction/OCR processes (default: all cores)")
+    parser.add_argument("--llm-concurrency", type=int, default=LLM_CONCURRENCY, help="summaries requested at once")
+    parser.add_argument("--retries", type=int, default=LLM_RETRIES, help="summary retries on rate limits or provider errors")
+    parser.add_argument("--no-summary", action="store_true", help="only extract text and flag abnormal values")
+    args=parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+    paths=list(args.paths)
+    if args.files_from:
+        with open(args.files_from, encoding="utf-8") as f:
+            paths.extend(line.strip() for line in f if line.strip())
+    if not paths:
+        parser.error("no reports given")
+
+    started=time.perf_counter()
+    stats=run_batch(paths, args.output, workers=args.workers, llm_concurrency=args.llm_concurrency,
+                    summaries=not args.no_summary, retries=args.retries)
+    print(f"Reports ok: {stats['ok']}, failed: {stats['error']}, skipped: {stats['skipped']} "
+          f"({time.perf_counter() - started:.1f}s total)")
@@ -0,0 +1,139 @@
+"""Speed, memory and retrieval agreement of the ONNX Runtime embedding backends against sentence-transformers.
+
+    python -m benchmarks.bench_embeddings
+    python -m benchmarks.bench_embeddings --db vectorstore/db_faiss --runtimes onnx,onnx-int8 --json embeddings.json
+
+Documents are the store's chunks (--db) or synthetic textbook chunks; queries are sentences taken from them.
+Exits with status 1 when a runtime's top-k results share less than --min-overlap with the torch results on
+average, or one of its document vectors has a cosine below --min-cosine to the torch vector.
+"""
+import argparse
+import json
+import os
+import random
+import re
+import subprocess
+import sys
+import time
+
+import numpy as np
+
+from benchmarks.bench_hot_paths import corpus_pages
+from embedding_model import EMBEDDING_MODEL_NAME, load_embeddings
+
+
+# Loaded in a fresh interpreter: import and load time, and the memory the runtime adds to a process
+LOAD_PROBE = """
+import json, os, sys, time
+def rss():
+    with open("/proc/self/statm") as f:
+        return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+before = rss()
+started = time.perf_counter()
+from embedding_model import load_embeddings
+load_embeddings(sys.argv[1], sys.argv[2]).embed_query("warm-up query")
+print(json.dumps({"load_seconds": time.perf_counter() - started, "rss_mb": (rss() - before) / 2 ** 20}))
+"""
+SENTENCE = re.compile(r"[^.!?]{20,200}[.!?]")
+
+
+def store_texts(db_path, count, seed=0):
+    from vector_store import ChunkStore
+
+    chunks = ChunkStore(db_path)
+    positions = sorted(random.Random(seed).sample(range(len(chunks)), min(count, len(chunks))))
+    return [chunks.text(i) for i in positions]
+
+
+def synthetic_texts(count):
+    # ~750-character pieces, as in bench_hot_paths
+    text = " ".join(corpus_pages(max(1, count // 3)))
+    return [text[i:i + 750] for i in range(0, len(text), 650)][:count]
+
+
+def sample_queries(texts, count, seed=0):
+    rng = random.Random(seed)
+    sentences = [match.group().strip() for text in texts for match in SENTENCE.finditer(text)]
+    return rng.sample(sentences, min(count, len(sentences))) if sentences else texts[:count]
+
+
+def load_probe(runtime):
+    output = subprocess.run([sys.executable, "-c", LOAD_PROBE, EMBEDDING_MODEL_NAME, runtime], check=True,
+                            capture_output=True, text=True, cwd=os.getcwd()).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def embed(runtime, texts, queries):
+    model = load_embeddings(EMBEDDING_MODEL_NAME, runtime)
+    model.embed_documents(texts[:8])  # warm-up
+    started = time.perf_counter()
+    documents = np.asarray(model.embed_documents(texts), dtype=np.float32)
+    seconds = time.perf_counter() - started
+    queries = np.asarray(model.embed_documents(queries), dtype=np.float32)
+    return documents, queries, seconds
+
+
+def top_k(documents, queries, k):
+    return np.argsort(-(queries @ documents.T), axis=1, kind="stable")[:, :k]
+
+
+def agreement(reference, candidate, k):
+    # Cosines to the reference vectors (all unit length) and top-k overlap of the same queries
+    cosines = np.sum(reference[0] * candidate[0], axis=1)
+    expected, found = top_k(reference[0], reference[1], k), top_k(candidate[0], candidate[1], k)
+    overlap = [len(set(a) & set(b)) / k for a, b in zip(expected, found)]
+    return {"min_cosine": float(cosines.min()), "mean_cosine": float(cosines.mean()),
+            "overlap": float(np.mean(overlap)), "top1_agreement": float(np.mean(expected[:, 0] == found[:, 0]))}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--db", default=None, help="take documents from this store instead of synthetic text")
+    parser.add_argument("--runtimes", type=lambda s: s.split(","), default=["onnx", "onnx-int8"],
+                        help="compared with torch")
+    parser.add_argument("--chunks", type=int, default=2000, help="documents to embed")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("-k", type=int, default=5, help="results per query")
+    parser.add_argument("--min-overlap", type=float, default=0.9, help="mean share of torch's top-k to keep")
+    parser.add_argument("--min-cosine", type=float, default=0.98, help="lowest cosine to the torch vector")
+    parser.add_argument("--no-probe", action="store_true", help="skip the fresh-process load time and memory")
+    parser.add_argument("--json", default=None, help="write results to this file")
+    args = parser.parse_args()
+
+    texts = store_texts(args.db, args.chunks) if args.db else synthetic_texts(args.chunks)
+    queries = sample_queries(texts, args.queries)
+    print(f"{len(texts)} documents, {len(queries)} queries, k={args.k}")
+
+    results = []
+    reference = None
+    for runtime in ["torch"] + [runtime for runtime in args.runtimes if runtime != "torch"]:
+        documents, query_vectors, seconds = embed(runtime, texts, queries)
+        row = {"runtime": runtime, "chunks_per_s": len(texts) / seconds}
+        if not args.no_probe:
+            row.update(load_probe(runtime))
+        if reference is None:
+            reference = (documents, query_vectors)
+        else:
+            row.update(agreement(reference, (documents, query_vectors), args.k))
+            row["passed"] = row["overlap"] >= args.min_overlap and row["min_cosine"] >= args.min_cosine
+        results.append(row)
+
+    header = f"{'runtime':<10} {'chunks/s':>9} {'load s':>7} {'RSS MB':>7} {'min cos':>8} {'overlap':>8} {'top-1':>6}"
+    print(header)
+    print("-" * len(header))
+    for row in results:
+        cells = [f"{row[key]:>{width}.{digits}f}" if key in row else f"{'-':>{width}}"
+                 for key, width, digits in (("load_seconds", 7, 2), ("rss_mb", 7, 0), ("min_cosine", 8, 4),
+                                            ("overlap", 8, 3), ("top1_agreement", 6, 3))]
+        status = "" if "passed" not in row else "  ok" if row["passed"] else "  OUT OF TOLERANCE"
+        print(f"{row['runtime']:<10} {row['chunks_per_s']:>9.1f} {' '.join(cells)}{status}")
+
+    if args.json:
+        settings = {key: getattr(args, key) for key in ("db", "chunks", "queries", "k", "min_overlap", "min_cosine")}
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"settings": settings, "results": results}, f, indent=2)
+    sys.exit(0 if all(row.get("passed", True) for row in results) else 1)
+
+
+if __name__ == "__main__":
+    main()
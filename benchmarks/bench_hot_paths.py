@@ -0,0 +1,357 @@
+"""Timings of the hot paths on synthetic inputs: report extraction (text layer and OCR), lab flagging,
+chunking, embedding, FAISS build and search, chat export and summarization with a stubbed LLM.
+
+    python -m benchmarks.bench_hot_paths --json baseline.json
+    python -m benchmarks.bench_hot_paths --pages 40 --corpus-pages 2000 --embeddings hash --json after.json
+    python -m benchmarks.bench_hot_paths --compare baseline.json after.json --threshold 0.15
+
+--compare exits with status 1 when a case's median time grew by more than the threshold.
+"""
+import argparse
+import hashlib
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import time
+import types
+
+import numpy as np
+
+from benchmarks.bench_lab_parser import synthetic_reports
+
+
+WORDS = ("anemia hemoglobin iron deficiency fatigue chronic disease marrow platelet infection fever "
+         "diagnosis treatment therapy dose patient symptoms clinical acute renal hepatic cardiac "
+         "pressure glucose insulin thyroid hormone vitamin serum plasma cell blood tissue").split()
+
+
+# Synthetic inputs
+
+def corpus_pages(count, chars_per_page=2500, seed=0):
+    # Textbook-like pages: sentences of medical words in paragraphs
+    rng = random.Random(seed)
+    pages = []
+    for _ in range(count):
+        paragraphs, size = [], 0
+        while size < chars_per_page:
+            sentences = (" ".join(rng.choices(WORDS, k=rng.randint(6, 18))).capitalize() + "."
+                         for _ in range(rng.randint(3, 7)))
+            paragraphs.append(" ".join(sentences))
+            size += len(paragraphs[-1])
+        pages.append("\n\n".join(paragraphs))
+    return pages
+
+
+def report_pdf(pages, scanned=False, seed=0):
+    # A lab report of `pages` pages; `scanned` keeps only page images, so every page needs OCR
+    import fitz
+
+    texts = [text for text, _ in synthetic_reports(pages, filler=10, seed=seed)]
+    doc = fitz.open()
+    for text in texts:
+        page = doc.new_page()
+        page.insert_textbox(fitz.Rect(40, 40, page.rect.width - 40, page.rect.height - 40), text, fontsize=9)
+    if not scanned:
+        return doc.tobytes()
+    images = fitz.open()
+    for page in doc:
+        pixmap = page.get_pixmap(dpi=150)
+        images.new_page(width=page.rect.width, height=page.rect.height).insert_image(page.rect, pixmap=pixmap)
+    return images.tobytes()
+
+
+class HashEmbeddings:
+    # Deterministic bag-of-words vectors: exercises everything around the model without loading it
+    dim = 384
+
+    def embed_documents(self, texts):
+        vectors = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for word in text.lower().split():
+                vectors[row, int(hashlib.md5(word.encode()).hexdigest()[:8], 16) % self.dim] += 1.0
+        vectors /= np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-6)
+        return vectors.tolist()
+
+    def embed_query(self, text):
+        return self.embed_documents([text])[0]
+
+
+class StubStream:
+    def __init__(self, deltas):
+        self.chunks = [types.SimpleNamespace(choices=[types.SimpleNamespace(delta=types.SimpleNamespace(content=d))])
+                       for d in deltas]
+
+    def __iter__(self):
+        return iter(self.chunks)
+
+    def close(self):
+        pass
+
+
+def stub_router(latency=0.0, tokens=200):
+    # The real LLMRouter over a provider whose client answers after `latency` seconds with `tokens` deltas
+    from llm import Provider
+    from llm_router import LLMRouter
+
+    def create(model, messages, stream=False, timeout=None):
+        time.sleep(latency)
+        deltas = [f"word{i} " for i in range(tokens)]
+        if stream:
+            return StubStream(deltas)
+        message = types.SimpleNamespace(content="".join(deltas))
+        return types.SimpleNamespace(choices=[types.SimpleNamespace(message=message)])
+
+    client = types.SimpleNamespace(chat=types.SimpleNamespace(completions=types.SimpleNamespace(create=create)))
+    return LLMRouter([Provider("stub", client, "llama3-70b-8192")], hedge_delay=60)
+
+
+# Cases: each builds its input from the parsed arguments and returns (function to time, units per call, unit).
+# They call the uncached functions, so repeats measure the code rather than the report or embedding cache.
+
+def case_extract_text(args):
+    import report_extraction
+
+    pdf = report_pdf(args.pages)
+    return lambda: report_extraction.extract_text(pdf), args.pages, "pages"
+
+
+def case_extract_ocr(args):
+    import shutil
+
+    import ocr_engine
+    import report_extraction
+
+    if shutil.which("tesseract") is None and ocr_engine.engine_name() != "tesserocr":
+        raise RuntimeError("tesseract is not installed")
+    pages = max(1, args.pages // 4)
+    pdf = report_pdf(pages, scanned=True)
+    # Inline: the OCR pool's process start-up would otherwise dominate
+    return lambda: report_extraction.extract_text(pdf, inline=True), pages, "pages"
+
+
+def case_flag_abnormalities(args):
+    import lab_parser
+
+    texts = [text for text, _ in synthetic_reports(args.reports, filler=20)]
+    return lambda: [lab_parser.flag_abnormalities(text) for text in texts], len(texts), "reports"
+
+
+def case_create_chunks(args):
+    from langchain_core.documents import Document
+    from memory_creation import create_chunks
+
+    docs = [Document(page_content=text, metadata={"source": "synthetic.pdf", "page": i})
+            for i, text in enumerate(corpus_pages(args.corpus_pages))]
+    return lambda: create_chunks(docs), len(docs), "pages"
+
+
+def embedder(args):
+    if args.embeddings == "hash":
+        return HashEmbeddings()
+    from embedding_model import get_embedding_model
+
+    # The model itself: the embedding cache would turn every repeat after the first into lookups
+    return get_embedding_model().embeddings
+
+
+def chunk_texts(args):
+    # ~750-character pieces: about chunker.CHUNK_TOKENS word pieces, the size create_chunks produces
+    text = " ".join(corpus_pages(args.corpus_pages))
+    return [text[i:i + 750] for i in range(0, len(text), 650)][:args.chunks]
+
+
+def case_embed(args):
+    model = embedder(args)
+    texts = chunk_texts(args)[:args.embed_chunks]
+    return lambda: model.embed_documents(texts), len(texts), "chunks"
+
+
+def corpus_vectors(args):
+    from benchmarks.bench_index import synthetic_vectors
+
+    return synthetic_vectors(args.chunks, args.dim)
+
+
+def case_faiss_build(args):
+    from vector_index import build_index, index_config
+
+    vectors = corpus_vectors(args)
+    config = index_config(args.index)
+    return lambda: build_index(vectors, config), len(vectors), "vectors"
+
+
+def case_faiss_search(args):
+    from vector_index import build_index, index_config
+
+    vectors = corpus_vectors(args)
+    index = build_index(vectors, index_config(args.index))
+    queries = vectors[np.random.default_rng(1).integers(0, len(vectors), args.queries)]
+    # One query at a time, like the chatbot
+    return lambda: [index.search(queries[i:i + 1], 4) for i in range(len(queries))], len(queries), "queries"
+
+
+def chat_history(turns):
+    rng = random.Random(0)
+    return [(f"Question {i} about {' '.join(rng.choices(WORDS, k=8))}?", "\n\n".join(corpus_pages(1, 1200, seed=i)))
+            for i in range(turns)]
+
+
+def case_chat_export(args):
+    from chat_export import ChatExport
+
+    history = chat_history(args.turns)
+    return lambda: ChatExport().export(history, "PDF"), len(history), "turns"
+
+
+def case_chat_export_append(args):
+    from chat_export import ChatExport
+
+    # Every call is the export the sidebar makes after one more question
+    history = chat_history(args.turns + args.repeat + 1)
+    export = ChatExport()
+    export.export(history[:args.turns], "PDF")
+    lengths = iter(range(args.turns + 1, len(history) + 1))
+    return lambda: export.export(history[:next(lengths)], "PDF"), 1, "turns"
+
+
+def summary_case(args, pages):
+    from report_analysis import generate_summary
+
+    router = stub_router(args.llm_latency)
+    text = "\f".join(text for text, _ in synthetic_reports(pages, filler=40))
+    return lambda: "".join(generate_summary(text, {}, router)), pages, "pages"
+
+
+def case_summary_short(args):
+    return summary_case(args, 1)
+
+
+def case_summary_long(args):
+    # Enough pages to take the map-reduce path
+    return summary_case(args, args.pages)
+
+
+CASES = {
+    "extract_text": case_extract_text,
+    "extract_ocr": case_extract_ocr,
+    "flag_abnormalities": case_flag_abnormalities,
+    "create_chunks": case_create_chunks,
+    "embed": case_embed,
+    "faiss_build": case_faiss_build,
+    "faiss_search": case_faiss_search,
+    "chat_export": case_chat_export,
+    "chat_export_append": case_chat_export_append,
+    "summary_short": case_summary_short,
+    "summary_long": case_summary_long,
+}
+
+
+def time_case(fn, repeat, warmup=1):
+    for _ in range(warmup):
+        fn()
+    runs = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        runs.append(time.perf_counter() - started)
+    return runs
+
+
+def run_cases(args):
+    results = {}
+    print(f"{'case':<20} {'median s':>10} {'min s':>10} {'throughput':>22}")
+    for name in args.only or CASES:
+        try:
+            fn, units, unit = CASES[name](args)
+            runs = time_case(fn, args.repeat)
+        except Exception as e:
+            # Missing optional dependency (tesseract, langchain, the model): recorded, not fatal
+            results[name] = {"skipped": f"{type(e).__name__}: {e}"}
+            print(f"{name:<20} skipped: {results[name]['skipped']}")
+            continue
+        median = statistics.median(runs)
+        results[name] = {"median": median, "min": min(runs), "runs": runs, "units": units, "unit": unit,
+                         "per_s": units / median if median else None}
+        print(f"{name:<20} {median:>10.4f} {min(runs):>10.4f} {units / median:>14.1f} {unit + '/s':<8}")
+    return results
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def compare(base_path, new_path, threshold, min_delta):
+    with open(base_path, encoding="utf-8") as f:
+        base = json.load(f)
+    with open(new_path, encoding="utf-8") as f:
+        new = json.load(f)
+    if base.get("sizes") != new.get("sizes"):
+        print(f"warning: runs used different sizes: {base.get('sizes')} vs {new.get('sizes')}")
+    print(f"{base_path} ({base.get('commit')}) -> {new_path} ({new.get('commit')})")
+    print(f"{'case':<20} {'base s':>10} {'new s':>10} {'change':>8}")
+    regressions = []
+    for name in dict.fromkeys([*base["results"], *new["results"]]):
+        old_row, new_row = base["results"].get(name, {}), new["results"].get(name, {})
+        if "median" not in old_row or "median" not in new_row:
+            print(f"{name:<20} {'-':>10} {'-':>10} {'n/a':>8}")
+            continue
+        change = new_row["median"] / old_row["median"] - 1
+        # Small absolute differences are timer noise, whatever the ratio
+        regressed = change > threshold and new_row["median"] - old_row["median"] > min_delta
+        mark = "  REGRESSION" if regressed else "  improved" if change < -threshold else ""
+        print(f"{name:<20} {old_row['median']:>10.4f} {new_row['median']:>10.4f} {change:>+8.1%}{mark}")
+        if regressed:
+            regressions.append(name)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--only", type=lambda s: s.split(","), default=None,
+                        help=f"comma-separated cases: {', '.join(CASES)}")
+    parser.add_argument("--repeat", type=int, default=5, help="timed runs per case (after one warm-up run)")
+    parser.add_argument("--pages", type=int, default=20, help="pages of the synthetic report")
+    parser.add_argument("--reports", type=int, default=2000, help="reports for flag_abnormalities")
+    parser.add_argument("--corpus-pages", type=int, default=200, help="textbook pages for chunking and embedding")
+    parser.add_argument("--chunks", type=int, default=20000, help="vectors in the FAISS cases")
+    parser.add_argument("--embed-chunks", type=int, default=512, help="chunks per embedding run")
+    parser.add_argument("--embeddings", choices=["model", "hash"], default="model",
+                        help="the real embedding model, or a hashing stand-in that needs no download")
+    parser.add_argument("--dim", type=int, default=384)
+    parser.add_argument("--index", default="flat", help="index type for the FAISS cases")
+    parser.add_argument("--queries", type=int, default=500)
+    parser.add_argument("--turns", type=int, default=100, help="chat turns for the export cases")
+    parser.add_argument("--llm-latency", type=float, default=0.0, help="seconds the stubbed LLM takes per call")
+    parser.add_argument("--json", default=None, help="write results to this file")
+    parser.add_argument("--compare", nargs=2, metavar=("BASE", "NEW"), help="compare two --json results")
+    parser.add_argument("--threshold", type=float, default=0.10, help="median slowdown that counts as a regression")
+    parser.add_argument("--min-delta", type=float, default=0.001, help="ignore slowdowns smaller than this many seconds")
+    args = parser.parse_args()
+
+    if args.compare:
+        regressions = compare(*args.compare, args.threshold, args.min_delta)
+        for name in regressions:
+            print(f"REGRESSED: {name}")
+        sys.exit(1 if regressions else 0)
+
+    unknown = set(args.only or []) - set(CASES)
+    if unknown:
+        parser.error(f"unknown case(s): {', '.join(sorted(unknown))}")
+    results = run_cases(args)
+    if args.json:
+        sizes = {key: getattr(args, key) for key in ("pages", "reports", "corpus_pages", "chunks", "embed_chunks",
+                                                     "embeddings", "dim", "index", "queries", "turns", "llm_latency")}
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"commit": git_commit(), "python": platform.python_version(), "machine": platform.machine(),
+                       "cpus": os.cpu_count(), "repeat": args.repeat, "sizes": sizes, "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,144 @@
+"""Recall/latency/size tradeoff of the FAISS index families in vector_index.py.
+
+    python -m benchmarks.bench_index --db vectorstore/db_faiss
+    python -m benchmarks.bench_index --synthetic 100000 --nprobe 1,8,32 --ef-search 32,64,128
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import faiss
+import numpy as np
+
+from vector_index import INDEX_TYPES, index_config, build_index, flat_vectors, is_exact, set_search_params
+from vector_store import current_build
+
+
+# Loaded in a fresh interpreter so the allocator's leftovers from earlier builds don't hide the cost
+RSS_PROBE = """
+import os, sys, faiss
+def rss():
+    with open("/proc/self/statm") as f:
+        return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+before = rss()
+index = faiss.read_index(sys.argv[1])
+print(rss() - before)
+"""
+
+
+def synthetic_vectors(count, dim, seed=0):
+    # Clustered unit vectors: closer to real sentence embeddings than uniform noise
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((max(1, count // 200), dim)).astype(np.float32)
+    vectors = centers[rng.integers(0, len(centers), count)] + 0.3 * rng.standard_normal((count, dim)).astype(np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def corpus_vectors(db_path):
+    index = faiss.read_index(os.path.join(current_build(db_path), "index.faiss"))
+    if is_exact(index):
+        return flat_vectors(index)
+    # Quantized indexes only hold approximations; get exact vectors back from the embedding cache
+    from embedding_model import get_embedding_model
+    from memory_creation import restore_flat_index
+    from vector_store import load_langchain_store
+
+    db = load_langchain_store(db_path, get_embedding_model())
+    restore_flat_index(db, get_embedding_model())
+    return db.index.reconstruct_n(0, db.index.ntotal)
+
+
+def make_queries(vectors, count, seed=1):
+    rng = np.random.default_rng(seed)
+    picked = vectors[rng.integers(0, len(vectors), count)]
+    queries = picked + 0.05 * rng.standard_normal(picked.shape).astype(np.float32)
+    return np.ascontiguousarray(queries / np.linalg.norm(queries, axis=1, keepdims=True), dtype=np.float32)
+
+
+def measure(index, queries, truth, k):
+    latencies = []
+    found = np.empty((len(queries), k), dtype=np.int64)
+    for i in range(len(queries)):
+        started = time.perf_counter()
+        _, ids = index.search(queries[i:i + 1], k)
+        latencies.append(time.perf_counter() - started)
+        found[i] = ids[0]
+    recall = np.mean([len(set(found[i]) & set(truth[i])) / k for i in range(len(queries))])
+    latencies = np.array(latencies) * 1000
+    return {"recall": float(recall), "p50_ms": float(np.percentile(latencies, 50)),
+            "p99_ms": float(np.percentile(latencies, 99))}
+
+
+def index_sizes(index):
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "index.faiss")
+        faiss.write_index(index, path)
+        probe = subprocess.run([sys.executable, "-c", RSS_PROBE, path], capture_output=True, text=True, check=True)
+        return os.path.getsize(path), int(probe.stdout.strip())
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--db", default=None, help="FAISS store to take the corpus vectors from")
+    parser.add_argument("--synthetic", type=int, default=50000, help="synthetic corpus size when --db is not given")
+    parser.add_argument("--dim", type=int, default=384, help="synthetic vector dimension (all-MiniLM-L6-v2: 384)")
+    parser.add_argument("--queries", type=int, default=500)
+    parser.add_argument("--k", type=int, default=3, help="k used by medibot.get_similar_docs")
+    parser.add_argument("--types", default=",".join(INDEX_TYPES))
+    parser.add_argument("--nprobe", default="8", help="comma-separated nprobe values for IVF families")
+    parser.add_argument("--ef-search", default="64", help="comma-separated efSearch values for HNSW")
+    parser.add_argument("--threads", type=int, default=1, help="FAISS threads (1 = per-query latency)")
+    parser.add_argument("--json", default=None, help="write results to this file")
+    args = parser.parse_args()
+
+    faiss.omp_set_num_threads(args.threads)
+    vectors = corpus_vectors(args.db) if args.db else synthetic_vectors(args.synthetic, args.dim)
+    vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+    queries = make_queries(vectors, args.queries)
+    print(f"Corpus: {len(vectors)} vectors x {vectors.shape[1]} dims, {len(queries)} queries, k={args.k}")
+
+    flat = build_index(vectors, index_config("flat"))
+    _, truth = flat.search(queries, args.k)
+
+    results = []
+    header = f"{'index':<10} {'param':<14} {'recall@k':>8} {'p50 ms':>8} {'p99 ms':>8} {'disk MB':>8} {'RAM MB':>8} {'build s':>8}"
+    print(header)
+    print("-" * len(header))
+    for index_type in args.types.split(","):
+        if index_type in ("ivf", "ivfpq", "ivfsq8", "ivfsq16"):
+            sweep = [("nprobe", int(v)) for v in args.nprobe.split(",")]
+        elif index_type == "hnsw":
+            sweep = [("ef_search", int(v)) for v in args.ef_search.split(",")]
+        else:
+            sweep = [(None, None)]
+
+        started = time.perf_counter()
+        try:
+            index = build_index(vectors, index_config(index_type))
+        except ValueError as e:
+            print(f"{index_type:<10} skipped: {e}")
+            continue
+        build_s = time.perf_counter() - started
+        disk, ram = index_sizes(index)
+
+        for name, value in sweep:
+            if name:
+                set_search_params(index, index_config(index_type, **{name: value}))
+            row = {"index": index_type, "param": f"{name}={value}" if name else "-",
+                   **measure(index, queries, truth, args.k),
+                   "disk_mb": disk / 1e6, "ram_mb": ram / 1e6, "build_s": build_s}
+            results.append(row)
+            print(f"{row['index']:<10} {row['param']:<14} {row['recall']:>8.3f} {row['p50_ms']:>8.3f} "
+                  f"{row['p99_ms']:>8.3f} {row['disk_mb']:>8.1f} {row['ram_mb']:>8.1f} {row['build_s']:>8.1f}")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"corpus": len(vectors), "k": args.k, "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,145 @@
+"""Throughput and recall of lab_parser over synthetic lab reports, against the old per-test regex loop.
+
+    python -m benchmarks.bench_lab_parser
+    python -m benchmarks.bench_lab_parser --reports 20000 --filler 40 --json lab_parser.json
+"""
+import argparse
+import json
+import random
+import re
+import time
+
+from lab_parser import LAB_TESTS, NORMAL_RANGES, flag_abnormalities, parse_lab_values
+
+
+UNITS = {
+    "Hemoglobin": "g/dL", "Hematocrit (PCV)": "%", "RBC Count": "mill/cumm", "MCV": "fL", "MCH": "pg",
+    "MCHC": "g/dL", "RBC Distribution Width - CV": "%", "Total Leukocyte Count": "cells/cumm",
+    "Neutrophils": "%", "Lymphocytes": "%", "Eosinophils": "%", "Monocytes": "%", "Basophils": "%",
+    "Platelet Count": "/cumm", "Mean Platelet Volume (MPV)": "fL", "PCT": "%",
+    "Absolute Neutrophil Count": "/cumm", "Absolute Lymphocyte Count": "/cumm", "Absolute Eosinophil Count": "/cumm",
+    "Absolute Monocyte Count": "/cumm", "Absolute Basophil Count": "/cumm",
+}
+FILLER = ["Patient Name: John Doe   Age/Sex: 45 Y / M", "Sample collected on 12/03/2024 09:15",
+          "Method: Automated cell counter", "Interpretation: Clinical correlation is advised.",
+          "This is an electronically authenticated report.", "Referred by: Dr. A. Kumar, MBBS"]
+
+
+LEGACY_FLAG = re.compile(r"\s*(?P<test>.+) is (?:low|high) \((?P<value>[\d.]+)\)")
+
+
+def legacy_flag_abnormalities(text):
+    # hack.flag_abnormalities as it was before lab_parser
+    highlights = []
+    for key, (low, high) in NORMAL_RANGES.items():
+        if key.lower() in text.lower():
+            try:
+                pattern = rf"{key}\s+(\d+\.?\d*)"
+                for match in re.findall(pattern, text, re.IGNORECASE):
+                    val = float(match)
+                    if val < low:
+                        highlights.append(f" {key} is low ({val})")
+                    elif val > high:
+                        highlights.append(f"{key} is high ({val})")
+            except Exception:
+                continue
+    return highlights
+
+
+def format_row(rng, alias, value, unit, low, high):
+    # Layouts seen in real report text: inline, pipe tables, and PyMuPDF's one-cell-per-line tables
+    layout = rng.randrange(4)
+    if layout == 0:
+        return f"{alias}    {value:g}    {unit}    {low:g} - {high:g}"
+    if layout == 1:
+        return f"{alias} | {value:g} | {unit} | {low:g} - {high:g}"
+    if layout == 2:
+        return f"{alias}\n{value:g}\n{unit}\n{low:g}-{high:g}"
+    return f"{alias}: {value:g} {unit}"
+
+
+def synthetic_reports(count, filler, seed=0):
+    # Returns (text, {test: value}) pairs with the planted values
+    rng = random.Random(seed)
+    reports = []
+    for _ in range(count):
+        lines = [rng.choice(FILLER) for _ in range(filler // 2)]
+        planted = {}
+        for test, ((low, high), aliases) in LAB_TESTS.items():
+            if rng.random() < 0.2:
+                continue
+            span = high - low
+            decimals = 0 if high >= 1000 else 2 if high < 10 else 1
+            value = round(rng.uniform(low - 0.3 * span, high + 0.3 * span), decimals)
+            value = max(value, 0.0)
+            planted[test] = value
+            lines.append(format_row(rng, rng.choice(aliases), value, UNITS[test], low, high))
+        lines += [rng.choice(FILLER) for _ in range(filler - filler // 2)]
+        reports.append(("\n".join(lines), planted))
+    return reports
+
+
+def run(name, parse, reports):
+    started = time.perf_counter()
+    outputs = [parse(text) for text, _ in reports]
+    elapsed = time.perf_counter() - started
+    megabytes = sum(len(text) for text, _ in reports) / 1e6
+    return {"parser": name, "seconds": elapsed, "reports_per_s": len(reports) / elapsed,
+            "mb_per_s": megabytes / elapsed}, outputs
+
+
+def found_values(results):
+    # (test, value) pairs from either parser's output
+    if results and isinstance(results[0], str):
+        matches = (LEGACY_FLAG.match(line) for line in results)
+        return {(m.group("test"), round(float(m.group("value")), 2)) for m in matches if m}
+    return {(r.test, round(r.value, 2)) for r in results}
+
+
+def recall(reports, outputs, abnormal_only=False):
+    found = planted = 0
+    for (_, values), results in zip(reports, outputs):
+        parsed = found_values(results)
+        for test, value in values.items():
+            low, high = NORMAL_RANGES[test]
+            if abnormal_only and low <= value <= high:
+                continue
+            planted += 1
+            found += (test, round(value, 2)) in parsed
+    return found / planted if planted else 1.0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--reports", type=int, default=5000)
+    parser.add_argument("--filler", type=int, default=20, help="non-result lines per report")
+    parser.add_argument("--json", default=None, help="write results to this file")
+    args = parser.parse_args()
+
+    reports = synthetic_reports(args.reports, args.filler)
+    print(f"{len(reports)} reports, {sum(len(t) for t, _ in reports) / 1e6:.1f} MB")
+
+    # recall: share of planted values returned; flagged: share of planted out-of-range values flagged
+    results = []
+    row, outputs = run("parse", parse_lab_values, reports)
+    row["recall"] = recall(reports, outputs)
+    results.append(row)
+    for name, parse in [("flag", flag_abnormalities), ("legacy-flag", legacy_flag_abnormalities)]:
+        row, outputs = run(name, parse, reports)
+        row["flagged"] = recall(reports, outputs, abnormal_only=True)
+        results.append(row)
+
+    header = f"{'parser':<12} {'seconds':>8} {'reports/s':>10} {'MB/s':>8} {'recall':>8} {'flagged':>8}"
+    print(header)
+    print("-" * len(header))
+    for row in results:
+        scores = " ".join(f"{row[key]:>8.3f}" if key in row else f"{'-':>8}" for key in ("recall", "flagged"))
+        print(f"{row['parser']:<12} {row['seconds']:>8.2f} {row['reports_per_s']:>10.0f} {row['mb_per_s']:>8.2f} {scores}")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"reports": len(reports), "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,202 @@
+"""OCR throughput and accuracy on scanned lab reports: the old per-page pytesseract call against ocr_engine
+(Tesseract kept loaded through tesserocr, NumPy preprocessing, per-page DPI and page segmentation mode).
+
+    python -m benchmarks.bench_ocr
+    python -m benchmarks.bench_ocr --pages 20 --skew 3 --json ocr.json
+    python -m benchmarks.bench_ocr --samples scans/
+
+--samples takes a directory of scanned PDFs, each with a .txt of the same name holding its true text
+(pages separated by form feeds). Without it, lab reports from bench_lab_parser are printed, skewed,
+shaded and speckled like a phone or flatbed scan. Character accuracy is 1 - edit distance / true length,
+with whitespace collapsed; lab-value recall is the share of planted values lab_parser finds (synthetic only).
+"""
+import argparse
+import glob
+import importlib.util
+import io
+import json
+import os
+import random
+import re
+import shutil
+import tempfile
+import time
+
+import numpy as np
+
+from benchmarks.bench_lab_parser import recall, synthetic_reports
+from lab_parser import parse_lab_values
+from report_extraction import OCR_DPI, PAGE_BREAK, render_page
+
+
+WHITESPACE = re.compile(r"\s+")
+
+
+# Samples
+
+def scanned_reports(pages, scan_dpi=150, skew=2.5, noise=12.0, seed=0):
+    # (pdf bytes, true text per page, planted values per page): one synthetic lab report per page
+    import fitz
+    from PIL import Image
+
+    rng = random.Random(seed)
+    noise_rng = np.random.default_rng(seed)
+    reports = synthetic_reports(pages, filler=10, seed=seed)
+    printed = fitz.open()
+    scans = fitz.open()
+    for text, _ in reports:
+        page = printed.new_page()
+        page.insert_textbox(fitz.Rect(40, 40, page.rect.width - 40, page.rect.height - 40), text, fontsize=9)
+        pixmap = page.get_pixmap(dpi=scan_dpi, colorspace=fitz.csGRAY)
+        gray = np.frombuffer(pixmap.samples, dtype=np.uint8).reshape(pixmap.height, pixmap.stride)[:, :pixmap.width]
+        image = Image.fromarray(gray).rotate(rng.uniform(-skew, skew), resample=Image.BILINEAR, fillcolor=255)
+        pixels = np.asarray(image, dtype=np.float32)
+        # Light falling off towards one side, and sensor noise
+        shading = np.linspace(1.0, rng.uniform(0.55, 0.8), pixels.shape[1], dtype=np.float32)
+        pixels = pixels * shading[None, :] + noise_rng.normal(0.0, noise, pixels.shape).astype(np.float32)
+        png = io.BytesIO()
+        Image.fromarray(np.clip(pixels, 0, 255).astype(np.uint8)).save(png, format="PNG")
+        scans.new_page(width=page.rect.width, height=page.rect.height).insert_image(page.rect, stream=png.getvalue())
+    return scans.tobytes(), [text for text, _ in reports], [values for _, values in reports]
+
+
+def load_samples(directory):
+    samples = []
+    for pdf_path in sorted(glob.glob(os.path.join(directory, "*.pdf"))):
+        truth_path = os.path.splitext(pdf_path)[0] + ".txt"
+        if not os.path.exists(truth_path):
+            print(f"skipping {pdf_path}: no {os.path.basename(truth_path)}")
+            continue
+        with open(pdf_path, "rb") as f:
+            pdf = f.read()
+        with open(truth_path, encoding="utf-8") as f:
+            truths = f.read().split(PAGE_BREAK)
+        samples.append((pdf, truths, None))
+    return samples
+
+
+# Scoring
+
+def edit_distance(a, b):
+    # Levenshtein distance, one NumPy row per character of `a`
+    if not a or not b:
+        return max(len(a), len(b))
+    target = np.frombuffer(b.encode("utf-32-le"), dtype=np.uint32)
+    columns = np.arange(len(b) + 1)
+    row = columns.copy()
+    for i, char in enumerate(a, 1):
+        substitute = row[:-1] + (target != ord(char))
+        current = np.empty_like(row)
+        current[0] = i
+        current[1:] = np.minimum(row[1:] + 1, substitute)
+        # Insertions: current[j] = min over k <= j of current[k] + (j - k)
+        row = np.minimum.accumulate(current - columns) + columns
+    return int(row[-1])
+
+
+def char_accuracy(text, truth):
+    text, truth = WHITESPACE.sub(" ", text).strip(), WHITESPACE.sub(" ", truth).strip()
+    return max(0.0, 1.0 - edit_distance(text, truth) / max(len(truth), 1))
+
+
+# Methods: (path, page number) -> text
+
+def legacy_ocr_page(path, page_number):
+    # report_extraction.ocr_page as it was: a tesseract process per page, default settings
+    import pytesseract
+
+    return pytesseract.image_to_string(render_page(path, page_number, OCR_DPI, "fitz"))
+
+
+def engine_method(engine, preprocess):
+    import ocr_engine
+
+    def ocr_page(path, page_number):
+        return ocr_engine.recognize(lambda dpi: render_page(path, page_number, dpi, "fitz"), OCR_DPI, engine, preprocess)
+    return ocr_page
+
+
+def available_methods():
+    methods = {}
+    if shutil.which("tesseract"):
+        methods["pytesseract"] = legacy_ocr_page
+        methods["pytesseract+prep"] = engine_method("pytesseract", True)
+    if importlib.util.find_spec("tesserocr"):
+        methods["tesserocr"] = engine_method("tesserocr", False)
+        methods["tesserocr+prep"] = engine_method("tesserocr", True)
+    return methods
+
+
+def run(name, ocr_page, documents):
+    # documents: (path, truths, planted). One page first, untimed: tesserocr loads its engine once per worker.
+    ocr_page(documents[0][0], 0)
+    texts, accuracies, reports = [], [], []
+    pages = 0
+    started = time.perf_counter()
+    for path, truths, _ in documents:
+        texts.append([ocr_page(path, i) for i in range(len(truths))])
+        pages += len(truths)
+    elapsed = time.perf_counter() - started
+    for (_, truths, planted), document_texts in zip(documents, texts):
+        accuracies += [char_accuracy(text, truth) for text, truth in zip(document_texts, truths)]
+        if planted is not None:
+            reports += [(text, values) for text, values in zip(document_texts, planted)]
+    row = {"method": name, "pages": pages, "seconds": elapsed, "pages_per_s": pages / elapsed,
+           "char_accuracy": float(np.mean(accuracies))}
+    if reports:
+        row["value_recall"] = recall(reports, [parse_lab_values(text) for text, _ in reports])
+    return row
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--samples", default=None, help="directory of scanned PDFs with .txt ground truth")
+    parser.add_argument("--pages", type=int, default=10, help="synthetic scanned pages")
+    parser.add_argument("--scan-dpi", type=int, default=150, help="resolution of the synthetic scans")
+    parser.add_argument("--skew", type=float, default=2.5, help="largest synthetic page rotation, in degrees")
+    parser.add_argument("--noise", type=float, default=12.0, help="synthetic sensor noise (grey levels)")
+    parser.add_argument("--only", type=lambda s: s.split(","), default=None, help="comma-separated methods")
+    parser.add_argument("--json", default=None, help="write results to this file")
+    args = parser.parse_args()
+
+    methods = available_methods()
+    if args.only:
+        methods = {name: method for name, method in methods.items() if name in args.only}
+    if not methods:
+        parser.error("neither the tesseract binary nor tesserocr is installed")
+
+    if args.samples:
+        samples = load_samples(args.samples)
+    else:
+        samples = [scanned_reports(args.pages, args.scan_dpi, args.skew, args.noise)]
+    if not samples:
+        parser.error(f"no PDF with ground truth in {args.samples}")
+
+    documents = []
+    try:
+        for pdf, truths, planted in samples:
+            with tempfile.NamedTemporaryFile(suffix=".pdf", delete=False) as f:
+                f.write(pdf)
+            documents.append((f.name, truths, planted))
+        print(f"{sum(len(truths) for _, truths, _ in documents)} pages in {len(documents)} document(s)")
+        results = [run(name, method, documents) for name, method in methods.items()]
+    finally:
+        for path, _, _ in documents:
+            os.remove(path)
+
+    header = f"{'method':<18} {'pages':>6} {'seconds':>8} {'pages/s':>8} {'chars':>7} {'values':>7}"
+    print(header)
+    print("-" * len(header))
+    for row in results:
+        values = f"{row['value_recall']:>7.3f}" if "value_recall" in row else f"{'-':>7}"
+        print(f"{row['method']:<18} {row['pages']:>6} {row['seconds']:>8.2f} {row['pages_per_s']:>8.2f} "
+              f"{row['char_accuracy']:>7.3f} {values}")
+
+    if args.json:
+        settings = {key: getattr(args, key) for key in ("samples", "pages", "scan_dpi", "skew", "noise")}
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"settings": settings, "ocr_dpi": OCR_DPI, "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
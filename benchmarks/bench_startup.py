@@ -0,0 +1,137 @@
+"""Import time of the app modules and time-to-first-answer, cold and after the background warm-up.
+
+    python -m benchmarks.bench_startup --db vectorstore/db_faiss
+    python -m benchmarks.bench_startup --synthetic 20000 --import-budget 1.5 --answer-budget 0.5
+
+Exits with status 1 when a measurement is over its budget.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import types
+
+
+# Each measurement runs in a fresh interpreter, so nothing is already imported or loaded
+IMPORT_PROBE = """
+import sys, time
+started = time.perf_counter()
+for module in sys.argv[1].split(","):
+    __import__(module)
+print(time.perf_counter() - started)
+"""
+
+ANSWER_PROBE = """
+import json, sys, time, uuid
+db, warm, think, llm = sys.argv[1], sys.argv[2] == "1", float(sys.argv[3]), sys.argv[4]
+import clients
+
+if warm:
+    clients.start_warmup()
+    time.sleep(think)  # the user reading the home page
+# A question the embedding cache has never seen
+question = f"What are the symptoms of anemia? {uuid.uuid4().hex}"
+started = time.perf_counter()
+store = clients.get_vector_store(db)
+embedding = store.embeddings.embed_query(question)
+docs = store.similarity_search_by_vector(embedding, k=3)
+retrieved = time.perf_counter() - started
+if llm == "real":
+    context = "\\n\\n".join(doc.page_content for doc in docs)
+    messages = [{"role": "system", "content": context}, {"role": "user", "content": question}]
+    next(iter(clients.get_router().stream(messages)))
+print(json.dumps({"retrieval": retrieved, "first_answer": time.perf_counter() - started,
+                  "warmup": clients.warmup_timings}))
+"""
+
+# Each on its own (including its dependencies), then both pages together: what the budget applies to
+MODULES = ["streamlit", "clients", "report_analysis", "hack", "medibot", "hack,medibot"]
+
+
+def synthetic_store(path, count, dim=384, seed=0):
+    # Random vectors in the real on-disk layout; the embedding model still loads for real
+    import faiss
+    import numpy as np
+
+    from vector_store import save_store
+
+    rng = np.random.default_rng(seed)
+    vectors = rng.standard_normal((count, dim)).astype(np.float32)
+    index = faiss.IndexFlatL2(dim)
+    index.add(vectors)
+    docs = {str(i): types.SimpleNamespace(page_content=f"Synthetic chunk {i}", metadata={}) for i in range(count)}
+    db = types.SimpleNamespace(index=index, index_to_docstore_id={i: str(i) for i in range(count)},
+                               docstore=types.SimpleNamespace(search=docs.get))
+    save_store(db, path)
+
+
+def run_probe(code, *args):
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join([os.getcwd(), os.environ.get("PYTHONPATH", "")]))
+    result = subprocess.run([sys.executable, "-c", code, *map(str, args)], capture_output=True, text=True, env=env)
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.strip().splitlines()[-1] if result.stderr.strip() else "probe failed")
+    return result.stdout.strip().splitlines()[-1]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--db", default="vectorstore/db_faiss", help="FAISS store the chatbot serves")
+    parser.add_argument("--synthetic", type=int, default=None, help="use a synthetic store of this many chunks instead")
+    parser.add_argument("--think-time", type=float, default=5.0,
+                        help="seconds between app start and the first question in the warm run")
+    parser.add_argument("--llm", choices=["none", "real"], default="none",
+                        help="also wait for the first LLM token (needs API keys)")
+    parser.add_argument("--import-budget", type=float, default=2.0, help="max seconds to import hack + medibot")
+    parser.add_argument("--answer-budget", type=float, default=1.0, help="max warm time-to-first-answer in seconds")
+    parser.add_argument("--json", default=None, help="write results to this file")
+    args = parser.parse_args()
+
+    results = {"imports": {}, "answer": {}}
+    print(f"{'module':<16} {'import s':>9}")
+    for module in MODULES:
+        try:
+            results["imports"][module] = float(run_probe(IMPORT_PROBE, module))
+            print(f"{module:<16} {results['imports'][module]:>9.2f}")
+        except RuntimeError as e:
+            print(f"{module:<16} failed: {e}")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db = args.db
+        if args.synthetic:
+            db = os.path.join(tmp, "db_faiss")
+            synthetic_store(db, args.synthetic)
+        for name, warm in (("cold", False), ("warm", True)):
+            try:
+                results["answer"][name] = json.loads(run_probe(ANSWER_PROBE, db, int(warm), args.think_time, args.llm))
+            except RuntimeError as e:
+                print(f"{name} first answer failed: {e}")
+                continue
+            row = results["answer"][name]
+            print(f"{name}: retrieval {row['retrieval']:.2f}s, first answer {row['first_answer']:.2f}s")
+        if "warm" in results["answer"]:
+            print("warm-up: " + ", ".join(f"{k} {v:.2f}s" for k, v in results["answer"]["warm"]["warmup"].items()))
+
+    failures = []
+    app_import = results["imports"].get("hack,medibot")
+    if app_import is None:
+        failures.append("import of hack + medibot failed")
+    elif app_import > args.import_budget:
+        failures.append(f"import of hack + medibot took {app_import:.2f}s (budget {args.import_budget:.2f}s)")
+    warm_answer = results["answer"].get("warm", {}).get("first_answer")
+    if warm_answer is None:
+        failures.append("no warm time-to-first-answer measured")
+    elif warm_answer > args.answer_budget:
+        failures.append(f"warm time-to-first-answer {warm_answer:.2f}s (budget {args.answer_budget:.2f}s)")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({**results, "failures": failures}, f, indent=2)
+    for failure in failures:
+        print(f"OVER BUDGET: {failure}")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,172 @@
+import json
+import unicodedata
+from datetime import datetime
+from io import BytesIO
+
+from metrics import span
+
+
+TITLE = "RAG Medical Chatbot – Conversation History"
+
+# name: (file extension, MIME type)
+EXPORT_FORMATS = {
+    "PDF": ("pdf", "application/pdf"),
+    "Markdown": ("md", "text/markdown"),
+    "JSON": ("json", "application/json"),
+}
+
+PAGE_MARGIN = 40
+BODY_FONT = ("Helvetica", 11)
+QUESTION_FONT = ("Helvetica-Bold", 11)
+LINE_HEIGHT = 16
+
+
+def pdf_safe(text):
+    # The standard PDF fonts only cover WinAnsi (cp1252): keep what they can draw, decompose accented
+    # letters they can't, and drop emoji and other symbols that would come out as black boxes
+    kept = []
+    dropped = False
+    for char in text:
+        if dropped and char == " " and (not kept or kept[-1].endswith((" ", "\n"))):
+            # Don't leave a double space where a dropped emoji was
+            continue
+        dropped = False
+        try:
+            char.encode("cp1252")
+            kept.append(char)
+            continue
+        except UnicodeEncodeError:
+            pass
+        decomposed = "".join(c for c in unicodedata.normalize("NFKD", char) if not unicodedata.combining(c))
+        try:
+            decomposed.encode("cp1252")
+            kept.append(decomposed)
+        except UnicodeEncodeError:
+            if unicodedata.category(char).startswith(("S", "C", "M")) or char == "\u200d":
+                dropped = True
+            else:
+                kept.append("?")
+    return "".join(kept)
+
+
+def wrap_line(text, font, max_width):
+    # Word wrap by rendered width; words wider than a whole line are broken by character
+    from reportlab.pdfbase.pdfmetrics import stringWidth
+
+    name, size = font
+    lines = []
+    line = ""
+    for word in text.split(" "):
+        candidate = f"{line} {word}" if line else word
+        if stringWidth(candidate, name, size) <= max_width:
+            line = candidate
+            continue
+        if line:
+            lines.append(line)
+        line = ""
+        while stringWidth(word, name, size) > max_width:
+            cut = len(word) - 1
+            while cut > 1 and stringWidth(word[:cut], name, size) > max_width:
+                cut -= 1
+            lines.append(word[:cut])
+            word = word[cut:]
+        line = word
+    lines.append(line)
+    return lines
+
+
+class PdfLayout:
+    # Lines already positioned on pages; adding a turn continues from where the last one ended
+
+    def __init__(self, page_size):
+        self.width, self.height = page_size
+        self.text_width = self.width - 2 * PAGE_MARGIN - 20
+        self.ops = []  # (page, font, x, y, text)
+        self.page = 0
+        # Title and export date are drawn at render time, above the first turn
+        self.y = self.height - PAGE_MARGIN - 50
+
+    def _place(self, font, x, text, before=0):
+        self.y -= before
+        if self.y < PAGE_MARGIN + 30:
+            self.page += 1
+            self.y = self.height - PAGE_MARGIN
+        self.ops.append((self.page, font, x, self.y, text))
+        self.y -= LINE_HEIGHT
+
+    def add_turn(self, number, question, answer):
+        for i, line in enumerate(wrap_line(pdf_safe(f"Q{number}: {question}"), QUESTION_FONT, self.text_width)):
+            self._place(QUESTION_FONT, PAGE_MARGIN, line, before=4 if i == 0 and number > 1 else 0)
+        for paragraph in pdf_safe(answer).split("\n"):
+            for line in wrap_line(paragraph, BODY_FONT, self.text_width):
+                self._place(BODY_FONT, PAGE_MARGIN + 20, line)
+        self.y -= 14
+
+    def render(self, exported_at):
+        from reportlab.pdfgen import canvas
+
+        buffer = BytesIO()
+        c = canvas.Canvas(buffer, pagesize=(self.width, self.height))
+        y = self.height - PAGE_MARGIN
+        c.setFont("Helvetica-Bold", 14)
+        c.drawString(PAGE_MARGIN, y, pdf_safe(TITLE))
+        c.setFont("Helvetica", 10)
+        c.drawString(PAGE_MARGIN, y - 20, f"Exported on: {exported_at}")
+        page = 0
+        for op_page, (name, size), x, y, text in self.ops:
+            while page < op_page:
+                self._footer(c, page)
+                c.showPage()
+                page += 1
+            c.setFont(name, size)
+            c.drawString(x, y, text)
+        self._footer(c, page)
+        c.save()
+        return buffer.getvalue()
+
+    def _footer(self, c, page):
+        c.setFont("Helvetica-Oblique", 8)
+        c.drawRightString(self.width - PAGE_MARGIN, PAGE_MARGIN / 2, f"Page {page + 1}")
+
+
+class ChatExport:
+    # Export of one chat, built only when asked for. Each format keeps what it has laid out so far,
+    # so a new export only processes the turns added since the last one; the output for a given
+    # history length is cached.
+
+    def __init__(self):
+        from reportlab.lib.pagesizes import letter
+
+        self.turns = 0
+        self.pdf = PdfLayout(letter)
+        self.markdown = [f"# {TITLE}\n"]
+        self.records = []
+        self.cache = {}
+
+    def sync(self, history):
+        if len(history) < self.turns:
+            # History was cleared or replaced: start over
+            self.__init__()
+        for number, (question, answer) in enumerate(history[self.turns:], self.turns + 1):
+            self.pdf.add_turn(number, question, answer)
+            self.markdown.append(f"\n## Q{number}: {question}\n\n{answer}\n")
+            self.records.append({"question": question, "answer": answer})
+        self.turns = len(history)
+
+    def export(self, history, export_format):
+        key = (export_format, len(history))
+        if key not in self.cache:
+            with span("chat_export"):
+                self.sync(history)
+                exported_at = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+                if export_format == "PDF":
+                    data = self.pdf.render(exported_at)
+                elif export_format == "Markdown":
+                    data = "".join(self.markdown[:1] + [f"\n_Exported on {exported_at}_\n"] + self.markdown[1:]).encode("utf-8")
+                else:
+                    data = json.dumps({"title": TITLE, "exported_at": exported_at, "turns": self.records},
+                                      ensure_ascii=False, indent=2).encode("utf-8")
+            # Only the latest version of each format is worth keeping
+            self.cache = {k: v for k, v in self.cache.items() if k[0] != export_format}
+            self.cache[key] = data
+        return self.cache[key]
@@ -0,0 +1,259 @@
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from collections import deque
+from functools import lru_cache
+
+from llm_scheduler import PRIORITY_SUMMARY
+from token_count import count_message_tokens
+
+
+logger = logging.getLogger(__name__)
+
+# Chat sessions (medibot.py, hack.py) persisted to SQLite. A session keeps only its last few turns in
+# memory; older ones are read back a page at a time when the user scrolls up. Turns that no longer
+# fit the prompt's history budget are folded into a running summary by the LLM, in the background.
+
+CHAT_DB_PATH = os.getenv("CHAT_DB_PATH", "cache/chat_sessions.sqlite")
+CHAT_WINDOW_TURNS = int(os.getenv("CHAT_WINDOW_TURNS", "10"))
+CHAT_PAGE_TURNS = int(os.getenv("CHAT_PAGE_TURNS", "10"))
+# Tokens of conversation (summary + recent turns) sent with each question
+HISTORY_TOKEN_BUDGET = int(os.getenv("HISTORY_TOKEN_BUDGET", "1500"))
+# Sessions untouched for this long are deleted
+CHAT_RETENTION_DAYS = float(os.getenv("CHAT_RETENTION_DAYS", "30"))
+
+FOLD_SYSTEM_PROMPT = "You keep a running summary of a conversation between a user and a medical assistant."
+FOLD_PROMPT = """
+Summary so far:
+{summary}
+
+Earlier turns to add to it:
+{turns}
+
+Rewrite the summary to include these turns. Keep the user's stated symptoms, conditions, medications,
+test values and open questions, and what the assistant already explained. Use at most 200 words.
+
+Updated summary:
+"""
+
+
+class ChatStore:
+    # Process-wide: every session of every page writes through one connection
+
+    def __init__(self, path=CHAT_DB_PATH, retention_days=CHAT_RETENTION_DAYS):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("CREATE TABLE IF NOT EXISTS sessions (id TEXT PRIMARY KEY, kind TEXT, turns INTEGER, "
+                        "summary TEXT, summarized INTEGER, updated REAL)")
+        self.db.execute("CREATE TABLE IF NOT EXISTS turns (session_id TEXT, position INTEGER, question TEXT, "
+                        "answer TEXT, PRIMARY KEY (session_id, position))")
+        cutoff = time.time() - retention_days * 86400
+        self.db.execute("DELETE FROM turns WHERE session_id IN (SELECT id FROM sessions WHERE updated < ?)", (cutoff,))
+        self.db.execute("DELETE FROM sessions WHERE updated < ?", (cutoff,))
+        self.db.commit()
+
+    def create(self, kind):
+        session_id = uuid.uuid4().hex
+        with self.lock:
+            self.db.execute("INSERT INTO sessions VALUES (?, ?, 0, '', 0, ?)", (session_id, kind, time.time()))
+            self.db.commit()
+        return session_id
+
+    def session(self, session_id):
+        # (kind, turns, summary, summarized) or None
+        with self.lock:
+            return self.db.execute("SELECT kind, turns, summary, summarized FROM sessions WHERE id = ?",
+                                   (session_id,)).fetchone()
+
+    def append(self, session_id, question, answer):
+        # Stores the turn after the session's last one and returns its position. The position is read
+        # in the same write transaction, so two tabs or replicas appending at once never overwrite a turn.
+        with self.lock:
+            self.db.execute("BEGIN IMMEDIATE")
+            try:
+                row = self.db.execute("SELECT turns FROM sessions WHERE id = ?", (session_id,)).fetchone()
+                if row is None:
+                    raise KeyError(f"chat session {session_id} no longer exists")
+                position = row[0]
+                self.db.execute("INSERT INTO turns VALUES (?, ?, ?, ?)", (session_id, position, question, answer))
+                self.db.execute("UPDATE sessions SET turns = ?, updated = ? WHERE id = ?", (position + 1, time.time(), session_id))
+                self.db.commit()
+            except Exception:
+                self.db.rollback()
+                raise
+        return position
+
+    def turns(self, session_id, start, stop):
+        with self.lock:
+            return self.db.execute("SELECT question, answer FROM turns WHERE session_id = ? AND position >= ? "
+                                   "AND position < ? ORDER BY position", (session_id, start, stop)).fetchall()
+
+    def set_summary(self, session_id, summary, summarized):
+        with self.lock:
+            self.db.execute("UPDATE sessions SET summary = ?, summarized = ? WHERE id = ?", (summary, summarized, session_id))
+            self.db.commit()
+
+    def delete(self, session_id):
+        with self.lock:
+            self.db.execute("DELETE FROM turns WHERE session_id = ?", (session_id,))
+            self.db.execute("DELETE FROM sessions WHERE id = ?", (session_id,))
+            self.db.commit()
+
+
+@lru_cache(maxsize=None)
+def get_chat_store():
+    return ChatStore()
+
+
+def turn_messages(turns):
+    messages = []
+    for question, answer in turns:
+        messages.append({"role": "user", "content": question})
+        messages.append({"role": "assistant", "content": answer})
+    return messages
+
+
+class ChatSession:
+    # Sequence of (question, answer) turns: len() and slicing work like the old history list,
+    # with only the newest CHAT_WINDOW_TURNS held in memory
+
+    def __init__(self, session_id, kind, store):
+        self.session_id = session_id
+        self.kind = kind
+        self.store = store
+        self.lock = threading.Lock()
+        self.folding = threading.Lock()
+        _, self.count, self.summary, self.summarized = store.session(session_id)
+        self.window = self._load_window()
+
+    def _load_window(self):
+        return deque(self.store.turns(self.session_id, max(self.count - CHAT_WINDOW_TURNS, 0), self.count),
+                     maxlen=CHAT_WINDOW_TURNS)
+
+    @classmethod
+    def open(cls, session_id=None, kind="chat", store=None):
+        # Resumes `session_id` when it exists (e.g. from the page URL), otherwise starts a new session
+        store = store or get_chat_store()
+        row = store.session(session_id) if session_id else None
+        if row is None or row[0] != kind:
+            session_id = store.create(kind)
+        return cls(session_id, kind, store)
+
+    def __len__(self):
+        return self.count
+
+    @property
+    def window_start(self):
+        return self.count - len(self.window)
+
+    def __getitem__(self, item):
+        if not isinstance(item, slice) or item.step not in (None, 1):
+            raise TypeError("ChatSession supports contiguous slices only")
+        start, stop, _ = item.indices(self.count)
+        if stop <= start:
+            return []
+        with self.lock:
+            window_start, window = self.window_start, list(self.window)
+        older = self.store.turns(self.session_id, start, min(stop, window_start)) if start < window_start else []
+        return [tuple(turn) for turn in older] + window[max(start - window_start, 0):max(stop - window_start, 0)]
+
+    def __iter__(self):
+        return iter(self[:])
+
+    def append(self, question, answer):
+        # The session id changes when the stored session was deleted meanwhile; pages keeping it in
+        # their URL update it afterwards
+        with self.lock:
+            try:
+                position = self.store.append(self.session_id, question, answer)
+            except KeyError:
+                # Cleared in another tab, or pruned after CHAT_RETENTION_DAYS: the turn starts a new session
+                logger.info("Chat %s no longer exists, continuing in a new session", self.session_id[:8])
+                self.session_id = self.store.create(self.kind)
+                self.window.clear()
+                self.count, self.summary, self.summarized = 0, "", 0
+                position = self.store.append(self.session_id, question, answer)
+            if position == self.count:
+                self.window.append((question, answer))
+                self.count += 1
+            else:
+                # Another tab or replica added turns to this session meanwhile
+                self.count = position + 1
+                self.window = self._load_window()
+
+    def older_turns(self, pages, page_turns=CHAT_PAGE_TURNS):
+        # The `pages` pages of turns just before the in-memory window: (first position, turns)
+        end = self.window_start
+        start = max(end - pages * page_turns, 0)
+        return start, self[start:end]
+
+    def context_messages(self, models, budget=HISTORY_TOKEN_BUDGET):
+        # Running summary, then as many of the newest not-yet-summarized turns as fit the budget
+        with self.lock:
+            summary, summarized = self.summary, self.summarized
+        messages = [{"role": "system", "content": f"Summary of the earlier conversation:\n{summary}"}] if summary else []
+        kept = []
+        for turn in reversed(self[summarized:]):
+            candidate = messages + turn_messages([turn] + kept)
+            if count_message_tokens(candidate, models) > budget:
+                break
+            kept.insert(0, turn)
+        return messages + turn_messages(kept)
+
+    def maybe_fold(self, router, budget=HISTORY_TOKEN_BUDGET):
+        # Folds older turns into the summary in a background thread once they no longer all fit
+        models = [p.model for p in router.providers]
+        with self.lock:
+            summary, summarized = self.summary, self.summarized
+        pending = self[summarized:]
+        if count_message_tokens(turn_messages(pending) + [{"role": "system", "content": summary}], models) <= budget:
+            return None
+        thread = threading.Thread(target=self.fold, args=(router, budget), name="chat-fold", daemon=True)
+        thread.start()
+        return thread
+
+    def fold(self, router, budget=HISTORY_TOKEN_BUDGET):
+        if not self.folding.acquire(blocking=False):
+            return  # Already folding; the next turn will check again
+        try:
+            models = [p.model for p in router.providers]
+            with self.lock:
+                session_id, summary, summarized = self.session_id, self.summary, self.summarized
+            pending = self[summarized:]
+            # Fold the oldest turns until what is left takes at most half the budget, so the
+            # summary isn't rewritten after every single turn
+            cut = 0
+            while cut < len(pending) and count_message_tokens(turn_messages(pending[cut:]), models) > budget // 2:
+                cut += 1
+            if not cut:
+                return
+            turns = "\n\n".join(f"User: {q}\nAssistant: {a}" for q, a in pending[:cut])
+            messages = [
+                {"role": "system", "content": FOLD_SYSTEM_PROMPT},
+                {"role": "user", "content": FOLD_PROMPT.format(summary=summary or "(none yet)", turns=turns)},
+            ]
+            new_summary = "".join(router.stream(messages, priority=PRIORITY_SUMMARY)).strip()
+            with self.lock:
+                if self.session_id != session_id:
+                    return  # Cleared meanwhile
+                self.summary, self.summarized = new_summary, summarized + cut
+                self.store.set_summary(session_id, new_summary, summarized + cut)
+            logger.info("Chat %s: folded %d turn(s) into the summary (%d summarized)", session_id[:8], cut, summarized + cut)
+        except Exception as e:
+            # The prompt stays within budget without it (oldest turns are left out); retried next turn
+            logger.warning("Chat %s: summarizing earlier turns failed: %s", self.session_id[:8], e)
+        finally:
+            self.folding.release()
+
+    def clear(self):
+        # Deletes the stored turns and continues as a new, empty session
+        self.store.delete(self.session_id)
+        with self.lock:
+            self.session_id = self.store.create(self.kind)
+            self.window.clear()
+            self.count, self.summary, self.summarized = 0, "", 0
@@ -0,0 +1,342 @@
+import hashlib
+import logging
+import math
+import os
+import re
+import zlib
+from collections import Counter, defaultdict
+from functools import lru_cache
+
+import numpy as np
+
+from embedding_model import EMBEDDING_MODEL_NAME
+
+
+logger = logging.getLogger(__name__)
+
+# Knowledge-base chunking (memory_creation.py):
+#  - running headers, footers, page numbers and copyright lines repeated across pages are stripped,
+#  - text is packed sentence by sentence up to a token budget counted with the embedding model's own
+#    tokenizer, and a new section heading always starts a new chunk,
+#  - exact and near-duplicate chunks (MinHash over word shingles) are dropped before embedding.
+
+# Part of the store manifest: bump when chunk boundaries change for the same text
+CHUNKER_VERSION = "sentence-tokens-2"
+# all-MiniLM-L6-v2 truncates input at 256 word pieces; stay under it with room for [CLS]/[SEP]
+CHUNK_TOKENS = int(os.getenv("CHUNK_TOKENS", "192"))
+# Trailing sentences (up to this many tokens) repeated at the start of the next chunk
+CHUNK_OVERLAP_TOKENS = int(os.getenv("CHUNK_OVERLAP_TOKENS", "32"))
+# Chunks shorter than this are figure labels, stray page numbers and the like
+MIN_CHUNK_TOKENS = int(os.getenv("MIN_CHUNK_TOKENS", "8"))
+# WordPiece averages about 4 characters per token on English prose
+FALLBACK_CHARS_PER_TOKEN = 4
+
+# A line in the first or last few lines of a page is boilerplate when the same line (digits ignored)
+# is at the edge of at least this share of the pages parsed together (and of at least 3 of them)
+BOILERPLATE_EDGE_LINES = 3
+BOILERPLATE_PAGE_SHARE = 0.3
+BOILERPLATE_MIN_PAGES = 3
+
+# Chunks whose estimated Jaccard similarity (over 5-word shingles) reaches this are near-duplicates
+NEAR_DUP_THRESHOLD = float(os.getenv("NEAR_DUP_THRESHOLD", "0.85"))
+SHINGLE_WORDS = 5
+MINHASH_PERMUTATIONS = 64
+MINHASH_BANDS = 16  # 4 rows per band: pairs from ~0.5 similarity up become candidates
+MINHASH_PRIME = (1 << 61) - 1
+
+PAGE_NUMBER = re.compile(r"^(?:page\s*)?(?:\d+|[ivxlcdm]+)(?:\s*(?:of|/)\s*\d+)?$", re.IGNORECASE)
+SENTENCE_END = re.compile(r"(?<=[.!?])[\"')\]]*\s+(?=[A-Z0-9\"'(\[])")
+HEADING_NUMBER = re.compile(r"^(?:chapter|section|part)\b|^\d+(?:\.\d+)*\s+\S", re.IGNORECASE)
+WORD = re.compile(r"\w+")
+
+
+def chunker_settings():
+    # Everything that changes which chunks get stored
+    return {"chunker": CHUNKER_VERSION, "chunk_tokens": CHUNK_TOKENS, "chunk_overlap_tokens": CHUNK_OVERLAP_TOKENS,
+            "min_chunk_tokens": MIN_CHUNK_TOKENS, "near_dup_threshold": NEAR_DUP_THRESHOLD}
+
+
+@lru_cache(maxsize=None)
+def get_tokenizer(model_name=EMBEDDING_MODEL_NAME):
+    # The embedding model's WordPiece tokenizer (tokenizer.json from the hub); None falls back to characters
+    try:
+        from tokenizers import Tokenizer
+
+        return Tokenizer.from_pretrained(model_name)
+    except Exception as e:
+        logger.warning("Could not load the %s tokenizer (%s); estimating tokens from characters", model_name, e)
+        return None
+
+
+def count_tokens(texts):
+    tokenizer = get_tokenizer()
+    if tokenizer is None:
+        return [math.ceil(len(text) / FALLBACK_CHARS_PER_TOKEN) for text in texts]
+    return [len(encoding.ids) for encoding in tokenizer.encode_batch(list(texts), add_special_tokens=False)]
+
+
+# Boilerplate
+
+def normalize_line(line):
+    return re.sub(r"\d+", "#", " ".join(line.lower().split()))
+
+
+def edge_lines(lines):
+    return lines[:BOILERPLATE_EDGE_LINES] + lines[-BOILERPLATE_EDGE_LINES:]
+
+
+def strip_boilerplate(pages):
+    # Returns the pages without their repeated edge lines, and how many lines were removed
+    page_lines = [[line for line in text.splitlines() if line.strip()] for text in pages]
+    seen = Counter()
+    for lines in page_lines:
+        seen.update({normalize_line(line) for line in edge_lines(lines)})
+    min_pages = max(BOILERPLATE_MIN_PAGES, math.ceil(BOILERPLATE_PAGE_SHARE * len(pages)))
+    repeated = {line for line, count in seen.items() if count >= min_pages}
+
+    cleaned, removed = [], 0
+    for lines in page_lines:
+        edges = set(range(min(BOILERPLATE_EDGE_LINES, len(lines)))) | set(range(max(len(lines) - BOILERPLATE_EDGE_LINES, 0), len(lines)))
+        kept = []
+        for i, line in enumerate(lines):
+            if i in edges and (normalize_line(line) in repeated or PAGE_NUMBER.match(line.strip())):
+                removed += 1
+                continue
+            kept.append(line)
+        cleaned.append("\n".join(kept))
+    return cleaned, removed
+
+
+# Sentence packing
+
+def is_heading(line):
+    words = line.split()
+    if not words or len(words) > 10 or len(line) > 80 or line.rstrip()[-1] in ".,;:":
+        return False
+    letters = [c for c in line if c.isalpha()]
+    return bool(HEADING_NUMBER.match(line)) or (len(letters) > 3 and all(c.isupper() for c in letters))
+
+
+def text_units(text):
+    # (sentence, starts a section) in order. PDF lines are re-joined, undoing end-of-line hyphenation.
+    units = []
+    paragraph = ""
+
+    def flush():
+        nonlocal paragraph
+        units.extend((sentence, False) for sentence in SENTENCE_END.split(paragraph.strip()) if sentence.strip())
+        paragraph = ""
+
+    for line in text.splitlines():
+        line = line.strip()
+        if not line:
+            continue
+        if is_heading(line):
+            flush()
+            units.append((line, True))
+        elif paragraph.endswith("-") and line[:1].islower():
+            paragraph = paragraph[:-1] + line
+        else:
+            paragraph = f"{paragraph} {line}" if paragraph else line
+    flush()
+    return units
+
+
+def split_long(sentence, tokens, max_tokens):
+    # A sentence over the budget (a table row run, a reference list) is cut into word windows, as
+    # (window, tokens); a window still over it (its words run longer than the average) is cut again
+    words = sentence.split()
+    per_window = max(1, int(len(words) * max_tokens / tokens))
+    windows = [" ".join(words[i:i + per_window]) for i in range(0, len(words), per_window)]
+    parts = []
+    for window, size in zip(windows, count_tokens(windows)):
+        if size > max_tokens and per_window > 1:
+            parts.extend(split_long(window, size, max_tokens))
+        else:
+            parts.append((window, size))
+    return parts
+
+
+def chunk_text(text, max_tokens=CHUNK_TOKENS, overlap_tokens=CHUNK_OVERLAP_TOKENS, min_tokens=MIN_CHUNK_TOKENS):
+    units = text_units(text)
+    if not units:
+        return []
+    sizes = count_tokens([sentence for sentence, _ in units])
+    pieces = []
+    for (sentence, heading), size in zip(units, sizes):
+        if size <= max_tokens:
+            pieces.append((sentence, heading, size))
+            continue
+        pieces.extend((part, heading and i == 0, part_size)
+                      for i, (part, part_size) in enumerate(split_long(sentence, size, max_tokens)))
+
+    chunks = []
+    current, size = [], 0
+
+    def close(carry_overlap):
+        nonlocal current, size
+        if current:
+            chunks.append((" ".join(piece for piece, _ in current), size))
+        carry, carried = [], 0
+        if carry_overlap:
+            for piece, piece_size in reversed(current):
+                if carried + piece_size > overlap_tokens:
+                    break
+                carry.insert(0, (piece, piece_size))
+                carried += piece_size
+        current, size = carry, carried
+
+    for piece, heading, piece_size in pieces:
+        if heading:
+            # Sections never share a chunk; the heading leads its section's first chunk
+            close(carry_overlap=False)
+        elif current and size + piece_size > max_tokens:
+            close(carry_overlap=True)
+            if current and size + piece_size > max_tokens:
+                current, size = [], 0
+        current.append((piece, piece_size))
+        size += piece_size
+    close(carry_overlap=False)
+    return [chunk for chunk, chunk_size in chunks if chunk_size >= min_tokens]
+
+
+# Deduplication
+
+def shingle_hashes(words):
+    if len(words) <= SHINGLE_WORDS:
+        shingles = [" ".join(words)]
+    else:
+        shingles = [" ".join(words[i:i + SHINGLE_WORDS]) for i in range(len(words) - SHINGLE_WORDS + 1)]
+    return np.fromiter((zlib.crc32(s.encode("utf-8")) for s in set(shingles)), dtype=np.uint64)
+
+
+class Deduplicator:
+    # Keeps the first of any set of exact or near-duplicate chunks. LSH bands bring candidate pairs
+    # together; a candidate counts only when its signatures agree on NEAR_DUP_THRESHOLD of the hashes.
+    # Signatures and band keys are saved next to the store (save/load), so an update only hashes its
+    # new chunks: saved chunks are looked up in per-band sorted arrays, this run's in a dict.
+
+    def __init__(self, threshold=NEAR_DUP_THRESHOLD, permutations=MINHASH_PERMUTATIONS, bands=MINHASH_BANDS, seed=1):
+        rng = np.random.default_rng(seed)
+        self.a = rng.integers(1, 1 << 32, size=(permutations, 1), dtype=np.uint64)
+        self.b = rng.integers(0, 1 << 32, size=(permutations, 1), dtype=np.uint64)
+        self.params = np.array([permutations, bands, seed, SHINGLE_WORDS], dtype=np.int64)
+        self.threshold = threshold
+        self.rows = permutations // bands
+        self.bands = bands
+        self.ids = []  # chunk ID per position; None once the chunk has left the store
+        self.keys = []  # hash of the chunk's words per position
+        self.exact = {}  # key -> position
+        # Positions below `loaded` come from save(): signatures in one array, band keys sorted per band
+        self.loaded = 0
+        self.loaded_signatures = np.zeros((0, permutations), dtype=np.uint64)
+        self.sorted_keys = np.zeros((bands, 0), dtype=np.uint64)
+        self.sorted_positions = np.zeros((bands, 0), dtype=np.int64)
+        # Chunks added since
+        self.signatures = []
+        self.buckets = defaultdict(list)  # (band, band key) -> positions
+        self.stats = {"unique": 0, "exact": 0, "near": 0}
+
+    def signature(self, words):
+        hashes = shingle_hashes(words)
+        # a * x + b stays below 2**64 for 32-bit a, b and x
+        return ((self.a * hashes[None, :] + self.b) % MINHASH_PRIME).min(axis=1)
+
+    def band_keys(self, signatures):
+        # (n, permutations) -> (n, bands): each band's rows folded into one 64-bit key (FNV-style,
+        # wrapping); a collision only adds a candidate, which the signature comparison then rejects
+        rows = signatures.reshape(len(signatures), self.bands, self.rows)
+        keys = np.full(rows.shape[:2], 0xCBF29CE484222325, dtype=np.uint64)
+        for row in range(self.rows):
+            keys = (keys ^ rows[:, :, row]) * np.uint64(0x100000001B3)
+        return keys
+
+    def signature_at(self, position):
+        if position < self.loaded:
+            return self.loaded_signatures[position]
+        return self.signatures[position - self.loaded]
+
+    def candidates(self, band_keys):
+        found = set()
+        for band, key in enumerate(band_keys):
+            found.update(self.buckets.get((band, int(key)), ()))
+            if self.loaded:
+                row = self.sorted_keys[band]
+                start, end = np.searchsorted(row, key, "left"), np.searchsorted(row, key, "right")
+                found.update(self.sorted_positions[band, start:end].tolist())
+        return sorted(found)
+
+    def seed(self, chunks):
+        # (chunk ID, text) of chunks already in the store: new ones are checked against them, but they
+        # aren't counted. Only needed for a store saved without the deduplicator's state.
+        stats = dict(self.stats)
+        for chunk_id, text in chunks:
+            self.check(text, chunk_id)
+        self.stats = stats
+
+    def check(self, text, chunk_id=None):
+        # None for a new chunk, which is remembered; ("exact" or "near", ID of the chunk it repeats) otherwise
+        words = WORD.findall(text.lower())
+        key = hashlib.sha1(" ".join(words).encode("utf-8")).digest()
+        position = self.exact.get(key)
+        if position is not None:
+            self.stats["exact"] += 1
+            return "exact", self.ids[position]
+        signature = self.signature(words) if words else np.zeros(self.rows * self.bands, dtype=np.uint64)
+        band_keys = self.band_keys(signature[None, :])[0]
+        for position in self.candidates(band_keys):
+            if self.ids[position] is not None and np.mean(self.signature_at(position) == signature) >= self.threshold:
+                self.stats["near"] += 1
+                return "near", self.ids[position]
+        position = len(self.ids)
+        self.ids.append(chunk_id)
+        self.keys.append(key)
+        self.exact[key] = position
+        self.signatures.append(signature)
+        for band, band_key in enumerate(band_keys):
+            self.buckets[(band, int(band_key))].append(position)
+        self.stats["unique"] += 1
+        return None
+
+    def retain(self, chunk_ids):
+        # Forgets every chunk not in `chunk_ids` (deleted from the store): nothing is a duplicate of it anymore
+        chunk_ids = set(chunk_ids)
+        for position, chunk_id in enumerate(self.ids):
+            if chunk_id is not None and chunk_id not in chunk_ids:
+                self.ids[position] = None
+                if self.exact.get(self.keys[position]) == position:
+                    del self.exact[self.keys[position]]
+
+    def save(self, path):
+        live = [position for position, chunk_id in enumerate(self.ids) if chunk_id is not None]
+        signatures = np.concatenate([self.loaded_signatures, np.array(self.signatures, dtype=np.uint64).reshape(
+            len(self.signatures), self.loaded_signatures.shape[1])])[live]
+        band_keys = self.band_keys(signatures).T
+        order = np.argsort(band_keys, axis=1, kind="stable")
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            np.savez(f, params=self.params, ids=np.array([self.ids[p] for p in live], dtype=str),
+                     # Raw digest bytes: a bytes ("S20") array would drop a digest's trailing NULs
+                     keys=np.frombuffer(b"".join(self.keys[p] for p in live), dtype=np.uint8).reshape(-1, 20),
+                     signatures=signatures,
+                     sorted_keys=np.take_along_axis(band_keys, order, axis=1), sorted_positions=order)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path, threshold=NEAR_DUP_THRESHOLD):
+        # None when there is no saved state, or it was hashed differently
+        if not os.path.exists(path):
+            return None
+        dedup = cls(threshold)
+        with np.load(path) as saved:
+            # Keys saved as "S20" (before they were raw bytes) may have lost trailing NULs
+            if not np.array_equal(saved["params"], dedup.params) or saved["keys"].dtype != np.uint8:
+                return None
+            dedup.ids = saved["ids"].tolist()
+            dedup.keys = [row.tobytes() for row in saved["keys"]]
+            dedup.loaded_signatures = saved["signatures"]
+            dedup.sorted_keys = saved["sorted_keys"]
+            dedup.sorted_positions = saved["sorted_positions"]
+        dedup.loaded = len(dedup.ids)
+        dedup.exact = {key: position for position, key in enumerate(dedup.keys)}
+        return dedup
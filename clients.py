@@ -0,0 +1,160 @@
+import logging
+import os
+import threading
+import time
+from functools import lru_cache
+
+from dotenv import load_dotenv
+
+from embedding_model import EMBEDDING_MODEL_NAME, get_embedding_model as get_local_embedding_model
+from llm import Provider
+
+
+# Process-wide client registry. Everything here is created once per process and reused by every
+# Streamlit rerun and session, so HTTP keep-alive connections and TLS sessions survive between requests.
+
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+
+DB_FAISS_PATH = "vectorstore/db_faiss"
+# Load the embedding model and the index in the background as soon as the app starts
+WARMUP = os.getenv("WARMUP", "1") != "0"
+# "inprocess": every process loads its own model and index. "service": use the per-host sidecar
+# (python embedding_service.py) over EMBEDDING_SOCKET; falls back to in-process if it isn't running.
+EMBEDDING_BACKEND = os.getenv("EMBEDDING_BACKEND", "inprocess")
+
+LLM_PROVIDERS = {
+    # name: (API key variable, base URL, model)
+    "GROQ": ("GROQ_API", "https://api.groq.com/openai/v1", "llama3-70b-8192"),
+    "DeepSeek": ("DEEPSEEK_API", "https://openrouter.ai/api/v1", "deepseek/deepseek-chat"),
+}
+
+LLM_POOL_CONNECTIONS = int(os.getenv("LLM_POOL_CONNECTIONS", "50"))
+LLM_POOL_KEEPALIVE = int(os.getenv("LLM_POOL_KEEPALIVE", "20"))
+LLM_KEEPALIVE_EXPIRY = float(os.getenv("LLM_KEEPALIVE_EXPIRY", "120"))
+LLM_CONNECT_TIMEOUT = float(os.getenv("LLM_CONNECT_TIMEOUT", "5"))
+LLM_READ_TIMEOUT = float(os.getenv("LLM_READ_TIMEOUT", "60"))
+
+
+@lru_cache(maxsize=None)
+def get_http_client():
+    import httpx
+
+    return httpx.Client(
+        limits=httpx.Limits(max_connections=LLM_POOL_CONNECTIONS,
+                            max_keepalive_connections=LLM_POOL_KEEPALIVE,
+                            keepalive_expiry=LLM_KEEPALIVE_EXPIRY),
+        timeout=httpx.Timeout(LLM_READ_TIMEOUT, connect=LLM_CONNECT_TIMEOUT),
+    )
+
+
+@lru_cache(maxsize=None)
+def get_llm_client(name):
+    from openai import OpenAI
+
+    key_variable, base_url, _ = LLM_PROVIDERS[name]
+    # No client-side retries: LLMRouter falls back to the next provider instead
+    return OpenAI(api_key=os.getenv(key_variable), base_url=base_url,
+                  http_client=get_http_client(), max_retries=0)
+
+
+@lru_cache(maxsize=None)
+def get_provider(name):
+    return Provider(name, get_llm_client(name), LLM_PROVIDERS[name][2])
+
+
+@lru_cache(maxsize=None)
+def get_router(names=("GROQ", "DeepSeek")):
+    from llm_router import LLMRouter
+
+    return LLMRouter([get_provider(name) for name in names])
+
+
+@lru_cache(maxsize=None)
+def get_embedding_service():
+    # ServiceClient for the sidecar, or None when running in-process
+    if EMBEDDING_BACKEND != "service":
+        return None
+    from embedding_service import ServiceClient
+
+    client = ServiceClient()
+    try:
+        client.call({"op": "ping"})
+    except (OSError, RuntimeError) as e:
+        logger.warning("Embedding service at %s unavailable (%s); loading the model in-process", client.socket_path, e)
+        return None
+    return client
+
+
+def get_embedding_model(model_name=EMBEDDING_MODEL_NAME):
+    # The sidecar's model in service mode, otherwise the shared in-process one (embedding_model.py)
+    service = get_embedding_service() if model_name == EMBEDDING_MODEL_NAME else None
+    if service is not None:
+        from embedding_service import RemoteEmbeddings
+
+        return RemoteEmbeddings(service)
+    return get_local_embedding_model(model_name)
+
+
+_store_lock = threading.Lock()
+
+
+@lru_cache(maxsize=None)
+def _load_vector_store(path):
+    service = get_embedding_service()
+    if service is not None:
+        # The sidecar serves the store it was started with (its --db)
+        from embedding_service import RemoteVectorStore
+
+        return RemoteVectorStore(service)
+
+    from vector_index import load_index_config
+    from vector_store import MmapVectorStore, current_build
+
+    # Index and chunk texts are mmap'd read-only: near-instant load, pages shared between replicas.
+    # nprobe / efSearch come from the build manifest, overridable with FAISS_NPROBE / FAISS_EF_SEARCH.
+    # Both are read from the build published now, even if memory_creation.py publishes another meanwhile
+    build = current_build(path)
+    return MmapVectorStore(build, get_embedding_model(), load_index_config(build))
+
+
+def get_vector_store(path=DB_FAISS_PATH):
+    with _store_lock:
+        return _load_vector_store(path)
+
+
+warmup_timings = {}
+
+
+def warm_up(path=DB_FAISS_PATH):
+    # Everything the first question would otherwise wait for: LLM clients, the embedding model
+    # (including its first forward pass) and the index, with one search to fault in its pages
+    def embed_once():
+        # Past the embedding cache, so the model itself runs once (in service mode: reaches the sidecar)
+        model = get_embedding_model()
+        getattr(model, "embeddings", model).embed_query("warm-up")
+
+    def search_once():
+        store = get_vector_store(path)
+        store.similarity_search_by_vector(store.embeddings.embed_query("warm-up"), k=1)
+
+    steps = [("router", get_router), ("embedding_model", embed_once), ("vector_store", search_once)]
+    for name, step in steps:
+        started = time.perf_counter()
+        try:
+            step()
+        except Exception as e:
+            logger.warning("Warm-up of %s failed: %s", name, e)
+        warmup_timings[name] = time.perf_counter() - started
+    logger.info("Warm-up done: %s", ", ".join(f"{name} {seconds:.1f}s" for name, seconds in warmup_timings.items()))
+
+
+@lru_cache(maxsize=None)
+def start_warmup():
+    # Once per process; returns the thread (None when WARMUP=0)
+    if not WARMUP:
+        return None
+    thread = threading.Thread(target=warm_up, name="warm-up", daemon=True)
+    thread.start()
+    return thread
@@ -0,0 +1,212 @@
+import hashlib
+import os
+import re
+import sqlite3
+import threading
+import time
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+
+EMBEDDING_CACHE_DIR = os.getenv("EMBEDDING_CACHE_DIR", "vectorstore/embedding_cache")
+EMBEDDING_CACHE_MAX_ENTRIES = int(os.getenv("EMBEDDING_CACHE_MAX_ENTRIES", "200000"))
+# Hits only update LRU recency in memory; it is written to SQLite after this many hits or seconds,
+# and before any eviction, so a cached query costs no disk write
+RECENCY_FLUSH_ENTRIES = int(os.getenv("EMBEDDING_CACHE_RECENCY_FLUSH_ENTRIES", "1000"))
+RECENCY_FLUSH_SECONDS = float(os.getenv("EMBEDDING_CACHE_RECENCY_FLUSH_SECONDS", "30"))
+# Key prefix of a slot reserved by put_many whose vector is still being written
+PENDING = "pending:"
+
+
+class EmbeddingCache:
+    # On-disk embedding cache for one model.
+    # Vectors live in a fixed-capacity float32 memmap, one slot per text; a small
+    # SQLite table maps text hash -> slot and tracks last use for LRU eviction.
+    # Several processes may share it: a slot's row is deleted (committed) before its vector is
+    # overwritten, and a new row only appears once its vector is written, so a reader that still
+    # finds the same row after reading a vector knows the vector wasn't being replaced.
+
+    def __init__(self, model_name, cache_dir=EMBEDDING_CACHE_DIR, max_entries=EMBEDDING_CACHE_MAX_ENTRIES):
+        self.model_name = model_name
+        self.max_entries = max_entries
+        self.path = os.path.join(cache_dir, re.sub(r"[^A-Za-z0-9_.-]+", "_", model_name))
+        os.makedirs(self.path, exist_ok=True)
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(os.path.join(self.path, "index.sqlite"), check_same_thread=False, timeout=30)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("CREATE TABLE IF NOT EXISTS entries (key TEXT PRIMARY KEY, slot INTEGER, last_used REAL)")
+        self.db.execute("CREATE INDEX IF NOT EXISTS entries_last_used ON entries (last_used)")
+        self.db.execute("CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value INTEGER)")
+        self.db.commit()
+        self.vectors = None
+        self.recent = {}  # key -> last use not yet written
+        self.recent_flushed = time.monotonic()
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, kind, text):
+        return hashlib.sha256(f"{self.model_name}\0{kind}\0{text}".encode("utf-8")).hexdigest()
+
+    def _meta(self, name):
+        row = self.db.execute("SELECT value FROM meta WHERE name = ?", (name,)).fetchone()
+        return row[0] if row else None
+
+    def _open_vectors(self, dim=None):
+        if self.vectors is not None:
+            return self.vectors
+        stored_dim = self._meta("dim")
+        if stored_dim is None:
+            if dim is None:
+                return None
+            self.db.execute("INSERT OR REPLACE INTO meta VALUES ('dim', ?)", (dim,))
+            self.db.execute("INSERT OR REPLACE INTO meta VALUES ('capacity', ?)", (self.max_entries,))
+            self.db.execute("INSERT OR REPLACE INTO meta VALUES ('next_slot', 0)")
+            self.db.commit()
+            stored_dim = dim
+        capacity = self._meta("capacity")
+        vectors_path = os.path.join(self.path, "vectors.f32")
+        mode = "r+" if os.path.exists(vectors_path) else "w+"
+        self.vectors = np.memmap(vectors_path, dtype=np.float32, mode=mode, shape=(capacity, stored_dim))
+        return self.vectors
+
+    def get_many(self, kind, texts):
+        # Returns {position in texts: vector} for every cached text
+        keys = [self.key(kind, text) for text in texts]
+        found = {}
+        with self.lock:
+            vectors = self._open_vectors()
+            if vectors is None:
+                self.misses += len(texts)
+                return found
+            slots = self._rows(keys)
+            read = {i: np.array(vectors[slots[key][1]]) for i, key in enumerate(keys) if key in slots}
+            # Vectors whose row changed meanwhile (evicted by another process) are misses
+            current = self._rows(list({keys[i] for i in read})) if read else {}
+            now = time.time()
+            for i, vector in read.items():
+                if current.get(keys[i]) == slots[keys[i]]:
+                    found[i] = vector
+                    self.recent[keys[i]] = now
+            if self.recent and (len(self.recent) >= RECENCY_FLUSH_ENTRIES
+                                or time.monotonic() - self.recent_flushed >= RECENCY_FLUSH_SECONDS):
+                self._write_recency()
+                self.db.commit()
+            self.hits += len(found)
+            self.misses += len(texts) - len(found)
+        return found
+
+    def _rows(self, keys):
+        # key -> (rowid, slot) for the stored keys; the rowid changes when a key is evicted and stored again
+        rows = {}
+        for start in range(0, len(keys), 500):
+            part = keys[start:start + 500]
+            rows.update((key, (rowid, slot)) for key, rowid, slot in self.db.execute(
+                f"SELECT key, rowid, slot FROM entries WHERE key IN ({','.join('?' * len(part))})", part))
+        return rows
+
+    def _write_recency(self):
+        # Caller holds the lock and commits
+        if self.recent:
+            self.db.executemany("UPDATE entries SET last_used = ? WHERE key = ?",
+                                [(used, key) for key, used in self.recent.items()])
+            self.recent.clear()
+        self.recent_flushed = time.monotonic()
+
+    def flush(self):
+        with self.lock:
+            self._write_recency()
+            self.db.commit()
+
+    def put_many(self, kind, texts, embeddings):
+        if not texts:
+            return
+        embeddings = np.asarray(embeddings, dtype=np.float32)
+        with self.lock:
+            vectors = self._open_vectors(dim=embeddings.shape[1])
+            # A batch larger than the whole cache only keeps its tail
+            texts, embeddings = texts[-len(vectors):], embeddings[-len(vectors):]
+            pending = {self.key(kind, text): embedding for text, embedding in zip(texts, embeddings)}
+            now = time.time()
+            self.db.execute("BEGIN IMMEDIATE")
+            try:
+                # Evictions below must see which entries were used recently
+                self._write_recency()
+                # Texts already stored keep their slot (and vector); they only count as used
+                stored = self._rows(list(pending))
+                self.db.executemany("UPDATE entries SET last_used = ? WHERE key = ?", [(now, key) for key in stored])
+                new = [key for key in pending if key not in stored]
+                # Slots for the others are reserved under placeholder keys (one left by a crashed run is reused)
+                placeholders = self._rows([PENDING + key for key in new])
+                reserved = {key[len(PENDING):]: slot for key, (_, slot) in placeholders.items()}
+                batch = set(pending) | {PENDING + key for key in pending}
+                for key in new:
+                    if key not in reserved:
+                        reserved[key] = self._allocate_slot(len(vectors), batch)
+                        self.db.execute("INSERT INTO entries VALUES (?, ?, ?)", (PENDING + key, reserved[key], now))
+                self.db.commit()
+            except Exception:
+                self.db.rollback()
+                raise
+            if not new:
+                return
+            for key in new:
+                vectors[reserved[key]] = pending[key]
+            vectors.flush()
+            # Only now do the new keys become visible. A key another process stored meanwhile keeps its
+            # row; the placeholder then ages out like any entry.
+            self.db.executemany("UPDATE OR IGNORE entries SET key = ? WHERE key = ?",
+                                [(key, PENDING + key) for key in new])
+            self.db.commit()
+
+    def _allocate_slot(self, capacity, keep):
+        # Caller holds the lock, in a transaction. `keep`: keys of the current batch, never evicted.
+        next_slot = self._meta("next_slot")
+        if next_slot < capacity:
+            self.db.execute("UPDATE meta SET value = ? WHERE name = 'next_slot'", (next_slot + 1,))
+            return next_slot
+        # Cache is full: reuse the slot of the least recently used entry
+        rows = self.db.execute("SELECT key, slot FROM entries ORDER BY last_used")
+        row = rows.fetchone()
+        while row[0] in keep:
+            row = rows.fetchone()
+        rows.close()
+        self.db.execute("DELETE FROM entries WHERE key = ?", (row[0],))
+        return row[1]
+
+
+class CachedEmbeddings(Embeddings):
+    # Drop-in wrapper for a LangChain embedding model that only embeds texts it has never seen
+
+    def __init__(self, embeddings, cache):
+        self.embeddings = embeddings
+        self.cache = cache
+
+    def _embed_many(self, kind, texts, embed):
+        texts = list(texts)
+        found = self.cache.get_many(kind, texts)
+        missing_texts = list(dict.fromkeys(texts[i] for i in range(len(texts)) if i not in found))
+        if missing_texts:
+            new_vectors = embed(missing_texts)
+            self.cache.put_many(kind, missing_texts, new_vectors)
+            by_text = dict(zip(missing_texts, np.asarray(new_vectors, dtype=np.float32)))
+            for i, text in enumerate(texts):
+                if i not in found:
+                    found[i] = by_text[text]
+        return [found[i].tolist() for i in range(len(texts))]
+
+    def embed_documents(self, texts):
+        return self._embed_many("document", texts, self.embeddings.embed_documents)
+
+    def embed_queries(self, texts):
+        # Several queries in one forward pass (the embedding service's micro-batches).
+        # Sentence-transformers models without query instructions embed queries like documents.
+        return self._embed_many("query", texts, self.embeddings.embed_documents)
+
+    def embed_query(self, text):
+        found = self.cache.get_many("query", [text])
+        if 0 in found:
+            return found[0].tolist()
+        vector = self.embeddings.embed_query(text)
+        self.cache.put_many("query", [text], [vector])
+        return vector
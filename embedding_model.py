@@ -0,0 +1,43 @@
+import os
+import threading
+from functools import lru_cache
+
+
+EMBEDDING_MODEL_NAME = "sentence-transformers/all-MiniLM-L6-v2"
+# "torch" (sentence-transformers), or ONNX Runtime with the exported model: "onnx" (fp32) or
+# "onnx-int8" (quantized). See onnx_embeddings.py; benchmarks/bench_embeddings.py checks retrieval agreement.
+EMBEDDING_RUNTIME = os.getenv("EMBEDDING_RUNTIME", "torch")
+
+# Held while the model loads, so the startup warm-up and a first request never load it twice
+_load_lock = threading.Lock()
+
+
+def embedding_id(model_name=EMBEDDING_MODEL_NAME, runtime=EMBEDDING_RUNTIME):
+    # Names the vectors: the embedding cache and the store manifest keep runtimes apart
+    return model_name if runtime == "torch" else f"{model_name}@{runtime}"
+
+
+def load_embeddings(model_name, runtime=EMBEDDING_RUNTIME):
+    # The uncached model
+    if runtime in ("onnx", "onnx-int8"):
+        from onnx_embeddings import OnnxEmbeddings
+
+        return OnnxEmbeddings(model_name, quantized=runtime == "onnx-int8")
+    if runtime != "torch":
+        raise ValueError(f"Unknown EMBEDDING_RUNTIME {runtime!r}: use torch, onnx or onnx-int8")
+    from langchain_huggingface import HuggingFaceEmbeddings
+
+    return HuggingFaceEmbeddings(model_name=model_name)
+
+
+@lru_cache(maxsize=None)
+def _load_embedding_model(model_name):
+    from embedding_cache import EmbeddingCache, CachedEmbeddings
+
+    return CachedEmbeddings(load_embeddings(model_name), EmbeddingCache(embedding_id(model_name)))
+
+
+# One cached embedding model per process, shared by index builds and query-time search
+def get_embedding_model(model_name=EMBEDDING_MODEL_NAME):
+    with _load_lock:
+        return _load_embedding_model(model_name)
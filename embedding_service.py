@@ -0,0 +1,266 @@
+import argparse
+import base64
+import json
+import logging
+import os
+import queue
+import socket
+import socketserver
+import struct
+import threading
+import time
+
+import numpy as np
+
+
+# Optional per-host sidecar: one process holds the embedding model and the FAISS index, and every
+# Streamlit replica on the host talks to it over a Unix socket (EMBEDDING_BACKEND=service in clients.py).
+# Query embeddings and searches arriving from all replicas at about the same time are micro-batched
+# into one forward pass and one index.search call.
+
+EMBEDDING_SOCKET = os.getenv("EMBEDDING_SOCKET", "/tmp/wellai-embedding.sock")
+SERVICE_MAX_BATCH = int(os.getenv("EMBEDDING_SERVICE_MAX_BATCH", "32"))
+SERVICE_MAX_WAIT_MS = float(os.getenv("EMBEDDING_SERVICE_MAX_WAIT_MS", "5"))
+SERVICE_TIMEOUT = float(os.getenv("EMBEDDING_SERVICE_TIMEOUT", "30"))
+
+logger = logging.getLogger(__name__)
+
+
+# Wire format: 4-byte big-endian length, then a JSON object. Vectors travel as base64 float32.
+def send_message(sock, message):
+    data = json.dumps(message).encode("utf-8")
+    sock.sendall(struct.pack(">I", len(data)) + data)
+
+
+def _recv_exactly(sock, size):
+    data = bytearray()
+    while len(data) < size:
+        part = sock.recv(size - len(data))
+        if not part:
+            return None
+        data += part
+    return bytes(data)
+
+
+def recv_message(sock):
+    header = _recv_exactly(sock, 4)
+    if header is None:
+        return None
+    data = _recv_exactly(sock, struct.unpack(">I", header)[0])
+    if data is None:
+        return None
+    return json.loads(data)
+
+
+def encode_vector(vector):
+    return base64.b64encode(np.asarray(vector, dtype=np.float32).tobytes()).decode("ascii")
+
+
+def decode_vector(data):
+    return np.frombuffer(base64.b64decode(data), dtype=np.float32)
+
+
+class MicroBatcher:
+    # Requests from every connection go into one queue. A single worker takes whatever arrived within
+    # max_wait of the first request (up to max_batch), embeds the texts in one forward pass and runs
+    # one index search for the whole batch.
+
+    def __init__(self, store, max_batch=SERVICE_MAX_BATCH, max_wait=SERVICE_MAX_WAIT_MS / 1000):
+        self.store = store
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.requests = queue.Queue()
+        self.lock = threading.Lock()
+        self.batches = 0
+        self.items = 0
+        threading.Thread(target=self._loop, name="micro-batcher", daemon=True).start()
+
+    def submit(self, text=None, vector=None, k=0):
+        # Embeds `text` (unless `vector` is given) and, with k > 0, searches the index.
+        # Returns (vector, [(position, chunk text), ...])
+        item = {"text": text, "vector": vector, "k": k, "done": threading.Event()}
+        self.requests.put(item)
+        item["done"].wait()
+        if "error" in item:
+            raise item["error"]
+        return item["vector"], item.get("hits", [])
+
+    def _loop(self):
+        while True:
+            batch = [self.requests.get()]
+            deadline = time.monotonic() + self.max_wait
+            while len(batch) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self.requests.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            try:
+                self._process(batch)
+            except Exception as e:
+                logger.exception("Batch of %d failed", len(batch))
+                for item in batch:
+                    item["error"] = e
+            for item in batch:
+                item["done"].set()
+
+    def _process(self, batch):
+        to_embed = [item for item in batch if item["vector"] is None]
+        if to_embed:
+            vectors = self.store.embeddings.embed_queries([item["text"] for item in to_embed])
+            for item, vector in zip(to_embed, vectors):
+                item["vector"] = np.asarray(vector, dtype=np.float32)
+        to_search = [item for item in batch if item["k"] > 0]
+        if to_search:
+            queries = np.stack([item["vector"] for item in to_search]).astype(np.float32)
+            _, positions = self.store.index.search(queries, max(item["k"] for item in to_search))
+            for item, row in zip(to_search, positions):
+                item["hits"] = [(int(i), self.store.chunks.text(int(i))) for i in row[:item["k"]] if i >= 0]
+        with self.lock:
+            self.batches += 1
+            self.items += len(batch)
+
+
+class ServiceHandler(socketserver.BaseRequestHandler):
+    def handle(self):
+        # One persistent connection per client thread; requests on it are answered in order
+        while True:
+            try:
+                message = recv_message(self.request)
+            except (OSError, ValueError):
+                return
+            if message is None:
+                return
+            try:
+                reply = self.server.dispatch(message)
+            except Exception as e:
+                reply = {"error": f"{type(e).__name__}: {e}"}
+            send_message(self.request, reply)
+
+
+class EmbeddingService(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, socket_path, store, max_batch=SERVICE_MAX_BATCH, max_wait=SERVICE_MAX_WAIT_MS / 1000):
+        self.store = store
+        self.batcher = MicroBatcher(store, max_batch, max_wait)
+        if os.path.exists(socket_path):
+            # Left over from a previous run
+            os.remove(socket_path)
+        super().__init__(socket_path, ServiceHandler)
+        os.chmod(socket_path, 0o660)
+
+    def dispatch(self, message):
+        op = message["op"]
+        if op == "embed_query":
+            vector, _ = self.batcher.submit(text=message["text"])
+            return {"vector": encode_vector(vector)}
+        if op == "embed_documents":
+            # Already a batch (e.g. a report's sections): straight to the model
+            return {"vectors": [encode_vector(v) for v in self.store.embeddings.embed_documents(message["texts"])]}
+        if op == "search":
+            vector = decode_vector(message["vector"]) if "vector" in message else None
+            vector, hits = self.batcher.submit(text=message.get("text"), vector=vector, k=message["k"])
+            return {"vector": encode_vector(vector), "hits": hits}
+        if op == "stats":
+            with self.batcher.lock:
+                batches, items = self.batcher.batches, self.batcher.items
+            return {"batches": batches, "items": items, "mean_batch": items / batches if batches else 0.0}
+        if op == "ping":
+            return {"ok": True}
+        raise ValueError(f"unknown op {op!r}")
+
+
+class ServiceClient:
+    # Thread-safe: each thread keeps its own connection to the service
+
+    def __init__(self, socket_path=EMBEDDING_SOCKET, timeout=SERVICE_TIMEOUT):
+        self.socket_path = socket_path
+        self.timeout = timeout
+        self.local = threading.local()
+
+    def _connect(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(self.timeout)
+        sock.connect(self.socket_path)
+        self.local.sock = sock
+        return sock
+
+    def call(self, message):
+        for attempt in range(2):
+            sock = getattr(self.local, "sock", None) or self._connect()
+            try:
+                send_message(sock, message)
+                reply = recv_message(sock)
+                if reply is None:
+                    raise ConnectionError("embedding service closed the connection")
+                break
+            except OSError:
+                # The service restarted since this connection was opened: reconnect once
+                sock.close()
+                self.local.sock = None
+                if attempt:
+                    raise
+        if "error" in reply:
+            raise RuntimeError(f"embedding service: {reply['error']}")
+        return reply
+
+
+class RemoteEmbeddings:
+    # The parts of the LangChain Embeddings interface the app uses, served by the sidecar
+
+    def __init__(self, client):
+        self.client = client
+
+    def embed_query(self, text):
+        return decode_vector(self.client.call({"op": "embed_query", "text": text})["vector"]).tolist()
+
+    def embed_documents(self, texts):
+        reply = self.client.call({"op": "embed_documents", "texts": list(texts)})
+        return [decode_vector(v).tolist() for v in reply["vectors"]]
+
+
+class RemoteVectorStore:
+    # Drop-in for vector_store.MmapVectorStore, backed by the sidecar
+
+    def __init__(self, client):
+        self.client = client
+        self.embeddings = RemoteEmbeddings(client)
+
+    def similarity_search_by_vector(self, embedding, k=4):
+        from langchain_core.documents import Document
+
+        reply = self.client.call({"op": "search", "vector": encode_vector(embedding), "k": k})
+        return [Document(page_content=text, metadata={"position": position}) for position, text in reply["hits"]]
+
+    def similarity_search(self, query, k=4):
+        from langchain_core.documents import Document
+
+        reply = self.client.call({"op": "search", "text": query, "k": k})
+        return [Document(page_content=text, metadata={"position": position}) for position, text in reply["hits"]]
+
+
+if __name__ == "__main__":
+    from embedding_model import get_embedding_model
+    from vector_index import load_index_config
+    from vector_store import MmapVectorStore, current_build
+
+    parser = argparse.ArgumentParser(description="Serve query embeddings and FAISS search to every app replica on this host")
+    parser.add_argument("--socket", default=EMBEDDING_SOCKET, help="Unix socket path (EMBEDDING_SOCKET)")
+    parser.add_argument("--db", default="vectorstore/db_faiss", help="FAISS store directory")
+    parser.add_argument("--max-batch", type=int, default=SERVICE_MAX_BATCH, help="queries per forward pass")
+    parser.add_argument("--max-wait-ms", type=float, default=SERVICE_MAX_WAIT_MS,
+                        help="how long the first query of a batch waits for others")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+    build = current_build(args.db)
+    store = MmapVectorStore(build, get_embedding_model(), load_index_config(build))
+    with EmbeddingService(args.socket, store, args.max_batch, args.max_wait_ms / 1000) as server:
+        logger.info("Embedding service listening on %s", args.socket)
+        try:
+            server.serve_forever()
+        finally:
+            os.remove(args.socket)
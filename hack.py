@@ -1,152 +1,116 @@
+import streamlit as st
+
+import report_analysis
+from chat_sessions import ChatSession
+from clients import get_router
+from llm import LLMError
+from llm_scheduler import RateLimited
+from report_cache import get_report_cache, content_hash
+
+
+# Imported once; run() is re-executed on every Streamlit rerun
 def run():
-    import streamlit as st
-    import os
-    from dotenv import load_dotenv
-    import fitz  # PyMuPDF
-    import pytesseract
-    from PIL import Image
-    from pdf2image import convert_from_bytes
-    from openai import OpenAI
-    import re
-
-    # Load API key
-    load_dotenv()
-    API_KEY = os.getenv("GROQ_API")
-    BASE_URL = "https://api.groq.com/openai/v1"
-    MODEL = "llama3-70b-8192"    #"mixtral-8x7b-instruct", #"mixtral-8x7b-32768",
-
-    client = OpenAI(api_key=API_KEY, base_url=BASE_URL)
-
-    # Normal ranges
-    NORMAL_RANGES = {
-        "Hemoglobin": (13.0, 18.0),
-        "Hematocrit (PCV)": (42.0, 52.0),
-        "RBC Count": (4.00, 6.50),
-        "MCV": (78.0, 94.0),
-        "MCH": (26.0, 31.0),
-        "MCHC": (31.0, 36.0),
-        "RBC Distribution Width - CV": (11.5, 14.5),
-        "Total Leukocyte Count": (4000, 11000),
-        "Neutrophils": (40, 70),
-        "Lymphocytes": (20, 45),
-        "Eosinophils": (0, 6),
-        "Monocytes": (2, 10),
-        "Basophils": (0, 1),
-        "Platelet Count": (150000, 450000),
-        "Mean Platelet Volume (MPV)": (6.5, 9.8),
-        "PCT": (0.150, 0.500),
-    }
-
-    def flag_abnormalities(text):
-        highlights = []
-        for key, (low, high) in NORMAL_RANGES.items():
-            if key.lower() in text.lower():
-                try:
-                    pattern = rf"{key}\s+(\d+\.?\d*)"
-                    matches = re.findall(pattern, text, re.IGNORECASE)
-                    for match in matches:
-                        val = float(match)
-                        if val < low:
-                            highlights.append(f" {key} is low ({val})")
-                        elif val > high:
-                            highlights.append(f"{key} is high ({val})")
-                except:
-                    continue
-        return highlights
-
-    def extract_text(pdf_file):
-        try:
-            with fitz.open(stream=pdf_file.read(), filetype="pdf") as doc:
-                text = "".join([page.get_text() for page in doc])
-            if text.strip():
-                return text
-        except Exception:
-            st.warning("Direct text extraction failed. Trying OCR...")
+    # Same routing as the chatbot: GROQ first, DeepSeek on failure or when GROQ is slow to start.
+    # The pooled clients behind it are created once per process (clients.py), not on every rerun.
+    router = get_router()
+
+    # Extraction, flagging and the prompts live in report_analysis.py, shared with the batch CLI
+    report_cache = get_report_cache()
+    SUMMARY_VERSION = report_analysis.summary_version(router)
+
+    def extract_text(pdf_file, report_hash):
+        # Per page: text layer when there is one, OCR (in a process pool) for scanned pages only
+        progress_bar = None
+
+        def on_page(done, total, page_number):
+            nonlocal progress_bar
+            if progress_bar is None:
+                progress_bar = st.progress(0.0)
+            progress_bar.progress(done / total, text=f"OCR: page {page_number + 1} done ({done}/{total})")
 
         try:
-            pdf_file.seek(0)
-            images = convert_from_bytes(pdf_file.read())
-            return "".join([pytesseract.image_to_string(image) for image in images])
+            text = report_analysis.extract_text(pdf_file.getvalue(), report_hash, progress=on_page)
         except Exception as e:
             st.error(f"OCR failed: {e}")
             return ""
+        if progress_bar is not None:
+            progress_bar.empty()
+        return text
 
-    def generate_summary(text):
-        prompt = f"""
-You are a helpful medical assistant. Analyze the medical report text and:
-1. Extract test names and values.
-2. Identify abnormal values based on healthy ranges.
-3. Explain the findings in plain language.
-4. Offer general advice based on the report.
-
-Medical Report:
-{text}
-
-Summary:
-"""
-        response = client.chat.completions.create(
-            model=MODEL,
-            messages=[
-                {"role": "system", "content": "You are a medical assistant."},
-                {"role": "user", "content": prompt}
-            ]
-        )
-        return response.choices[0].message.content.strip()
-
-    def ask_question(question, report_text, summary):
-        followup_prompt = f"""
-You are a medical assistant. Here is a medical report and its summary:
-
-Report:
-{report_text}
-
-Summary:
-{summary}
-
-The user asks: {question}
-
-Please respond clearly and accurately in plain language.
-"""
-        response = client.chat.completions.create(
-            model=MODEL,
-            messages=[
-                {"role": "system", "content": "You help users understand medical reports."},
-                {"role": "user", "content": followup_prompt}
-            ]
-        )
-        return response.choices[0].message.content.strip()
+    def stream_reply(stream, outcome):
+        # Provider failures end the stream with a message instead of an exception, as in medibot.py;
+        # outcome["failed"] keeps that message out of the report cache and the chat history
+        try:
+            yield from stream
+        except LLMError as e:
+            outcome["failed"] = True
+            if any(isinstance(error, RateLimited) for _, error in e.errors):
+                # The scheduler already waited and retried within the deadline
+                yield " The assistant is handling a lot of questions right now. Please try again in a minute."
+                return
+            details = "\n".join(f"- {name}: {error}" for name, error in e.errors)
+            yield f" Both GROQ and DeepSeek failed. Details:\n{details}"
+        except Exception as e:
+            outcome["failed"] = True
+            yield f"\n\n Response interrupted: {e}"
+
+    def show_timings(timings):
+        if "ttft" in timings:
+            caption = f"⏱ first token {timings['ttft']:.1f}s · total {timings['total']:.1f}s"
+            if timings.get("mode") == "map-reduce":
+                caption += f" · long report: {timings['parts']} parts summarized in {timings['map']:.1f}s, merged in {timings['reduce']:.1f}s"
+            if "prompt_tokens" in timings:
+                caption += f" · prompt {timings['prompt_tokens']} tokens (whole report: {timings['full_report_tokens']})"
+            st.caption(caption)
 
     # Upload and reset state
     uploaded_file = st.file_uploader("Upload your medical report (PDF)", type=["pdf"])
     if uploaded_file:
-        if "last_uploaded" not in st.session_state or uploaded_file.name != st.session_state.last_uploaded:
+        # Identify the report by content, not file name: renamed re-uploads hit the cache,
+        # different files with the same name don't collide
+        report_hash = content_hash(uploaded_file.getvalue())
+        if "last_uploaded" not in st.session_state or report_hash != st.session_state.last_uploaded:
             # Reset state
-            st.session_state.last_uploaded = uploaded_file.name
+            st.session_state.last_uploaded = report_hash
             st.session_state.report_text = None
-            st.session_state.summary_text = None
-            st.session_state.chat_history = []
+            st.session_state.summary_text = report_cache.get("summary", report_hash, SUMMARY_VERSION)
+            st.session_state.summary_timings = {}
+            # A new conversation per report (stored in SQLite, see chat_sessions.py)
+            st.session_state.report_chat = ChatSession.open(kind="report")
+            st.session_state.report_chat_pages = 0
 
         if st.session_state.report_text is None:
             with st.spinner("🔍 Extracting text..."):
-                text = extract_text(uploaded_file)
-                if not text or len(text.strip()) < 20:
-                    st.error("No extractable text found. Try another file.")
-                    return
-                st.session_state.report_text = text
+                text = extract_text(uploaded_file, report_hash)
+            if not text:
+                st.error("No extractable text found. Try another file.")
+                return
+            st.session_state.report_text = text
         else:
             text = st.session_state.report_text
 
         # Abnormalities
-        flagged = flag_abnormalities(text)
+        flagged = report_analysis.flag_abnormalities(text, report_hash)
         if flagged:
             st.success(f"Found {len(flagged)} abnormal value(s):")
-            for issue in flagged:
-                st.markdown(f"- {issue}")
+            for flag in flagged:
+                st.markdown(f"- {report_analysis.describe_flag(flag)}")
 
         # Summary button
         if st.button("Analyze with AI"):
+            st.markdown("### Plain Language Summary")
+            timings = {}
+            outcome = {"failed": False}
             with st.spinner("Generating summary..."):
-                st.session_state.summary_text = generate_summary(text)
+                summary = st.write_stream(stream_reply(
+                    report_analysis.generate_summary(text, timings, router), outcome))
+            # A failed summary stays on screen until the next click, but is neither stored nor cached
+            if not outcome["failed"]:
+                # Rerun so the stored summary is shown (with the chat below) instead of the stream
+                st.session_state.summary_text = summary.strip()
+                report_cache.put("summary", report_hash, SUMMARY_VERSION, st.session_state.summary_text)
+                st.session_state.summary_timings = timings
+                st.rerun()
 
         # Summary display + chat
         if "summary_text" in st.session_state and st.session_state.summary_text:
@@ -154,6 +118,7 @@ Please respond clearly and accurately in plain language.
             st.success("Summary Complete")
             st.markdown("### Plain Language Summary")
             st.write(summary)
+            show_timings(st.session_state.get("summary_timings", {}))
             st.download_button("Download Summary", summary, file_name="summary.txt")
 
             st.markdown("### Ask a Question About Your Report")
@@ -162,14 +127,29 @@ Please respond clearly and accurately in plain language.
                 user_q = st.text_input("Enter your question:", placeholder="e.g. What does a low MCH mean?")
                 submitted = st.form_submit_button("Send")
 
+            # Chat history display: the in-memory window, plus older turns a page at a time on request
+            chat = st.session_state.report_chat
+            _, older = chat.older_turns(st.session_state.report_chat_pages)
+            hidden = chat.window_start - len(older)
+            if hidden and st.button(f"Show earlier questions ({hidden} more)"):
+                st.session_state.report_chat_pages += 1
+                st.rerun()
+            for q, a in older + chat[chat.window_start:]:
+                st.chat_message("user").write(q)
+                st.chat_message("assistant").write(a)
+
+            # New answer streams in below the history, then joins it
             if submitted and user_q:
-                st.session_state.chat_history.append({"role": "user", "content": user_q})
-                with st.spinner("Thinking..."):
-                    answer = ask_question(user_q, text, summary)
-                st.session_state.chat_history.append({"role": "assistant", "content": answer})
-
-            # Chat history display
-            for msg in st.session_state.chat_history:
-                st.chat_message(msg["role"]).write(msg["content"])
+                st.chat_message("user").write(user_q)
+                timings = {}
+                outcome = {"failed": False}
+                with st.chat_message("assistant"):
+                    with st.spinner("Thinking..."):
+                        answer = st.write_stream(stream_reply(
+                            report_analysis.ask_question(user_q, text, summary, timings, router, chat), outcome))
+                    show_timings(timings)
+                if not outcome["failed"]:
+                    chat.append(user_q, answer.strip())
+                    chat.maybe_fold(router)
 
         # st.markdown("<hr><small>Built by Statistician</small>", unsafe_allow_html=True)
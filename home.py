@@ -8,6 +8,15 @@ st.set_page_config(
     initial_sidebar_state="collapsed"
 )
 
+# Embedding model, FAISS index and LLM clients load in the background (once per process),
+# so they are ready by the time the first question is asked
+from clients import start_warmup
+start_warmup()
+
+# Per-stage latency histograms; served on METRICS_PORT in the Prometheus text format when it is set
+from metrics import METRICS_PANEL, REGISTRY, span, start_metrics_server
+start_metrics_server()
+
 # State management
 if "page" not in st.session_state:
     st.session_state.page = "home"
@@ -194,10 +203,26 @@ def show_chatbot():
     except Exception as e:
         st.error(f"Error loading Medical Chatbot: {str(e)}")
 
-# Page routing
-if st.session_state.page == "home":
-    show_home()
-elif st.session_state.page == "analyzer":
-    show_analyzer()
-elif st.session_state.page == "chatbot":
-    show_chatbot()
\ No newline at end of file
+# Developer panel (METRICS_PANEL=1): this process's stage latencies
+def show_metrics_panel():
+    with st.sidebar.expander("⏱ Stage latencies (this process)"):
+        rows = REGISTRY.stage_summary()
+        if not rows:
+            st.caption("Nothing recorded yet.")
+            return
+        table = ["| stage | count | mean | p50 | p95 |", "|---|---:|---:|---:|---:|"]
+        table += [f"| {row['stage']} | {row['count']} | {row['mean']:.3f}s | {row['p50']:.3f}s | {row['p95']:.3f}s |"
+                  for row in rows]
+        st.markdown("\n".join(table))
+
+# Page routing; a page's run includes the stages it waits for (streaming answers, OCR)
+with span(f"page_{st.session_state.page}"):
+    if st.session_state.page == "home":
+        show_home()
+    elif st.session_state.page == "analyzer":
+        show_analyzer()
+    elif st.session_state.page == "chatbot":
+        show_chatbot()
+
+if METRICS_PANEL:
+    show_metrics_panel()
\ No newline at end of file
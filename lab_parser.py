@@ -0,0 +1,149 @@
+import re
+from collections import namedtuple
+
+
+# name: (normal range, aliases as they appear on lab reports)
+LAB_TESTS = {
+    "Hemoglobin": ((13.0, 18.0), ["Hemoglobin", "Haemoglobin", "Hb", "Hgb"]),
+    "Hematocrit (PCV)": ((42.0, 52.0), ["Hematocrit (PCV)", "Hematocrit", "Haematocrit", "Packed Cell Volume", "PCV", "HCT"]),
+    "RBC Count": ((4.00, 6.50), ["RBC Count", "Total RBC Count", "Red Blood Cell Count", "RBC"]),
+    "MCV": ((78.0, 94.0), ["MCV", "Mean Corpuscular Volume"]),
+    "MCH": ((26.0, 31.0), ["MCH", "Mean Corpuscular Hemoglobin"]),
+    "MCHC": ((31.0, 36.0), ["MCHC", "Mean Corpuscular Hemoglobin Concentration"]),
+    "RBC Distribution Width - CV": ((11.5, 14.5), ["RBC Distribution Width - CV", "Red Cell Distribution Width", "RDW-CV", "RDW CV", "RDW"]),
+    "Total Leukocyte Count": ((4000, 11000), ["Total Leukocyte Count", "Total WBC Count", "White Blood Cell Count", "WBC Count", "TLC", "WBC"]),
+    "Neutrophils": ((40, 70), ["Neutrophils", "Neutrophil"]),
+    "Lymphocytes": ((20, 45), ["Lymphocytes", "Lymphocyte"]),
+    "Eosinophils": ((0, 6), ["Eosinophils", "Eosinophil"]),
+    "Monocytes": ((2, 10), ["Monocytes", "Monocyte"]),
+    "Basophils": ((0, 1), ["Basophils", "Basophil"]),
+    "Absolute Neutrophil Count": ((2000, 7000), ["Absolute Neutrophil Count", "Absolute Neutrophils", "Absolute Neutrophil", "ANC"]),
+    "Absolute Lymphocyte Count": ((1000, 3000), ["Absolute Lymphocyte Count", "Absolute Lymphocytes", "Absolute Lymphocyte"]),
+    "Absolute Eosinophil Count": ((20, 500), ["Absolute Eosinophil Count", "Absolute Eosinophils", "Absolute Eosinophil", "AEC"]),
+    "Absolute Monocyte Count": ((200, 1000), ["Absolute Monocyte Count", "Absolute Monocytes", "Absolute Monocyte"]),
+    "Absolute Basophil Count": ((20, 100), ["Absolute Basophil Count", "Absolute Basophils", "Absolute Basophil"]),
+    "Platelet Count": ((150000, 450000), ["Platelet Count", "Platelets", "PLT"]),
+    "Mean Platelet Volume (MPV)": ((6.5, 9.8), ["Mean Platelet Volume (MPV)", "Mean Platelet Volume", "MPV"]),
+    "PCT": ((0.150, 0.500), ["PCT", "Plateletcrit"]),
+}
+
+# Bump when parsing changes what is returned for the same text (part of the report cache key)
+PARSER_VERSION = "single-pass-3"
+
+NORMAL_RANGES = {name: normal_range for name, (normal_range, _) in LAB_TESTS.items()}
+
+# Counts reported in thousands / lakhs are scaled to the per-µL ranges above
+COUNT_TESTS = {"Total Leukocyte Count", "Platelet Count", "Absolute Neutrophil Count", "Absolute Lymphocyte Count",
+               "Absolute Eosinophil Count", "Absolute Monocyte Count", "Absolute Basophil Count"}
+# Differential counts printed as a count (a unit other than %, or a value no percentage can have) under
+# the percentage's name are checked against the absolute count's range
+ABSOLUTE_COUNTS = {"Neutrophils": "Absolute Neutrophil Count", "Lymphocytes": "Absolute Lymphocyte Count",
+                   "Eosinophils": "Absolute Eosinophil Count", "Monocytes": "Absolute Monocyte Count",
+                   "Basophils": "Absolute Basophil Count"}
+UNIT_SCALES = [
+    (re.compile(r"lakh", re.IGNORECASE), 100000),
+    (re.compile(r"10\s*\^?\s*(?:3|³)|thou|10\s*\^?\s*9\s*/\s*l\b", re.IGNORECASE), 1000),
+]
+
+ALIAS_TO_TEST = {alias.lower(): name for name, (_, aliases) in LAB_TESTS.items() for alias in aliases}
+
+
+def _trie_pattern(words):
+    # Alternation factored by common prefixes ("mch|mchc|mcv" -> "m(?:c(?:h(?:c)?|v))"), so the scan
+    # branches on one character at a time instead of retrying every alias at every position.
+    # Longer continuations are tried first, so the longest alias wins.
+    trie = {}
+    for word in words:
+        node = trie
+        for char in word:
+            node = node.setdefault(char, {})
+        node[""] = {}
+
+    def build(node):
+        branches = [re.escape(char) + build(child) for char, child in sorted(node.items()) if char]
+        if not branches:
+            return ""
+        pattern = branches[0] if len(branches) == 1 else "(?:" + "|".join(branches) + ")"
+        return f"(?:{pattern})?" if "" in node else pattern
+
+    return build(trie)
+
+
+# Thousands separators in western ("150,000") or Indian ("1,50,000") grouping
+NUMBER = r"(?:\d{1,3}(?:,\d{3})+|\d{1,2}(?:,\d{2})+,\d{3})(?:\.\d+)?|\d+(?:\.\d+)?"
+UNIT = (r"(?:gm?|mg)\s*%|%|fl\b|pg\b"
+        r"|(?:x\s*)?10\s*\^?\s*[0-9³⁶]+\s*/\s*[a-zµμ]+3?"
+        r"|[a-zµμ]*\s*/\s*[a-zµμ]+3?")
+
+# One pattern for every test: all aliases as a single trie, then only separators, table bars,
+# bracketed notes or h/l flags up to the value - which also matches tables whose cells come out
+# one per line - then an optional unit and printed reference range. Written in lower case and run
+# over the lower-cased text: much faster than re.IGNORECASE. The left word boundary is checked in
+# parse_lab_values, as a leading \b would stop re from skipping ahead to the aliases' first letters.
+LAB_VALUE = re.compile(
+    r"(?P<name>" + _trie_pattern(ALIAS_TO_TEST) + r")(?![\w])"
+    r"(?:[\s:=|*\-–]|\([^()\n\d]{0,30}\)|\b(?:h|l|high|low)\b)*"
+    r"(?P<value>" + NUMBER + r")"
+    r"(?:[^\S\n|]*\|?[^\S\n|]*\n?[^\S\n]*(?P<unit>" + UNIT + r"))?"
+    r"(?:[\s|]*(?P<low>" + NUMBER + r")\s*[-–]\s*(?P<high>" + NUMBER + r"))?"
+)
+# For the rare text whose lower-casing changes its length (and so the match offsets)
+LAB_VALUE_ANY_CASE = re.compile(LAB_VALUE.pattern, re.IGNORECASE)
+WHITESPACE = re.compile(r"\s+")
+
+
+class LabResult(namedtuple("LabResult", ["test", "value", "unit", "range", "status"])):
+    def describe(self):
+        unit = f" {self.unit}" if self.unit else ""
+        return f"{self.test} is {self.status} ({self.value:g}{unit}; normal {self.range[0]:g}–{self.range[1]:g})"
+
+
+def _number(text):
+    return float(text.replace(",", ""))
+
+
+def _scale(test, unit):
+    if test in COUNT_TESTS and unit:
+        for pattern, scale in UNIT_SCALES:
+            if pattern.search(unit):
+                return scale
+    return 1
+
+
+def parse_lab_values(text):
+    # Every recognised test value in the report, in order, without exact duplicates
+    lowered = text.lower()
+    pattern = LAB_VALUE
+    if len(lowered) != len(text):
+        lowered, pattern = text, LAB_VALUE_ANY_CASE
+    results = []
+    seen = set()
+    for match in pattern.finditer(lowered):
+        start = match.start()
+        if start and lowered[start - 1].isalnum():
+            continue
+        name, value, unit, low, high = match.group("name", "value", "unit", "low", "high")
+        test = ALIAS_TO_TEST[name.lower()]
+        # Units come from the original text, so they keep their case
+        unit = WHITESPACE.sub("", text[match.start("unit"):match.end("unit")]) if unit else ""
+        if test in ABSOLUTE_COUNTS and (unit not in ("", "%") or _number(value) > 100):
+            test = ABSOLUTE_COUNTS[test]
+        scale = _scale(test, unit)
+        if scale != 1:
+            unit = "/µL"
+        value = round(_number(value) * scale, 6)
+        if (test, value) in seen:
+            continue
+        seen.add((test, value))
+        if low:
+            # The report's own reference range, when printed next to the value
+            low, high = round(_number(low) * scale, 6), round(_number(high) * scale, 6)
+        else:
+            low, high = NORMAL_RANGES[test]
+        status = "low" if value < low else "high" if value > high else "normal"
+        results.append(LabResult(test, value, unit, (low, high), status))
+    return results
+
+
+def flag_abnormalities(text):
+    return [result for result in parse_lab_values(text) if result.status != "normal"]
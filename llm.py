@@ -0,0 +1,53 @@
+import os
+
+
+STREAM_RESPONSES = os.getenv("STREAM_RESPONSES", "1") != "0"
+
+
+class Provider:
+    def __init__(self, name, client, model):
+        self.name = name
+        self.client = client
+        self.model = model
+
+
+class LLMError(Exception):
+    def __init__(self, errors):
+        self.errors = errors
+        super().__init__("; ".join(f"{name}: {error}" for name, error in errors))
+
+
+def stream_provider(provider, messages, stream=STREAM_RESPONSES, timeout=None, cancel=None):
+    # Yields one provider's answer as text deltas (a single part when not streaming).
+    # `cancel` (a threading.Event) closes the HTTP stream early, e.g. when a hedged request lost.
+    if not stream:
+        response = provider.client.chat.completions.create(model=provider.model, messages=messages, timeout=timeout)
+        yield response.choices[0].message.content.strip()
+        return
+    response = provider.client.chat.completions.create(
+        model=provider.model, messages=messages, stream=True, timeout=timeout
+    )
+    try:
+        for chunk in response:
+            if cancel is not None and cancel.is_set():
+                return
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
+    finally:
+        response.close()
+
+
+def rate_limit_delay(error):
+    # Seconds to wait if `error` (or any provider error inside an LLMError) is an HTTP 429, else None.
+    # Uses the provider's Retry-After header when it sends one.
+    errors = [e for _, e in error.errors] if isinstance(error, LLMError) else [error]
+    delays = []
+    for e in errors:
+        if getattr(e, "status_code", None) != 429:
+            continue
+        headers = getattr(getattr(e, "response", None), "headers", None) or {}
+        try:
+            delays.append(float(headers.get("retry-after", 0)))
+        except ValueError:
+            delays.append(0.0)
+    return min(delays) if delays else None
@@ -0,0 +1,341 @@
+import hashlib
+import json
+import logging
+import os
+import queue
+import threading
+import time
+from collections import deque
+
+from llm import LLMError, STREAM_RESPONSES
+from llm_scheduler import PRIORITY_INTERACTIVE, RateLimited, get_scheduler
+from metrics import REGISTRY, count_error, observe_stage
+
+
+logger = logging.getLogger(__name__)
+
+LLM_DEADLINE = float(os.getenv("LLM_DEADLINE", "90"))
+LLM_HEDGE_DELAY = float(os.getenv("LLM_HEDGE_DELAY", "3"))
+LLM_BREAKER_FAILURES = int(os.getenv("LLM_BREAKER_FAILURES", "3"))
+LLM_BREAKER_COOLDOWN = float(os.getenv("LLM_BREAKER_COOLDOWN", "30"))
+
+
+class ProviderHealth:
+    # Circuit breaker plus an EWMA of time-to-first-token for one provider
+
+    def __init__(self, failure_threshold=LLM_BREAKER_FAILURES, cooldown=LLM_BREAKER_COOLDOWN, alpha=0.3):
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.alpha = alpha
+        self.lock = threading.Lock()
+        self.consecutive_failures = 0
+        self.opened_at = None
+        self.probing = False  # the single half-open trial request is in flight
+        self.ewma_ttft = None
+        self.successes = 0
+        self.failures = 0
+
+    def available(self):
+        # Closed, or open long enough that one trial request is allowed (half-open) and none is running
+        with self.lock:
+            return self.opened_at is None or (not self.probing and time.monotonic() - self.opened_at >= self.cooldown)
+
+    def claim(self):
+        # Called just before a request goes out: "closed", "probe" (this request is the half-open trial;
+        # others see the provider as unavailable until it succeeds or fails) or None
+        with self.lock:
+            if self.opened_at is None:
+                return "closed"
+            if self.probing or time.monotonic() - self.opened_at < self.cooldown:
+                return None
+            self.probing = True
+            return "probe"
+
+    def release_probe(self):
+        # The trial request ended without a verdict (cancelled, lost a hedge): let another one try
+        with self.lock:
+            self.probing = False
+
+    def record_latency(self, seconds):
+        with self.lock:
+            if self.ewma_ttft is None:
+                self.ewma_ttft = seconds
+            else:
+                self.ewma_ttft = self.alpha * seconds + (1 - self.alpha) * self.ewma_ttft
+
+    def record_success(self, ttft):
+        self.record_latency(ttft)
+        with self.lock:
+            self.successes += 1
+            self.consecutive_failures = 0
+            self.opened_at = None
+            self.probing = False
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            self.consecutive_failures += 1
+            self.probing = False
+            if self.consecutive_failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+
+    def score(self):
+        # Lower is better: seconds to first token plus a penalty of up to 10s for errors.
+        # Providers without samples score 0 and keep their configured order.
+        with self.lock:
+            total = self.successes + self.failures
+            error_rate = self.failures / total if total else 0.0
+            return (self.ewma_ttft or 0.0) + 10 * error_rate
+
+    def snapshot(self):
+        with self.lock:
+            return {"state": "closed" if self.opened_at is None else "open",
+                    "ewma_ttft": self.ewma_ttft, "successes": self.successes, "failures": self.failures}
+
+
+# Health is process-wide and keyed by provider name, so it survives Streamlit reruns
+_health = {}
+_health_lock = threading.Lock()
+
+
+def get_health(name):
+    with _health_lock:
+        if name not in _health:
+            _health[name] = ProviderHealth()
+        return _health[name]
+
+
+def health_snapshot():
+    with _health_lock:
+        return {name: health.snapshot() for name, health in _health.items()}
+
+
+class Flight:
+    # One upstream request and what it has produced so far, for everyone reading it
+    def __init__(self):
+        self.cond = threading.Condition()
+        self.parts = []
+        self.done = False
+        self.error = None
+        self.timings = {}
+        self.readers = 0
+
+
+class LLMRouter:
+    # Routes one chat request over several providers:
+    #  - the healthiest available provider goes first,
+    #  - if it has no first token after `hedge_delay`, the next one is fired too and the first to answer wins,
+    #  - a provider that errors before its first token is replaced immediately,
+    #  - the whole request (including streaming) must finish within `deadline`,
+    #  - every provider call waits its turn in the provider's scheduler (llm_scheduler.py),
+    #  - identical requests made while one is in flight share its answer instead of calling upstream again.
+
+    def __init__(self, providers, hedge_delay=LLM_HEDGE_DELAY, deadline=LLM_DEADLINE, stream=STREAM_RESPONSES):
+        self.providers = providers
+        self.hedge_delay = hedge_delay
+        self.deadline = deadline
+        self.stream_responses = stream
+        self.flights = {}  # request key -> Flight
+        self.flights_lock = threading.Lock()
+
+    def ordered_providers(self):
+        available = [p for p in self.providers if get_health(p.name).available()]
+        # With every breaker open, still try everything rather than fail without a request
+        candidates = available or list(self.providers)
+        # A provider holding its queue after a 429 goes last
+        return sorted(candidates, key=lambda p: (get_scheduler(p.name).backing_off(), get_health(p.name).score()))
+
+    def _run(self, provider, messages, events, cancel, deadline_at, priority, probe=False):
+        health = get_health(provider.name)
+        started = time.monotonic()
+        first_token = False
+        failed = False
+        try:
+            # Time waiting for rate-limit budget counts towards the first token, so a provider with a
+            # long queue gets hedged and scores worse, like a slow one
+            parts = get_scheduler(provider.name).stream(provider, messages, self.stream_responses, priority,
+                                                        cancel=cancel, deadline_at=deadline_at)
+            for part in parts:
+                if cancel.is_set():
+                    break
+                if not first_token:
+                    first_token = True
+                    health.record_success(time.monotonic() - started)
+                events.put(("token", provider.name, part))
+            if cancel.is_set() and not first_token:
+                # Lost the hedge: still a useful (lower-bound) latency sample
+                health.record_latency(time.monotonic() - started)
+            events.put(("done", provider.name, None))
+        except Exception as e:
+            if not cancel.is_set():
+                failed = True
+                health.record_failure()
+            events.put(("error", provider.name, e))
+        finally:
+            if probe and not first_token and not failed:
+                health.release_probe()
+
+    def stream(self, messages, timings=None, priority=PRIORITY_INTERACTIVE):
+        # Yields the answer as it streams in. The upstream request runs in its own thread, shared by
+        # every caller asking the same thing meanwhile; it is cancelled once no caller is reading.
+        timings = {} if timings is None else timings
+        key = hashlib.sha256(json.dumps(messages, sort_keys=True).encode("utf-8")).hexdigest()
+        with self.flights_lock:
+            flight = self.flights.get(key)
+            if flight is None:
+                flight = self.flights[key] = Flight()
+                threading.Thread(target=self._fly, args=(key, flight, messages, priority), daemon=True).start()
+            else:
+                timings["coalesced"] = True
+                REGISTRY.inc("wellai_llm_coalesced_total")
+            flight.readers += 1
+        try:
+            read = 0
+            while True:
+                with flight.cond:
+                    while read == len(flight.parts) and not flight.done:
+                        flight.cond.wait()
+                    parts = flight.parts[read:]
+                    finished = flight.done
+                for part in parts:
+                    yield part
+                read += len(parts)
+                if finished and read == len(flight.parts):
+                    break
+            timings.update(flight.timings)
+            if flight.error is not None:
+                raise flight.error
+        finally:
+            with self.flights_lock:
+                flight.readers -= 1
+
+    def _fly(self, key, flight, messages, priority):
+        parts = self._stream(messages, flight.timings, priority)
+        try:
+            for part in parts:
+                with flight.cond:
+                    flight.parts.append(part)
+                    flight.cond.notify_all()
+                with self.flights_lock:
+                    if not flight.readers:
+                        # Everyone stopped reading: cancel upstream; later identical requests start afresh
+                        self.flights.pop(key, None)
+                        break
+        except Exception as e:
+            flight.error = e
+        finally:
+            parts.close()
+            with self.flights_lock:
+                if self.flights.get(key) is flight:
+                    del self.flights[key]
+            with flight.cond:
+                flight.done = True
+                flight.cond.notify_all()
+
+    def _stream(self, messages, timings, priority):
+        timings["attempts"] = []
+        started = time.monotonic()
+        deadline_at = started + self.deadline
+        events = queue.Queue()
+        pending = deque(self.ordered_providers())
+        running = {}
+        errors = []
+        forced = False
+
+        def launch():
+            # Starts the next provider that admits a request; False when none is left
+            while pending:
+                provider = pending.popleft()
+                claim = get_health(provider.name).claim()
+                if claim is None and not forced:
+                    continue  # breaker open, or another request is its half-open trial
+                cancel = threading.Event()
+                running[provider.name] = cancel
+                timings["attempts"].append(provider.name)
+                REGISTRY.inc("wellai_llm_attempts_total", provider=provider.name)
+                args = (provider, messages, events, cancel, deadline_at, priority, claim == "probe")
+                threading.Thread(target=self._run, args=args, daemon=True).start()
+                return True
+            return False
+
+        def cancel_all(keep=None):
+            for name, cancel in running.items():
+                if name != keep:
+                    cancel.set()
+
+        try:
+            # Phase 1: wait for the first token, hedging and falling back as needed
+            if not launch():
+                # Every breaker is open (or in trial elsewhere): still try rather than fail without a request
+                forced = True
+                pending.extend(self.ordered_providers())
+                launch()
+            next_hedge = started + self.hedge_delay
+            winner = None
+            while winner is None:
+                now = time.monotonic()
+                if now >= deadline_at:
+                    timings["total"] = now - started
+                    # A provider still held after a 429 may not have reported its own timeout yet
+                    errors += [(name, RateLimited(name)) for name in running if get_scheduler(name).backing_off()]
+                    raise LLMError(errors + [("deadline", TimeoutError(f"no answer within {self.deadline:.0f}s"))])
+                wait_until = min(deadline_at, next_hedge) if pending else deadline_at
+                try:
+                    kind, name, payload = events.get(timeout=max(wait_until - now, 0.01))
+                except queue.Empty:
+                    if pending and time.monotonic() >= next_hedge:
+                        if launch():
+                            logger.info("No first token after %.1fs, hedging with %s", self.hedge_delay,
+                                        timings["attempts"][-1])
+                            timings["hedged"] = True
+                        next_hedge = time.monotonic() + self.hedge_delay
+                    continue
+                if name not in running:
+                    continue
+                if kind == "error":
+                    logger.warning("%s failed before the first token: %s", name, payload)
+                    errors.append((name, payload))
+                    del running[name]
+                    if launch():
+                        next_hedge = time.monotonic() + self.hedge_delay
+                    elif not running:
+                        timings["total"] = time.monotonic() - started
+                        raise LLMError(errors)
+                    continue
+                winner = name
+                cancel_all(keep=winner)
+                timings["provider"] = winner
+                timings["ttft"] = time.monotonic() - started
+                timings["fallbacks"] = len(timings["attempts"]) - 1
+                observe_stage("llm_ttft", timings["ttft"])
+                if winner != timings["attempts"][0]:
+                    REGISTRY.inc("wellai_llm_fallbacks_total", provider=winner)
+                if kind == "done":
+                    timings["total"] = timings["ttft"]
+                    observe_stage("llm_total", timings["total"])
+                    return
+                yield payload
+
+            # Phase 2: relay the winner's stream
+            while True:
+                remaining = deadline_at - time.monotonic()
+                try:
+                    kind, name, payload = events.get(timeout=max(remaining, 0.01))
+                except queue.Empty:
+                    raise TimeoutError(f"{winner} did not finish within {self.deadline:.0f}s")
+                if name != winner:
+                    continue
+                if kind == "error":
+                    raise payload
+                if kind == "done":
+                    break
+                yield payload
+            timings["total"] = time.monotonic() - started
+            observe_stage("llm_total", timings["total"])
+            logger.info("LLM %s: first token %.2fs, total %.2fs", winner, timings["ttft"], timings["total"])
+        except Exception:
+            count_error("llm_total")
+            raise
+        finally:
+            # Also runs when the caller stops reading early
+            cancel_all()
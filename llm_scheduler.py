@@ -0,0 +1,199 @@
+import heapq
+import itertools
+import logging
+import os
+import random
+import threading
+import time
+
+from llm import rate_limit_delay, stream_provider
+from metrics import REGISTRY
+from token_count import count_message_tokens
+
+
+logger = logging.getLogger(__name__)
+
+# Process-wide admission control in front of every chat-completion call (used by LLMRouter):
+#  - per-provider request and token budgets (token buckets refilled per minute),
+#  - waiting requests go in priority order, first come first served within a priority,
+#  - on HTTP 429 the provider's whole queue backs off (Retry-After when sent) and the request is retried.
+# Budgets are per process: with several replicas, give each its share of the account's limits.
+
+# Lower runs first
+PRIORITY_INTERACTIVE = 0  # chat answers and report follow-ups: a user is watching
+PRIORITY_SUMMARY = 1
+PRIORITY_BATCH = 2  # batch_reports.py
+
+
+def parse_rate_limits(spec):
+    # "GROQ=30/6000,DeepSeek=0/0" -> {"GROQ": (30, 6000), ...}: requests/min and tokens/min, 0 = no limit
+    limits = {}
+    for item in filter(None, (part.strip() for part in spec.split(","))):
+        name, _, value = item.partition("=")
+        requests, _, tokens = value.partition("/")
+        limits[name.strip()] = (int(requests or 0), int(tokens or 0))
+    return limits
+
+
+# Groq's free tier for llama3-70b-8192; OpenRouter has no fixed per-minute limit for paid models
+LLM_RATE_LIMITS = parse_rate_limits(os.getenv("LLM_RATE_LIMITS", "GROQ=30/6000"))
+# Reply tokens reserved per request on top of the prompt (streamed replies don't report usage)
+LLM_COMPLETION_TOKENS = int(os.getenv("LLM_COMPLETION_TOKENS", "700"))
+# Backoff after a 429 that came without Retry-After: base * 2^retry, capped, with jitter
+LLM_BACKOFF_BASE = float(os.getenv("LLM_BACKOFF_BASE", "1"))
+LLM_BACKOFF_MAX = float(os.getenv("LLM_BACKOFF_MAX", "20"))
+# How often a waiting request checks whether it was cancelled (a lost hedge)
+POLL_INTERVAL = 0.1
+
+
+class RequestCancelled(Exception):
+    pass
+
+
+class RateLimited(TimeoutError):
+    # The deadline passed while the provider's queue was held after a 429. Looks like the 429 itself to
+    # rate_limit_delay (status code and Retry-After of the last one this request got, if any).
+    status_code = 429
+
+    def __init__(self, name, error=None):
+        self.error = error
+        self.response = getattr(error, "response", None)
+        super().__init__(f"{name}: still rate-limited at the deadline" + (f" ({error})" if error else ""))
+
+
+class TokenBucket:
+    # `per_minute` units, refilled continuously. A request bigger than the whole bucket waits for
+    # a full bucket and leaves it in debt, so it delays what comes next instead of never running.
+
+    def __init__(self, per_minute):
+        self.capacity = float(per_minute)
+        self.rate = per_minute / 60.0
+        self.level = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now):
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount, now):
+        self._refill(now)
+        missing = min(amount, self.capacity) - self.level
+        return max(missing / self.rate, 0.0)
+
+    def take(self, amount):
+        self.level -= amount
+
+
+class ProviderScheduler:
+    def __init__(self, name, requests_per_minute=0, tokens_per_minute=0):
+        self.name = name
+        self.requests = TokenBucket(requests_per_minute) if requests_per_minute else None
+        self.tokens = TokenBucket(tokens_per_minute) if tokens_per_minute else None
+        self.cond = threading.Condition()
+        self.waiting = []  # heap of (priority, arrival)
+        self.arrivals = itertools.count()
+        self.blocked_until = 0.0
+        self.backoffs = 0
+
+    def _wait_time(self, tokens, now):
+        waits = [self.blocked_until - now]
+        if self.requests:
+            waits.append(self.requests.wait_time(1, now))
+        if self.tokens:
+            waits.append(self.tokens.wait_time(tokens, now))
+        return max(max(waits), 0.0)
+
+    def _update_depth(self):
+        REGISTRY.set_gauge("wellai_llm_queue_depth", len(self.waiting), provider=self.name)
+
+    def acquire(self, tokens, priority=PRIORITY_INTERACTIVE, cancel=None, deadline_at=None):
+        # Blocks until this request is first in line and within budget; returns the seconds waited
+        ticket = (priority, next(self.arrivals))
+        started = time.monotonic()
+        with self.cond:
+            heapq.heappush(self.waiting, ticket)
+            self._update_depth()
+            try:
+                while True:
+                    now = time.monotonic()
+                    if cancel is not None and cancel.is_set():
+                        raise RequestCancelled(self.name)
+                    if deadline_at is not None and now >= deadline_at:
+                        if now < self.blocked_until:
+                            raise RateLimited(self.name)
+                        raise TimeoutError(f"{self.name}: no rate-limit budget within the deadline")
+                    wait = self._wait_time(tokens, now) if self.waiting[0] == ticket else POLL_INTERVAL
+                    if wait <= 0:
+                        if self.requests:
+                            self.requests.take(1)
+                        if self.tokens:
+                            self.tokens.take(tokens)
+                        break
+                    if deadline_at is not None:
+                        wait = min(wait, deadline_at - now)
+                    self.cond.wait(timeout=max(min(wait, POLL_INTERVAL), 0.001))
+            finally:
+                self.waiting.remove(ticket)
+                heapq.heapify(self.waiting)
+                self._update_depth()
+                # The next in line may be able to go now
+                self.cond.notify_all()
+        waited = time.monotonic() - started
+        REGISTRY.observe("wellai_llm_queue_wait_seconds", waited, provider=self.name)
+        return waited
+
+    def back_off(self, retry_after=None):
+        # A 429: hold every request to this provider, not just the one that got it
+        with self.cond:
+            if retry_after is None:
+                retry_after = min(LLM_BACKOFF_BASE * 2 ** self.backoffs, LLM_BACKOFF_MAX) * random.uniform(0.8, 1.2)
+            self.backoffs += 1
+            self.blocked_until = max(self.blocked_until, time.monotonic() + retry_after)
+            self.cond.notify_all()
+        REGISTRY.inc("wellai_llm_rate_limited_total", provider=self.name)
+        logger.warning("%s rate-limited; holding its queue for %.1fs", self.name, retry_after)
+        return retry_after
+
+    def record_success(self):
+        with self.cond:
+            self.backoffs = 0
+
+    def backing_off(self):
+        return time.monotonic() < self.blocked_until
+
+    def stream(self, provider, messages, stream=True, priority=PRIORITY_INTERACTIVE, cancel=None, deadline_at=None):
+        # stream_provider behind the budget, retrying 429s that arrive before the first token
+        tokens = count_message_tokens(messages, [provider.model]) + LLM_COMPLETION_TOKENS
+        rate_limited = None  # the last 429 this request got
+        while True:
+            try:
+                self.acquire(tokens, priority, cancel, deadline_at)
+            except TimeoutError as e:
+                if rate_limited is None:
+                    raise
+                raise RateLimited(self.name, rate_limited) from e
+            timeout = max(deadline_at - time.monotonic(), 0.1) if deadline_at is not None else None
+            started = False
+            try:
+                for part in stream_provider(provider, messages, stream, timeout=timeout, cancel=cancel):
+                    started = True
+                    yield part
+                self.record_success()
+                return
+            except Exception as e:
+                delay = rate_limit_delay(e)
+                if started or delay is None:
+                    raise
+                rate_limited = e
+                self.back_off(delay or None)
+
+
+_schedulers = {}
+_schedulers_lock = threading.Lock()
+
+
+def get_scheduler(name):
+    with _schedulers_lock:
+        if name not in _schedulers:
+            _schedulers[name] = ProviderScheduler(name, *LLM_RATE_LIMITS.get(name, (0, 0)))
+        return _schedulers[name]
@@ -1,91 +1,18 @@
-def run():
-    import streamlit as st
-    from reportlab.lib.pagesizes import letter
-    from reportlab.pdfgen import canvas
-    from reportlab.lib.units import inch
-    from io import BytesIO
-    from datetime import datetime
-    import pandas as pd
-    import numpy as np
-    import os
-    from dotenv import load_dotenv
-    from openai import OpenAI
-    from langchain_community.vectorstores import FAISS
-    from langchain.embeddings import HuggingFaceEmbeddings
-    # Load environment variables
-    import streamlit as st
-
-    load_dotenv()
-    GROQ_API = os.getenv("GROQ_API")
-    DEEPSEEK_API = os.getenv("DEEPSEEK_API")
-    print("GROQ API:", os.getenv("GROQ_API"))
-    print("DEEPSEEK API:", os.getenv("DEEPSEEK_API"))
-    # Create OpenAI-compatible clients
-    groq_client = OpenAI(api_key=GROQ_API, base_url="https://api.groq.com/openai/v1")
-    deepseek_client = OpenAI(api_key=DEEPSEEK_API, base_url="https://openrouter.ai/api/v1")
-
-
-    def create_chat_pdf(history):
-        buffer = BytesIO()
-        c = canvas.Canvas(buffer, pagesize=letter)
-        width, height = letter
-        margin = 40
-        y = height - margin
-
-        # 🔹 Title
-        c.setFont("Helvetica-Bold", 14)
-        c.drawString(margin, y, "📚 RAG Medical Chatbot – Conversation History")
-        y -= 20
-
-        # 🔹 Date/Time
-        c.setFont("Helvetica", 10)
-        now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        c.drawString(margin, y, f"Exported on: {now}")
-        y -= 30
-
-        # 🔹 Page tracker
-        page_num = 1
-        c.setFont("Helvetica", 11)
-
-        for i, (q, a) in enumerate(history, 1):
-            if y < margin + 100:
-                # Footer
-                c.setFont("Helvetica-Oblique", 8)
-                c.drawRightString(width - margin, margin / 2, f"Page {page_num}")
-                c.showPage()
-                page_num += 1
-                c.setFont("Helvetica", 11)
-                y = height - margin
-
-            c.setFont("Helvetica-Bold", 11)
-            c.drawString(margin, y, f"🧑 Q{i}: {q}")
-            y -= 18
-
-            c.setFont("Helvetica", 11)
-            for line in a.split("\n"):
-                if y < margin + 50:
-                    # Footer
-                    c.setFont("Helvetica-Oblique", 8)
-                    c.drawRightString(width - margin, margin / 2, f"Page {page_num}")
-                    c.showPage()
-                    page_num += 1
-                    c.setFont("Helvetica", 11)
-                    y = height - margin
-
-                c.drawString(margin + 20, y, f"🤖 {line}")
-                y -= 16
-
-            y -= 14
-
-        # Final footer
-        c.setFont("Helvetica-Oblique", 8)
-        c.drawRightString(width - margin, margin / 2, f"Page {page_num}")
-
-        c.save()
-        buffer.seek(0)
-        return buffer
+import streamlit as st
+
+from answer_cache import get_answer_cache, context_ids, is_context_dependent
+from chat_export import ChatExport, EXPORT_FORMATS
+from chat_sessions import ChatSession
+from clients import get_router, get_vector_store
+from llm import LLMError
+from llm_scheduler import RateLimited
+from metrics import span
 
 
+# Imported once, on first entry to the chatbot; heavier modules (FAISS, reportlab) load where they're used.
+# API keys, pooled HTTP clients, the embedding model and the index are loaded once per process in clients.py,
+# usually already warmed up in the background by home.py.
+def run():
     #  MUST be first Streamlit command
     #st.set_page_config(page_title="Medical Chatbot", layout="centered")
 
@@ -96,30 +23,34 @@ def run():
 
 
 
-    # Load FAISS Vector DB
-    @st.cache_resource
+    # Load FAISS Vector DB (process-wide, see clients.get_vector_store)
     def load_vector_db():
-        embeddings = HuggingFaceEmbeddings(model_name="sentence-transformers/all-MiniLM-L6-v2")
-        return FAISS.load_local(DB_FAISS_PATH, embeddings, allow_dangerous_deserialization=True)
+        return get_vector_store(DB_FAISS_PATH)
 
     #db = load_vector_db()
 
-    #  Initialize session state for chat
-    if "history" not in st.session_state:
-        st.session_state.history = []
+    #  Initialize session state for chat: the conversation lives in SQLite (chat_sessions.py) and is
+    #  resumed from the ?chat= URL parameter after a reload
+    if "chat" not in st.session_state:
+        st.session_state.chat = ChatSession.open(st.query_params.get("chat"), kind="chatbot")
+        st.session_state.older_pages = 0
+    chat = st.session_state.chat
+    st.query_params["chat"] = chat.session_id
 
     if "injected_prompt" not in st.session_state:
         st.session_state.injected_prompt = None
         
 
-    def get_similar_docs(query, k=3):
+    def get_similar_docs(query, k=3, embedding=None):
         db = load_vector_db()  
-        results = db.similarity_search(query, k=k)
+        if embedding is None:
+            embedding = db.embeddings.embed_query(query)
+        results = db.similarity_search_by_vector(embedding, k=k)
         return [doc.page_content for doc in results]
 
 
-    # Chatbot with RAG + DeepSeek
-    def generate_rag_response(user_query):
+    # Chatbot with RAG + DeepSeek (yields the answer as it is generated)
+    def generate_rag_response(user_query, timings=None):
         casual_responses = {
             "hi": "Hello! How can I assist you with a medical question today?",
             "hello": " Hello! How can I assist you?",
@@ -137,14 +68,32 @@ def run():
 
         normalized_input = user_query.lower().strip()
         if normalized_input in casual_responses:
-            return casual_responses[normalized_input]
+            yield casual_responses[normalized_input]
+            return
 
         if len(user_query.strip()) < 5:
-            return "Could you please ask a more specific medical question?"
-
-        context_docs = get_similar_docs(user_query)
+            yield "Could you please ask a more specific medical question?"
+            return
+
+        db = load_vector_db()
+        with span("query_embedding"):
+            query_embedding = db.embeddings.embed_query(user_query)
+        with span("similarity_search"):
+            context_docs = get_similar_docs(user_query, embedding=query_embedding)
         context = "\n\n".join(context_docs)
 
+        # Semantic answer cache: same meaning + same retrieved chunks -> reuse the answer
+        answer_cache = get_answer_cache()
+        cache_key = context_ids(context_docs)
+        use_cache = not is_context_dependent(user_query, chat)
+        if use_cache:
+            cached_answer = answer_cache.get(query_embedding, cache_key)
+            if cached_answer is not None:
+                yield cached_answer
+                return
+        else:
+            answer_cache.bypass()
+
         messages = [
             {
                 "role": "system",
@@ -159,30 +108,31 @@ def run():
             }
         ]
 
-        for q, a in st.session_state.history[-5:]:
-            messages.append({"role": "user", "content": q})
-            messages.append({"role": "assistant", "content": a})
+        # Summary of the earlier conversation plus the latest turns, within HISTORY_TOKEN_BUDGET
+        messages.extend(chat.context_messages([provider.model for provider in get_router().providers]))
 
         messages.append({"role": "user", "content": user_query})
 
-        # Try GROQ first
+        # GROQ first; DeepSeek is fired too if GROQ fails or has no first token within the hedge delay
+        parts = []
         try:
-            response = groq_client.chat.completions.create(
-                model= "llama3-70b-8192", #command-r-plus  #"mixtral-8x7b-32768", mixtral-8x7b-instruct
-                messages=messages
-            )
-            return response.choices[0].message.content.strip()
-        
-        # On failure, fallback to DeepSeek
-        except Exception as groq_error:
-            try:
-                response = deepseek_client.chat.completions.create(
-                    model="deepseek/deepseek-chat",
-                    messages=messages
-                )
-                return response.choices[0].message.content.strip()
-            except Exception as deepseek_error:
-                return f" Both GROQ and DeepSeek failed. Details:\n- GROQ: {groq_error}\n- DeepSeek: {deepseek_error}"
+            for part in get_router().stream(messages, timings):
+                parts.append(part)
+                yield part
+        except LLMError as e:
+            if any(isinstance(error, RateLimited) for _, error in e.errors):
+                # The scheduler already waited and retried within the deadline
+                yield " The assistant is handling a lot of questions right now. Please try again in a minute."
+                return
+            details = "\n".join(f"- {name}: {error}" for name, error in e.errors)
+            yield f" Both GROQ and DeepSeek failed. Details:\n{details}"
+            return
+        except Exception as e:
+            yield f"\n\n Response interrupted: {e}"
+            return
+
+        if use_cache:
+            answer_cache.put(query_embedding, cache_key, "".join(parts).strip())
 
 
 
@@ -228,26 +178,48 @@ def run():
         st.markdown("## 🧠 WellAI Info")
         st.markdown("Powered by advanced AI, this assistant answers medical questions using knowledge from curated medical textbooks.")
 
+        cache_stats = get_answer_cache().stats()
+        st.caption(
+            f"Answer cache: {cache_stats['hits']} hits / {cache_stats['misses']} misses "
+            f"({cache_stats['hit_rate']:.0%}), {cache_stats['bypassed']} bypassed, "
+            f"threshold {cache_stats['threshold']:.2f}"
+        )
+
         if st.button(" Clear Chat History"):
-            st.session_state.history = []
+            chat.clear()
+            st.query_params["chat"] = chat.session_id
+            st.session_state.older_pages = 0
+            st.session_state.pop("chat_export", None)
+            st.session_state.pop("export_version", None)
             st.success("History cleared! Refreshing...")
             st.rerun()
 
-        if st.session_state.get("history") and len(st.session_state.history) > 0:
-            disabled = len(st.session_state.get("history", [])) == 0
-            pdf_buffer = create_chat_pdf(st.session_state.history) if not disabled else BytesIO()
-            st.download_button(
-                "⬇️ Export Chat as PDF",
-                data=pdf_buffer,
-                file_name="chat_history.pdf",
-                mime="application/pdf",
-                disabled=disabled
-            )
+        # The export is only built when asked for, and only for the turns added since the last one
+        if len(chat):
+            export_format = st.selectbox("Export format", list(EXPORT_FORMATS), key="export_format")
+            if st.button("Prepare export"):
+                st.session_state.export_version = (export_format, len(chat))
+            if st.session_state.get("export_version") == (export_format, len(chat)):
+                extension, mime = EXPORT_FORMATS[export_format]
+                if "chat_export" not in st.session_state:
+                    st.session_state.chat_export = ChatExport()
+                export = st.session_state.chat_export
+                st.download_button(
+                    f"⬇️ Download Chat as {export_format}",
+                    data=export.export(chat, export_format),
+                    file_name=f"chat_history.{extension}",
+                    mime=mime
+                )
 
 
 
-    # Display chat history 
-    for q, a in st.session_state.history:
+    # Display chat history: the in-memory window, plus older turns a page at a time on request
+    _, older = chat.older_turns(st.session_state.older_pages)
+    hidden = chat.window_start - len(older)
+    if hidden and st.button(f"Show earlier messages ({hidden} more)"):
+        st.session_state.older_pages += 1
+        st.rerun()
+    for q, a in older + chat[chat.window_start:]:
         with st.chat_message("user"):
             st.markdown(q)
         with st.chat_message("assistant"):
@@ -265,11 +237,18 @@ def run():
         with st.chat_message("user"):
             st.markdown(prompt)
 
-        with st.spinner("Thinking..."):
-            answer = generate_rag_response(prompt)
-            st.session_state.history.append((prompt, answer))
-
+        # Tokens are rendered as they arrive; the assembled text goes into the history
+        timings = {}
         with st.chat_message("assistant"):
-            st.markdown(answer)
+            with st.spinner("Thinking..."):
+                answer = st.write_stream(generate_rag_response(prompt, timings))
+            if "ttft" in timings:
+                st.caption(f"⏱ first token {timings['ttft']:.1f}s · total {timings['total']:.1f}s")
+        chat.append(prompt, answer.strip())
+        # A new session id when this one was deleted meanwhile (cleared in another tab, or pruned)
+        st.query_params["chat"] = chat.session_id
+        # Turns that no longer fit the history budget are summarized in the background
+        chat.maybe_fold(get_router())
+        st.session_state.last_llm_timings = timings
 
 
@@ -1,46 +1,344 @@
-from langchain_community.document_loaders import PyPDFLoader, DirectoryLoader
-from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain_huggingface import HuggingFaceEmbeddings
+import argparse
+import hashlib
+import json
+import os
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import faiss
+import numpy as np
+from pypdf import PdfReader
+from langchain_core.documents import Document
 from langchain_community.vectorstores import FAISS
 
-## Uncomment the following files if you're not using pipenv as your virtual environment manager
-#from dotenv import load_dotenv, find_dotenv
-#load_dotenv(find_dotenv())
+from chunker import Deduplicator, chunk_text, chunker_settings, strip_boilerplate
+from embedding_model import embedding_id, get_embedding_model
+from vector_index import INDEX_TYPES, index_config, build_index, flat_vectors, is_exact, is_flat, training_size
+from vector_store import store_exists, store_stats, current_build, new_build, write_store, publish_build, load_langchain_store
 
 
-# Step 1: Load raw PDF(s)
 DATA_PATH="data/"
-def load_pdf_files(data):
-    loader = DirectoryLoader(data,
-                             glob='*.pdf',
-                             loader_cls=PyPDFLoader)
-    
-    documents=loader.load()
-    return documents
+DB_FAISS_PATH="vectorstore/db_faiss"
+MANIFEST_FILE="manifest.json"
+DEDUP_FILE="dedup.npz"
+PAGES_PER_TASK=25
+BATCH_SIZE=256
+
+
+# Step 1: Load raw PDF(s)
+def list_pdf_files(data):
+    # Same selection DirectoryLoader(glob='*.pdf') used: top-level PDFs only
+    return sorted(
+        name for name in os.listdir(data)
+        if name.lower().endswith(".pdf") and os.path.isfile(os.path.join(data, name))
+    )
+
+def file_hash(path):
+    digest=hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+def count_pages(path):
+    return len(PdfReader(path).pages)
 
-documents=load_pdf_files(data=DATA_PATH)
-#print("Length of PDF pages: ", len(documents))
+def split_page_ranges(page_count, pages_per_task=PAGES_PER_TASK):
+    # Big textbooks are split into page ranges so a single file still spreads over all cores
+    return [(start, min(start + pages_per_task, page_count)) for start in range(0, page_count, pages_per_task)]
 
 
 # Step 2: Create Chunks
 def create_chunks(extracted_data):
-    text_splitter=RecursiveCharacterTextSplitter(chunk_size=500,
-                                                 chunk_overlap=50)
-    text_chunks=text_splitter.split_documents(extracted_data)
-    return text_chunks
+    # Sentence-packed, token-counted chunks (chunker.py); each keeps its page's metadata
+    return [
+        Document(page_content=text, metadata=dict(document.metadata))
+        for document in extracted_data
+        for text in chunk_text(document.page_content)
+    ]
 
-text_chunks=create_chunks(extracted_data=documents)
-#print("Length of Text Chunks: ", len(text_chunks))
+def make_chunk_ids(name, digest, page, text_chunks):
+    # IDs are derived from the file name and content, so an unchanged file keeps its IDs across runs
+    # and two copies of one PDF under different names never share (or delete) each other's chunks
+    name_hash=hashlib.sha256(name.encode("utf-8")).hexdigest()[:8]
+    return [f"{name_hash}-{digest[:16]}-{page}-{i}" for i in range(len(text_chunks))]
 
-# Step 3: Create Vector Embeddings 
+def parse_page_range(task):
+    # Runs in a worker process: parse and chunk one page range, return plain tuples.
+    # Headers and footers repeated across the range are stripped before chunking.
+    name, path, digest, start, end = task
+    started=time.perf_counter()
+    reader=PdfReader(path)
+    pages, boilerplate=strip_boilerplate([reader.pages[page].extract_text() or "" for page in range(start, end)])
+    chunks=[]
+    for page, text in zip(range(start, end), pages):
+        page_chunks=create_chunks([Document(page_content=text, metadata={"source": path, "page": page})])
+        for chunk_id, chunk in zip(make_chunk_ids(name, digest, page, page_chunks), page_chunks):
+            chunks.append((chunk_id, chunk.page_content, chunk.metadata))
+    return name, chunks, end - start, time.perf_counter() - started, boilerplate
 
-def get_embedding_model():
-    embedding_model=HuggingFaceEmbeddings(model_name="sentence-transformers/all-MiniLM-L6-v2")
-    return embedding_model
+def stream_chunks(tasks, workers, stats):
+    # Keep only a few page ranges in flight so memory is bounded by the window, not the corpus
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        pending=deque()
+        task_iter=iter(tasks)
+        for task in task_iter:
+            pending.append(pool.submit(parse_page_range, task))
+            if len(pending) >= workers * 2:
+                break
+        while pending:
+            name, chunks, pages, seconds, boilerplate = pending.popleft().result()
+            for task in task_iter:
+                pending.append(pool.submit(parse_page_range, task))
+                break
+            stats["parse"].add(pages, len(chunks), seconds)
+            stats["boilerplate_lines"]+=boilerplate
+            for chunk_id, text, metadata in chunks:
+                yield name, chunk_id, Document(page_content=text, metadata=metadata)
 
-embedding_model=get_embedding_model()
+def deduplicate(chunks, dedup, files):
+    # Exact and near-duplicate chunks (across every file and the chunks already stored) are never embedded.
+    # A dropped chunk is recorded in its file's manifest entry with the chunk it repeats.
+    for name, chunk_id, document in chunks:
+        duplicate=dedup.check(document.page_content, chunk_id)
+        if duplicate is None:
+            yield name, chunk_id, document
+        else:
+            files[name]["duplicates"][chunk_id]=duplicate[1]
 
-# Step 4: Store embeddings in FAISS
-DB_FAISS_PATH="vectorstore/db_faiss"
-db=FAISS.from_documents(text_chunks, embedding_model)
-db.save_local(DB_FAISS_PATH)
\ No newline at end of file
+def batched(iterable, size):
+    batch=[]
+    for item in iterable:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch=[]
+    if batch:
+        yield batch
+
+
+class StageStats:
+    # `per_worker`: seconds are summed over the pool's tasks (busy time per worker, not wall-clock time),
+    # so rates are per worker process
+    def __init__(self, name, per_worker=False):
+        self.name=name
+        self.per_worker=per_worker
+        self.pages=0
+        self.chunks=0
+        self.seconds=0.0
+
+    def add(self, pages, chunks, seconds):
+        self.pages+=pages
+        self.chunks+=chunks
+        self.seconds+=seconds
+
+    def report(self):
+        seconds=max(self.seconds, 1e-9)
+        unit, rate=(" worker-seconds", "/s per worker") if self.per_worker else ("s", "/s")
+        if not self.pages:
+            return f"{self.name}: {self.chunks} chunks in {self.seconds:.1f}{unit} ({self.chunks / seconds:.1f} chunks{rate})"
+        return (f"{self.name}: {self.pages} pages, {self.chunks} chunks in {self.seconds:.1f}{unit} "
+                f"({self.pages / seconds:.1f} pages{rate}, {self.chunks / seconds:.1f} chunks{rate})")
+
+
+# Step 3: Create Vector Embeddings
+# get_embedding_model() (embedding_model.py) goes through the on-disk embedding cache,
+# so re-chunking or re-running ingestion only embeds text that was never seen before
+
+
+# Step 4: Manifest of what is already in the index
+def manifest_settings():
+    # Anything that changes chunk boundaries or vectors invalidates every stored chunk
+    return {"model": embedding_id(), **chunker_settings()}
+
+def load_manifest(db_path):
+    path=os.path.join(db_path, MANIFEST_FILE)
+    # Stores in the old pickle layout have no chunk files and are rebuilt once
+    if not os.path.exists(path) or not store_exists(db_path):
+        return None
+    with open(path, "r", encoding="utf-8") as f:
+        manifest=json.load(f)
+    if manifest.get("settings") != manifest_settings():
+        return None
+    return manifest
+
+def save_manifest(db_path, files, index):
+    os.makedirs(db_path, exist_ok=True)
+    path=os.path.join(db_path, MANIFEST_FILE)
+    tmp_path=path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump({"settings": manifest_settings(), "index": index, "files": files}, f, indent=2)
+    os.replace(tmp_path, path)
+
+def restore_flat_index(db, embedding_model):
+    # IVF/HNSW/PQ indexes can't delete in place; go back to a flat index in docstore order before editing
+    # the store. IVF-Flat and HNSW hand their vectors back exactly; PQ / SQ codes lose precision, so those
+    # vectors are embedded again (from the embedding cache)
+    flat=faiss.IndexFlatL2(db.index.d)
+    if is_exact(db.index):
+        flat.add(flat_vectors(db.index))
+    else:
+        texts=[db.docstore.search(db.index_to_docstore_id[i]).page_content for i in range(db.index.ntotal)]
+        if texts:
+            flat.add(np.array(embedding_model.embed_documents(texts), dtype=np.float32))
+    db.index=flat
+
+
+# Step 5: Store embeddings in FAISS (only for new or changed files), batch by batch
+def update_vector_store(data_path=DATA_PATH, db_path=DB_FAISS_PATH, full=False,
+                        workers=None, batch_size=BATCH_SIZE, index=None):
+    workers=workers or os.cpu_count() or 1
+    # Everything is read from the build published now; the new one (store, dedup state and manifest together)
+    # replaces it in a single step at the end
+    current=current_build(db_path)
+    before=store_stats(current)
+    manifest=None if full else load_manifest(current)
+    old_files=manifest["files"] if manifest else {}
+    # Without an explicit choice, keep the index family the store was built with
+    old_index=manifest.get("index", index_config()) if manifest else None
+    index=index or old_index or index_config()
+
+    new_files={}
+    for name in list_pdf_files(data_path):
+        digest=file_hash(os.path.join(data_path, name))
+        previous=old_files.get(name)
+        if previous and previous["sha256"] == digest:
+            new_files[name]=previous
+        else:
+            new_files[name]={"sha256": digest, "chunk_ids": [], "duplicates": {}}
+
+    # Chunks of removed files and the old version of changed files. An unchanged file whose chunks were
+    # dropped as duplicates of a stale chunk is parsed again, so those chunks can take its place
+    # (its own chunks become stale in turn).
+    stale_ids=set()
+    requeue=[name for name, entry in old_files.items() if new_files.get(name) is not entry]
+    while requeue:
+        for name in requeue:
+            stale_ids.update(old_files[name]["chunk_ids"])
+            if name in new_files and new_files[name] is old_files[name]:
+                new_files[name]={"sha256": old_files[name]["sha256"], "chunk_ids": [], "duplicates": {}}
+        requeue=[
+            name for name, entry in new_files.items()
+            if entry is old_files.get(name)
+            and any(original in stale_ids for original in entry.get("duplicates", {}).values())
+        ]
+
+    tasks=[]
+    kept=0
+    for name, entry in new_files.items():
+        if entry is old_files.get(name):
+            kept+=len(entry["chunk_ids"])
+            continue
+        path=os.path.join(data_path, name)
+        for start, end in split_page_ranges(count_pages(path)):
+            tasks.append((name, path, entry["sha256"], start, end))
+
+    stats={"added": 0, "removed": len(stale_ids), "kept": kept, "boilerplate_lines": 0,
+           "dedup": {"unique": 0, "exact": 0, "near": 0}, "before": before, "after": before,
+           "parse": StageStats("parse", per_worker=True), "embed": StageStats("embed"), "index_fallback": None}
+
+    if manifest is not None and not tasks and not stale_ids and index == old_index:
+        return stats
+
+    embedding_model=get_embedding_model()
+    db=None
+    dedup=Deduplicator()
+    if manifest is not None:
+        db=load_langchain_store(current, embedding_model)
+        if not is_flat(db.index):
+            restore_flat_index(db, embedding_model)
+        if stale_ids:
+            db.delete(list(stale_ids))
+        # New chunks that repeat ones already stored are dropped too. The stored chunks' signatures are
+        # saved with the store; a store without them has them computed once, here.
+        stored_ids=list(db.index_to_docstore_id.values())
+        saved=Deduplicator.load(os.path.join(current, DEDUP_FILE))
+        if saved is None:
+            dedup.seed((chunk_id, db.docstore.search(chunk_id).page_content) for chunk_id in stored_ids)
+        else:
+            dedup=saved
+            dedup.retain(stored_ids)
+    stats["dedup"]=dedup.stats
+
+    chunks=deduplicate(stream_chunks(tasks, workers, stats), dedup, new_files)
+    for batch in batched(chunks, batch_size):
+        documents=[document for _, _, document in batch]
+        ids=[chunk_id for _, chunk_id, _ in batch]
+        started=time.perf_counter()
+        if db is None:
+            db=FAISS.from_documents(documents, embedding_model, ids=ids)
+        else:
+            db.add_documents(documents, ids=ids)
+        stats["embed"].add(0, len(batch), time.perf_counter() - started)
+        for name, chunk_id, _ in batch:
+            new_files[name]["chunk_ids"].append(chunk_id)
+        stats["added"]+=len(batch)
+
+    if db is None:
+        print("No PDF chunks found in", data_path)
+        return stats
+
+    if index["type"] != "flat" and db.index.ntotal < training_size(index):
+        # Too few vectors to train on (down to none once every PDF is removed): keep the flat index. The
+        # manifest still asks for the requested type, which is built once there are enough vectors
+        stats["index_fallback"]=(index["type"], db.index.ntotal, training_size(index))
+    elif index["type"] != "flat":
+        started=time.perf_counter()
+        db.index=build_index(flat_vectors(db.index), index)
+        print(f"Built {index['type']} index over {db.index.ntotal} vectors in {time.perf_counter() - started:.1f}s")
+
+    build=new_build(db_path)
+    write_store(db, build)
+    dedup.save(os.path.join(build, DEDUP_FILE))
+    save_manifest(build, new_files, index)
+    publish_build(db_path, build)
+    stats["after"]=store_stats(build)
+    return stats
+
+def shrink_report(stats):
+    dedup=stats["dedup"]
+    lines=[f"Boilerplate lines stripped: {stats['boilerplate_lines']}; "
+           f"duplicate chunks dropped: {dedup['exact']} exact, {dedup['near']} near "
+           f"(of {dedup['unique'] + dedup['exact'] + dedup['near']} new chunks)"]
+    if stats["index_fallback"]:
+        index_type, count, needed=stats["index_fallback"]
+        lines.append(f"Saved a flat index instead of {index_type}: {count} vectors, {index_type} needs {needed} to train")
+    if stats["before"] and stats["after"]:
+        (old_chunks, old_bytes), (new_chunks, new_bytes) = stats["before"], stats["after"]
+        lines.append(f"Index: {old_chunks} -> {new_chunks} chunks ({new_chunks / max(old_chunks, 1) - 1:+.1%}), "
+                     f"{old_bytes / 1e6:.1f} -> {new_bytes / 1e6:.1f} MB ({new_bytes / max(old_bytes, 1) - 1:+.1%})")
+    elif stats["after"]:
+        lines.append(f"Index: {stats['after'][0]} chunks, {stats['after'][1] / 1e6:.1f} MB")
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    parser=argparse.ArgumentParser(description="Build or update the FAISS store from the PDFs in data/")
+    parser.add_argument("--data", default=DATA_PATH, help="directory with the source PDFs")
+    parser.add_argument("--db", default=DB_FAISS_PATH, help="FAISS store directory")
+    parser.add_argument("--full", action="store_true", help="ignore the manifest and rebuild from scratch")
+    parser.add_argument("--workers", type=int, default=None, help="PDF parser processes (default: all cores)")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE, help="chunks embedded per batch")
+    parser.add_argument("--index", choices=INDEX_TYPES, default=None,
+                        help="FAISS index family (default: keep the current one, flat for a new store)")
+    parser.add_argument("--nlist", type=int, default=None, help="IVF lists (default: ~4*sqrt(chunks))")
+    parser.add_argument("--nprobe", type=int, default=None, help="IVF lists searched per query")
+    parser.add_argument("--hnsw-m", type=int, default=None, help="HNSW neighbours per node")
+    parser.add_argument("--ef-search", type=int, default=None, help="HNSW search depth")
+    parser.add_argument("--pq-m", type=int, default=None, help="PQ sub-quantizers (must divide the dimension)")
+    args=parser.parse_args()
+
+    index=None
+    if args.index:
+        index=index_config(args.index, nlist=args.nlist, nprobe=args.nprobe, hnsw_m=args.hnsw_m,
+                           ef_search=args.ef_search, pq_m=args.pq_m)
+
+    started=time.perf_counter()
+    stats=update_vector_store(args.data, args.db, full=args.full,
+                              workers=args.workers, batch_size=args.batch_size, index=index)
+    print(stats["parse"].report())
+    print(stats["embed"].report())
+    print(shrink_report(stats))
+    print(f"Chunks added: {stats['added']}, removed: {stats['removed']}, kept: {stats['kept']} "
+          f"({time.perf_counter() - started:.1f}s total)")
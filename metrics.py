@@ -0,0 +1,186 @@
+import bisect
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from functools import lru_cache
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+logger = logging.getLogger(__name__)
+
+# Per-process latency histograms for every stage of the app, exported in the Prometheus text format.
+# Recording a span is two clock reads and a bucket increment under a lock, so it stays on in production.
+
+# Serve /metrics on this port (unset: no server). Each replica needs its own port.
+METRICS_PORT = os.getenv("METRICS_PORT")
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+# Developer panel with the same numbers in the sidebar (home.py)
+METRICS_PANEL = os.getenv("METRICS_PANEL", "0") == "1"
+
+STAGE_METRIC = "wellai_stage_seconds"
+# Upper bounds in seconds: OCR pages and LLM answers take seconds, searches a few milliseconds
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+HELP = {
+    STAGE_METRIC: "Time spent in each stage of the app",
+    "wellai_stage_errors_total": "Stages that ended in an exception",
+    "wellai_llm_attempts_total": "LLM requests sent, by provider (hedges and fallbacks included)",
+    "wellai_llm_fallbacks_total": "LLM answers that came from a provider other than the first one tried",
+    "wellai_llm_queue_depth": "LLM requests waiting in the scheduler, by provider",
+    "wellai_llm_queue_wait_seconds": "Time LLM requests waited in the scheduler for their turn and budget",
+    "wellai_llm_rate_limited_total": "HTTP 429 responses, by provider",
+    "wellai_llm_coalesced_total": "LLM requests that shared an identical in-flight request instead of calling upstream",
+}
+
+
+class Histogram:
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # the last one is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q):
+        # Linear interpolation inside the bucket, as Prometheus' histogram_quantile does
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for i, count in enumerate(self.counts):
+            if seen + count >= rank and count:
+                if i == len(self.buckets):
+                    return self.buckets[-1]
+                low = self.buckets[i - 1] if i else 0.0
+                return low + (self.buckets[i] - low) * (rank - seen) / count
+            seen += count
+        return self.buckets[-1]
+
+
+def format_labels(labels, **extra):
+    pairs = list(labels) + list(extra.items())
+    if not pairs:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, value in pairs)
+    return "{" + ",".join(f'{key}="{value}"' for (key, _), value in zip(pairs, escaped)) + "}"
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.histograms = {}  # (name, labels) -> Histogram
+        self.counters = {}  # (name, labels) -> value
+        self.gauges = {}  # (name, labels) -> value
+
+    def observe(self, name, value, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram()
+            histogram.observe(value)
+
+    def inc(self, name, amount=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + amount
+
+    def set_gauge(self, name, value, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.gauges[key] = value
+
+    def prometheus_text(self):
+        with self.lock:
+            histograms = {key: (list(h.counts), h.sum, h.count, h.buckets) for key, h in self.histograms.items()}
+            counters = dict(self.counters)
+            gauges = dict(self.gauges)
+        lines = []
+        for name in sorted({name for name, _ in histograms}):
+            lines += [f"# HELP {name} {HELP.get(name, name)}", f"# TYPE {name} histogram"]
+            for (metric, labels), (counts, total, count, buckets) in sorted(histograms.items()):
+                if metric != name:
+                    continue
+                cumulative = 0
+                for bound, bucket_count in zip(list(buckets) + ["+Inf"], counts):
+                    cumulative += bucket_count
+                    lines.append(f"{name}_bucket{format_labels(labels, le=bound)} {cumulative}")
+                lines.append(f"{name}_sum{format_labels(labels)} {total}")
+                lines.append(f"{name}_count{format_labels(labels)} {count}")
+        for kind, values in (("counter", counters), ("gauge", gauges)):
+            for name in sorted({name for name, _ in values}):
+                lines += [f"# HELP {name} {HELP.get(name, name)}", f"# TYPE {name} {kind}"]
+                lines += [f"{name}{format_labels(labels)} {value}"
+                          for (metric, labels), value in sorted(values.items()) if metric == name]
+        return "\n".join(lines) + "\n"
+
+    def stage_summary(self):
+        # One row per stage for the developer panel
+        with self.lock:
+            rows = [{"stage": dict(labels).get("stage"), "count": h.count, "mean": h.sum / h.count,
+                     "p50": h.quantile(0.5), "p95": h.quantile(0.95)}
+                    for (name, labels), h in self.histograms.items() if name == STAGE_METRIC and h.count]
+        return sorted(rows, key=lambda row: row["stage"])
+
+
+REGISTRY = MetricsRegistry()
+
+
+def observe_stage(stage, seconds):
+    REGISTRY.observe(STAGE_METRIC, seconds, stage=stage)
+
+
+def count_error(stage):
+    REGISTRY.inc("wellai_stage_errors_total", stage=stage)
+
+
+@contextmanager
+def span(stage):
+    # with span("similarity_search"): ... records the block's duration, whether or not it raised
+    started = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        count_error(stage)
+        raise
+    finally:
+        observe_stage(stage, time.perf_counter() - started)
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] not in ("/", "/metrics"):
+            self.send_error(404)
+            return
+        body = REGISTRY.prometheus_text().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # Scrapes every few seconds would flood the app's log
+        pass
+
+
+@lru_cache(maxsize=None)
+def start_metrics_server(port=METRICS_PORT, host=METRICS_HOST):
+    # Once per process; returns the server (None when METRICS_PORT is unset or the port is taken)
+    if not port:
+        return None
+    try:
+        server = ThreadingHTTPServer((host, int(port)), MetricsHandler)
+    except OSError as e:
+        logger.warning("Metrics endpoint not started on %s:%s: %s", host, port, e)
+        return None
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="metrics", daemon=True).start()
+    logger.info("Metrics on http://%s:%s/metrics", host, port)
+    return server
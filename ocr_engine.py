@@ -0,0 +1,239 @@
+import importlib.util
+import logging
+import os
+import threading
+from functools import lru_cache
+
+import numpy as np
+
+
+logger = logging.getLogger(__name__)
+
+# OCR of one rendered page (report_extraction.py, in the OCR worker processes):
+#  - Tesseract is kept loaded per worker thread through tesserocr (the C API) and gets the image in memory;
+#    without tesserocr, pytesseract runs the tesseract CLI per page as before,
+#  - the page is flattened (uneven scan lighting), binarized (Otsu), despeckled and deskewed with NumPy,
+#  - the render DPI is picked from the measured text line height and the page segmentation mode from the
+#    layout: tables are read row by row (PSM 6) so a test's value stays on its line.
+
+# "auto" (tesserocr when installed), "tesserocr" or "pytesseract"
+OCR_ENGINE = os.getenv("OCR_ENGINE", "auto")
+OCR_LANG = os.getenv("OCR_LANG", "eng")
+OCR_PREPROCESS = os.getenv("OCR_PREPROCESS", "1") == "1"
+# Tesseract is most accurate with capitals around 30 px; a text line (ascenders to descenders) is a bit taller
+OCR_TARGET_LINE_PX = int(os.getenv("OCR_TARGET_LINE_PX", "32"))
+OCR_MIN_DPI = int(os.getenv("OCR_MIN_DPI", "150"))
+OCR_MAX_DPI = int(os.getenv("OCR_MAX_DPI", "400"))
+# Force one page segmentation mode for every page (unset: chosen per page)
+OCR_PSM = int(os.getenv("OCR_PSM", "0")) or None
+
+# Re-render only when the better DPI differs from the first render's by more than this
+DPI_TOLERANCE = 0.2
+# Skew angles tried, in degrees, and the smallest correction applied
+MAX_SKEW = 5.0
+SKEW_STEP = 0.25
+MIN_SKEW = 0.3
+# The brightest 8x8 mean (averaging out sensor noise) in each block of this many pixels approximates
+# the paper under uneven lighting
+BACKGROUND_BLOCK = 32
+BACKGROUND_CELL = 8
+
+PSM_AUTO = 3
+PSM_BLOCK = 6  # one uniform block, read row by row
+PSM_SPARSE = 11
+# A page is tabular when this share of its lines has a gap of 3 line heights or more between words
+TABLE_LINE_SHARE = 0.4
+TABLE_GAP_LINES = 3
+
+
+@lru_cache(maxsize=None)
+def engine_name():
+    if OCR_ENGINE != "auto":
+        return OCR_ENGINE
+    return "tesserocr" if importlib.util.find_spec("tesserocr") else "pytesseract"
+
+
+def ocr_settings():
+    # Part of report_extraction.EXTRACTION_VERSION: everything that changes the text for the same page
+    return (engine_name(), OCR_LANG, OCR_PREPROCESS, OCR_TARGET_LINE_PX, OCR_MIN_DPI, OCR_MAX_DPI, OCR_PSM)
+
+
+# Preprocessing (grayscale uint8 arrays, ink is dark)
+
+def to_gray(image):
+    return np.asarray(image.convert("L"), dtype=np.uint8)
+
+
+def flatten(gray, block=BACKGROUND_BLOCK, cell=BACKGROUND_CELL):
+    # Divides out the paper's brightness, estimated per block
+    h, w = gray.shape
+    bh, bw = -(-h // block), -(-w // block)
+    per = block // cell
+    padded = np.pad(gray, ((0, bh * block - h), (0, bw * block - w)), mode="edge").astype(np.float32)
+    cells = padded.reshape(bh * per, cell, bw * per, cell).mean(axis=(1, 3))
+    background = cells.reshape(bh, per, bw, per).max(axis=(1, 3))
+    background = np.repeat(np.repeat(background, block, axis=0), block, axis=1)[:h, :w]
+    return np.clip(gray / np.maximum(background, 1.0) * 255.0, 0, 255).astype(np.uint8)
+
+
+def otsu_threshold(gray):
+    # 0 (no ink) for a page with a single grey level, e.g. a blank one
+    counts = np.bincount(gray.ravel(), minlength=256).astype(np.float64)
+    if np.count_nonzero(counts) < 2:
+        return 0
+    levels = np.arange(256)
+    weight = np.cumsum(counts)
+    mass = np.cumsum(counts * levels)
+    total, total_mass = weight[-1], mass[-1]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        between = (total_mass * weight - total * mass) ** 2 / (weight * (total - weight))
+    if np.all(np.isnan(between[:-1])):
+        return 0
+    return int(np.nanargmax(between[:-1]))
+
+
+def despeckle(ink, min_neighbours=2):
+    # Drops ink pixels with fewer than `min_neighbours` inked pixels around them: scanner noise, dust
+    padded = np.pad(ink, 1).astype(np.uint8)
+    rows = padded[:-2] + padded[1:-1] + padded[2:]
+    around = rows[:, :-2] + rows[:, 1:-1] + rows[:, 2:]
+    return ink & (around > min_neighbours)
+
+
+def estimate_skew(ink, max_angle=MAX_SKEW, step=SKEW_STEP, max_points=50000):
+    # Angle (degrees) at which the rows of ink line up best: the sharpest horizontal projection profile
+    ys, xs = np.nonzero(ink)
+    if len(ys) < 100:
+        return 0.0
+    if len(ys) > max_points:
+        keep = np.random.default_rng(0).choice(len(ys), max_points, replace=False)
+        ys, xs = ys[keep], xs[keep]
+    xs = xs - xs.mean()
+    best_angle, best_score = 0.0, -1.0
+    for angle in np.arange(-max_angle, max_angle + step / 2, step):
+        rows = np.round(ys - xs * np.tan(np.radians(angle))).astype(np.int64)
+        profile = np.bincount(rows - rows.min())
+        score = float(np.sum(np.diff(profile).astype(np.float64) ** 2))
+        if score > best_score:
+            best_angle, best_score = float(angle), score
+    return best_angle
+
+
+def rotate(gray, angle):
+    from PIL import Image
+
+    return np.asarray(Image.fromarray(gray).rotate(angle, resample=Image.BILINEAR, expand=True, fillcolor=255))
+
+
+def text_lines(ink, angle=0.0):
+    # (top, bottom) row ranges that contain ink; with `angle`, rows run along that skew (no rotation needed)
+    if angle:
+        ys, xs = np.nonzero(ink)
+        rows = np.round(ys - (xs - xs.mean()) * np.tan(np.radians(angle))).astype(np.int64)
+        profile = np.bincount(rows - rows.min()) / ink.shape[1] if len(rows) else np.zeros(0)
+    else:
+        profile = ink.mean(axis=1)
+    inked = np.concatenate(([False], profile > 0.002, [False]))
+    edges = np.flatnonzero(np.diff(inked.astype(np.int8)))
+    lines = []
+    for top, bottom in zip(edges[::2], edges[1::2]):
+        # Descenders thin out below the baseline and can come out as a sliver of their own
+        previous = lines[-1][1] - lines[-1][0] if lines else 0
+        if bottom - top < 0.4 * previous and top - lines[-1][1] <= max(2, previous // 8):
+            lines[-1] = (lines[-1][0], bottom)
+        else:
+            lines.append((top, bottom))
+    return [(top, bottom) for top, bottom in lines if bottom - top >= 3]
+
+
+def line_height(lines):
+    return float(np.median([bottom - top for top, bottom in lines])) if lines else None
+
+
+def choose_dpi(height, dpi, target=OCR_TARGET_LINE_PX, low=OCR_MIN_DPI, high=OCR_MAX_DPI):
+    # The DPI that would bring the measured line height to the target
+    if not height:
+        return dpi
+    wanted = int(min(max(dpi * target / height, low), high))
+    return wanted if abs(wanted - dpi) > DPI_TOLERANCE * dpi else dpi
+
+
+def choose_psm(ink, lines):
+    if OCR_PSM:
+        return OCR_PSM
+    if len(lines) < 3:
+        return PSM_SPARSE
+    height = line_height(lines)
+    gap = TABLE_GAP_LINES * height
+    gapped = 0
+    for top, bottom in lines:
+        # Runs of inked columns; runs with less ink than a thin letter are specks, not words
+        profile = ink[top:bottom].sum(axis=0)
+        edges = np.flatnonzero(np.diff(np.concatenate(([0], profile > 0, [0])).astype(np.int8)))
+        runs = [(start, end) for start, end in zip(edges[::2], edges[1::2]) if profile[start:end].sum() >= height]
+        if any(start - previous_end >= gap for (_, previous_end), (start, _) in zip(runs, runs[1:])):
+            gapped += 1
+    return PSM_BLOCK if gapped >= TABLE_LINE_SHARE * len(lines) else PSM_AUTO
+
+
+def prepare_page(render, dpi):
+    # render(dpi) -> PIL image of the page. Returns (binary uint8 image, dpi, psm).
+    gray = flatten(to_gray(render(dpi)))
+    threshold = otsu_threshold(gray)
+    ink = despeckle(gray <= threshold)
+    angle = estimate_skew(ink)
+    if abs(angle) < MIN_SKEW:
+        angle = 0.0
+    better = choose_dpi(line_height(text_lines(ink, angle)), dpi)
+    if better != dpi:
+        # Rendered again rather than resampled: the PDF's vector text or full-resolution scan is sharper
+        dpi = better
+        gray = flatten(to_gray(render(dpi)))
+    if angle:
+        gray = rotate(gray, angle)
+    ink = despeckle(gray <= threshold)
+    return np.where(ink, 0, 255).astype(np.uint8), dpi, choose_psm(ink, text_lines(ink))
+
+
+# Engines
+
+_local = threading.local()
+
+
+def tesseract_api():
+    # One engine per thread, loaded on first use and kept for the life of the worker
+    api = getattr(_local, "api", None)
+    if api is None:
+        from tesserocr import PyTessBaseAPI
+
+        api = _local.api = PyTessBaseAPI(lang=OCR_LANG)
+        logger.info("Tesseract %s loaded in process %d", api.Version(), os.getpid())
+    return api
+
+
+def image_to_text(image, dpi, psm=PSM_AUTO, engine=None):
+    # image: PIL image or uint8 array
+    from PIL import Image
+
+    if isinstance(image, np.ndarray):
+        image = Image.fromarray(image)
+    if (engine or engine_name()) == "tesserocr":
+        api = tesseract_api()
+        api.SetPageSegMode(psm)
+        api.SetImage(image)
+        api.SetSourceResolution(dpi)
+        try:
+            return api.GetUTF8Text()
+        finally:
+            api.Clear()
+    import pytesseract
+
+    return pytesseract.image_to_string(image, lang=OCR_LANG, config=f"--psm {psm} --dpi {dpi}")
+
+
+def recognize(render, dpi, engine=None, preprocess=OCR_PREPROCESS):
+    # Text of one page; render(dpi) -> PIL image of it
+    if not preprocess:
+        return image_to_text(render(dpi), dpi, OCR_PSM or PSM_AUTO, engine)
+    image, dpi, psm = prepare_page(render, dpi)
+    return image_to_text(image, dpi, psm, engine)
@@ -0,0 +1,160 @@
+import argparse
+import logging
+import os
+import re
+import threading
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+
+logger = logging.getLogger(__name__)
+
+# Sentence-transformers models (mean pooling + L2 normalisation, like all-MiniLM-L6-v2) on ONNX Runtime,
+# for EMBEDDING_RUNTIME=onnx / onnx-int8 (embedding_model.py). Loading needs only onnxruntime and
+# tokenizers: no torch, no transformers. The model is exported once (with torch) into ONNX_MODEL_DIR,
+# with a dynamically int8-quantized copy next to it:
+#
+#     python onnx_embeddings.py
+
+ONNX_MODEL_DIR = os.getenv("ONNX_MODEL_DIR", "vectorstore/onnx")
+# Intra-op threads per forward pass (0: one per physical core, ONNX Runtime's default)
+EMBEDDING_THREADS = int(os.getenv("EMBEDDING_THREADS", "0"))
+# Texts are sorted by length and packed into batches of at most this many tokens, padding included
+EMBEDDING_BATCH_TOKENS = int(os.getenv("EMBEDDING_BATCH_TOKENS", "16384"))
+EMBEDDING_MAX_BATCH = int(os.getenv("EMBEDDING_MAX_BATCH", "256"))
+# all-MiniLM-L6-v2's max_seq_length in sentence-transformers
+EMBEDDING_MAX_TOKENS = int(os.getenv("EMBEDDING_MAX_TOKENS", "256"))
+
+FP32_FILE = "model.onnx"
+INT8_FILE = "model_int8.onnx"
+TOKENIZER_FILE = "tokenizer.json"
+ONNX_OPSET = 14
+
+
+def model_dir(model_name, root=ONNX_MODEL_DIR):
+    return os.path.join(root, re.sub(r"[^A-Za-z0-9_.-]+", "_", model_name))
+
+
+def export_model(model_name, out_dir=None):
+    # Writes model.onnx (fp32), model_int8.onnx (dynamic int8 weights) and tokenizer.json. Needs torch.
+    import torch
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+    from transformers import AutoModel, AutoTokenizer
+
+    out_dir = out_dir or model_dir(model_name)
+    os.makedirs(out_dir, exist_ok=True)
+    tokenizer = AutoTokenizer.from_pretrained(model_name)
+    model = AutoModel.from_pretrained(model_name).eval()
+
+    class Encoder(torch.nn.Module):
+        # Token embeddings only; pooling stays in NumPy so batches can be padded freely
+        def __init__(self):
+            super().__init__()
+            self.model = model
+
+        def forward(self, input_ids, attention_mask, token_type_ids):
+            return self.model(input_ids=input_ids, attention_mask=attention_mask,
+                              token_type_ids=token_type_ids).last_hidden_state
+
+    sample = tokenizer(["An example sentence to trace the model."], return_tensors="pt")
+    names = ["input_ids", "attention_mask", "token_type_ids"]
+    axes = {name: {0: "batch", 1: "sequence"} for name in names + ["last_hidden_state"]}
+    fp32_path = os.path.join(out_dir, FP32_FILE)
+    with torch.no_grad():
+        torch.onnx.export(Encoder(), tuple(sample[name] for name in names), fp32_path, input_names=names,
+                          output_names=["last_hidden_state"], dynamic_axes=axes, opset_version=ONNX_OPSET)
+    quantize_dynamic(fp32_path, os.path.join(out_dir, INT8_FILE), weight_type=QuantType.QInt8)
+    tokenizer.backend_tokenizer.save(os.path.join(out_dir, TOKENIZER_FILE))
+    logger.info("Exported %s to %s", model_name, out_dir)
+    return out_dir
+
+
+class OnnxEmbeddings(Embeddings):
+    # Drop-in for HuggingFaceEmbeddings: same vectors within rounding (fp32) or quantization error (int8)
+
+    def __init__(self, model_name, quantized=True, threads=EMBEDDING_THREADS, batch_tokens=EMBEDDING_BATCH_TOKENS,
+                 max_batch=EMBEDDING_MAX_BATCH, max_tokens=EMBEDDING_MAX_TOKENS, directory=None):
+        import onnxruntime as ort
+        from tokenizers import Tokenizer
+
+        directory = directory or model_dir(model_name)
+        path = os.path.join(directory, INT8_FILE if quantized else FP32_FILE)
+        if not os.path.exists(path):
+            raise FileNotFoundError(f"{path} not found; export the model with: python onnx_embeddings.py")
+        self.model_name = model_name
+        self.batch_tokens = batch_tokens
+        self.max_batch = max_batch
+
+        self.tokenizer = Tokenizer.from_file(os.path.join(directory, TOKENIZER_FILE))
+        self.tokenizer.no_padding()  # batches are padded here, to their own longest text
+        self.tokenizer.enable_truncation(max_length=max_tokens)
+        self.pad_id = self.tokenizer.token_to_id("[PAD]") or 0  # never read by the model: its mask is 0
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        options.execution_mode = ort.ExecutionMode.ORT_SEQUENTIAL
+        options.intra_op_num_threads = threads
+        options.inter_op_num_threads = 1
+        self.session = ort.InferenceSession(path, options, providers=["CPUExecutionProvider"])
+        self.input_names = {i.name for i in self.session.get_inputs()}
+        # InferenceSession.run is thread-safe; the tokenizer's encode_batch is not documented as such
+        self.lock = threading.Lock()
+
+    def batches(self, lengths):
+        # Index lists, shortest texts first: little padding, and long texts get smaller batches
+        order = np.argsort(lengths, kind="stable")
+        start = 0
+        while start < len(order):
+            end = start + 1
+            while (end < len(order) and end - start < self.max_batch
+                   and (end - start + 1) * lengths[order[end]] <= self.batch_tokens):
+                end += 1
+            yield order[start:end]
+            start = end
+
+    def embed(self, texts):
+        # (len(texts), dim) float32, L2-normalised
+        with self.lock:
+            encodings = self.tokenizer.encode_batch(list(texts))
+        lengths = np.array([len(encoding.ids) for encoding in encodings])
+        vectors = None
+        for indices in self.batches(lengths):
+            width = int(lengths[indices].max())
+            ids = np.full((len(indices), width), self.pad_id, dtype=np.int64)
+            mask = np.zeros((len(indices), width), dtype=np.int64)
+            types = np.zeros((len(indices), width), dtype=np.int64)
+            for row, i in enumerate(indices):
+                encoding = encodings[i]
+                ids[row, :lengths[i]] = encoding.ids
+                mask[row, :lengths[i]] = 1
+                types[row, :lengths[i]] = encoding.type_ids
+            feeds = {name: value for name, value in
+                     (("input_ids", ids), ("attention_mask", mask), ("token_type_ids", types))
+                     if name in self.input_names}
+            hidden = self.session.run(None, feeds)[0]
+            # Mean over the real tokens, then unit length (the model's Pooling and Normalize modules)
+            weights = mask[:, :, None].astype(np.float32)
+            pooled = (hidden * weights).sum(axis=1) / np.maximum(weights.sum(axis=1), 1e-9)
+            pooled /= np.maximum(np.linalg.norm(pooled, axis=1, keepdims=True), 1e-12)
+            if vectors is None:
+                vectors = np.empty((len(encodings), pooled.shape[1]), dtype=np.float32)
+            vectors[indices] = pooled
+        return vectors if vectors is not None else np.zeros((0, 0), dtype=np.float32)
+
+    def embed_documents(self, texts):
+        return self.embed(texts).tolist()
+
+    def embed_query(self, text):
+        return self.embed([text])[0].tolist()
+
+
+if __name__ == "__main__":
+    from embedding_model import EMBEDDING_MODEL_NAME
+
+    parser = argparse.ArgumentParser(description="Export the embedding model to ONNX, fp32 and int8-quantized")
+    parser.add_argument("--model", default=EMBEDDING_MODEL_NAME)
+    parser.add_argument("--out", default=None, help=f"output directory (default: under {ONNX_MODEL_DIR})")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    print(export_model(args.model, args.out))
@@ -0,0 +1,296 @@
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+
+import lab_parser
+import report_extraction
+from llm_scheduler import PRIORITY_SUMMARY
+from metrics import observe_stage, span
+from report_cache import get_report_cache, content_hash, version_hash
+from token_count import count_message_tokens
+
+
+logger = logging.getLogger(__name__)
+
+
+# The report analyzer without Streamlit: used by hack.py and by the batch CLI (batch_reports.py)
+
+SUMMARY_SYSTEM_PROMPT = "You are a medical assistant."
+SUMMARY_PROMPT = """
+You are a helpful medical assistant. Analyze the medical report text and:
+1. Extract test names and values.
+2. Identify abnormal values based on healthy ranges.
+3. Explain the findings in plain language.
+4. Offer general advice based on the report.
+
+Medical Report:
+{text}
+
+Summary:
+"""
+# Long reports: each part is summarized on its own (map), then the partial summaries are merged (reduce)
+MAP_PROMPT = """
+You are a helpful medical assistant. Below is part {part} of {parts} of a medical report.
+List every test name with its value, unit and reference range, and note any diagnoses, medications
+and findings in this part. Be concise and do not give advice yet.
+
+Report part:
+{text}
+
+Notes:
+"""
+# Notes still too long to reduce together are merged group by group first
+MERGE_PROMPT = """
+You are a helpful medical assistant. Below are notes on consecutive parts of one medical report
+(group {part} of {parts}), in order. Merge them into one set of notes: keep every test name with its
+value, unit and reference range, and every diagnosis, medication and finding, without repeating any.
+Be concise and do not give advice yet.
+
+Notes:
+{text}
+
+Merged notes:
+"""
+REDUCE_PROMPT = """
+You are a helpful medical assistant. Below are notes on each part of one medical report, in order.
+Using them:
+1. Extract test names and values.
+2. Identify abnormal values based on healthy ranges.
+3. Explain the findings in plain language.
+4. Offer general advice based on the report.
+
+Notes on the report:
+{text}
+
+Summary:
+"""
+FOLLOWUP_SYSTEM_PROMPT = "You help users understand medical reports."
+FOLLOWUP_PROMPT = """
+You are a medical assistant. Here are the sections of a medical report most relevant to the question, and the report's summary:
+
+Report sections:
+{report_text}
+
+Summary:
+{summary}
+
+The user asks: {question}
+
+Please respond clearly and accurately in plain language.
+"""
+
+# Less text than this means extraction found nothing usable
+MIN_REPORT_CHARS = 20
+
+# Follow-up questions get only the report sections closest to the question, within a prompt budget
+# (llama3-70b-8192 has 8192 tokens for prompt and answer together)
+REPORT_CHUNK_SIZE = int(os.getenv("REPORT_CHUNK_SIZE", "800"))
+REPORT_CHUNK_OVERLAP = int(os.getenv("REPORT_CHUNK_OVERLAP", "100"))
+REPORT_CONTEXT_K = int(os.getenv("REPORT_CONTEXT_K", "4"))
+PROMPT_TOKEN_BUDGET = int(os.getenv("PROMPT_TOKEN_BUDGET", "6000"))
+
+# Summary prompts above this many tokens switch to map-reduce; parts are packed up to MAP_CHUNK_TOKENS
+LONG_REPORT_TOKENS = int(os.getenv("LONG_REPORT_TOKENS", "5000"))
+MAP_CHUNK_TOKENS = int(os.getenv("MAP_CHUNK_TOKENS", "3000"))
+MAP_CONCURRENCY = int(os.getenv("MAP_CONCURRENCY", "4"))
+
+# Cached results are keyed by the PDF bytes plus a version of whatever produced them,
+# so a prompt, model, range or OCR change never serves stale values
+TEXT_VERSION = version_hash(report_extraction.EXTRACTION_VERSION)
+FLAGS_VERSION = version_hash(lab_parser.PARSER_VERSION, lab_parser.LAB_TESTS, "records")
+
+
+def default_router():
+    from clients import get_router
+
+    return get_router()
+
+
+def summary_version(router=None):
+    router = router or default_router()
+    return version_hash(SUMMARY_SYSTEM_PROMPT, SUMMARY_PROMPT, MAP_PROMPT, MERGE_PROMPT, REDUCE_PROMPT,
+                        LONG_REPORT_TOKENS, MAP_CHUNK_TOKENS, [p.model for p in router.providers])
+
+
+def extract_text(pdf_bytes, report_hash=None, progress=None, inline=False):
+    # Cached report text; "" when nothing readable was found
+    report_hash = report_hash or content_hash(pdf_bytes)
+    report_cache = get_report_cache()
+    text = report_cache.get("text", report_hash, TEXT_VERSION)
+    if text is None:
+        with span("extract"):
+            text = report_extraction.extract_text(pdf_bytes, progress=progress, inline=inline)
+        if len(text.strip()) < MIN_REPORT_CHARS:
+            return ""
+        report_cache.put("text", report_hash, TEXT_VERSION, text)
+    return text
+
+
+def flag_abnormalities(text, report_hash=None):
+    # Out-of-range values as JSON-ready dicts (LabResult fields); cached when the report hash is known
+    def compute():
+        with span("abnormality_scan"):
+            return [result._asdict() for result in lab_parser.flag_abnormalities(text)]
+
+    if report_hash is None:
+        return compute()
+    return get_report_cache().get_or_compute("flags", report_hash, FLAGS_VERSION, compute)
+
+
+def describe_flag(flag):
+    return lab_parser.LabResult(flag["test"], flag["value"], flag["unit"], tuple(flag["range"]), flag["status"]).describe()
+
+
+def summary_messages(prompt, **fields):
+    return [
+        {"role": "system", "content": SUMMARY_SYSTEM_PROMPT},
+        {"role": "user", "content": prompt.format(**fields)}
+    ]
+
+
+def split_report(text, models, max_tokens=MAP_CHUNK_TOKENS):
+    # Consecutive pages packed into parts of up to max_tokens; a page too big on its own is split by lines
+    def tokens(piece):
+        return count_message_tokens([{"role": "user", "content": piece}], models)
+
+    units = []
+    for page in text.split(report_extraction.PAGE_BREAK):
+        size = tokens(page)
+        if size <= max_tokens:
+            units.append((page, size))
+        else:
+            units.extend((line + "\n", tokens(line)) for line in page.splitlines())
+    parts = []
+    part, part_size = "", 0
+    for unit, size in units:
+        if part and part_size + size > max_tokens:
+            parts.append(part)
+            part, part_size = "", 0
+        part += unit
+        part_size += size
+    parts.append(part)
+    return [part for part in parts if part.strip()]
+
+
+def map_summaries(parts, router, priority=PRIORITY_SUMMARY, prompt=MAP_PROMPT):
+    # Each part summarized concurrently (with MAP_PROMPT, or MERGE_PROMPT for groups of notes);
+    # results keep the report's order
+    def summarize_part(numbered):
+        number, part = numbered
+        messages = summary_messages(prompt, part=number, parts=len(parts), text=part)
+        return "".join(router.stream(messages, priority=priority)).strip()
+
+    with ThreadPoolExecutor(max_workers=MAP_CONCURRENCY) as pool:
+        return list(pool.map(summarize_part, enumerate(parts, 1)))
+
+
+# Both LLM helpers yield the response text as it streams in
+def generate_summary(text, timings=None, router=None, priority=PRIORITY_SUMMARY):
+    router = router or default_router()
+    timings = {} if timings is None else timings
+    models = [p.model for p in router.providers]
+    messages = summary_messages(SUMMARY_PROMPT, text=text)
+    if count_message_tokens(messages, models) <= LONG_REPORT_TOKENS:
+        timings["mode"] = "single"
+        yield from router.stream(messages, timings, priority)
+        return
+
+    # Long report: map, then reduce. Notes that are still too long together are merged in groups first.
+    started = time.monotonic()
+    notes = split_report(text, models)
+    timings.update(mode="map-reduce", parts=len(notes), rounds=0)
+    prompt = MAP_PROMPT
+    while True:
+        notes = map_summaries(notes, router, priority, prompt)
+        timings["rounds"] += 1
+        messages = summary_messages(REDUCE_PROMPT, text="\n\n".join(notes))
+        if len(notes) == 1 or count_message_tokens(messages, models) <= LONG_REPORT_TOKENS:
+            break
+        regrouped = split_report(report_extraction.PAGE_BREAK.join(notes), models)
+        if len(regrouped) >= len(notes):
+            # Regrouping no longer shrinks anything: reduce what there is
+            break
+        notes = regrouped
+        prompt = MERGE_PROMPT
+    timings["map"] = time.monotonic() - started
+    observe_stage("summary_map", timings["map"])
+    logger.info("Summary map stage: %d part(s) in %d round(s), %.1fs", timings["parts"], timings["rounds"], timings["map"])
+    reduce_started = time.monotonic()
+    yield from router.stream(messages, timings, priority)
+    timings["reduce"] = time.monotonic() - reduce_started
+    observe_stage("summary_reduce", timings["reduce"])
+    logger.info("Summary reduce stage: %.1fs", timings["reduce"])
+
+
+@lru_cache(maxsize=32)
+def report_sections(report_text):
+    # Split and embed once per report (per process); the vectors also land in the embedding cache
+    import numpy as np
+    from langchain.text_splitter import RecursiveCharacterTextSplitter
+    from clients import get_embedding_model
+
+    splitter = RecursiveCharacterTextSplitter(chunk_size=REPORT_CHUNK_SIZE, chunk_overlap=REPORT_CHUNK_OVERLAP)
+    sections = splitter.split_text(report_text)
+    vectors = np.asarray(get_embedding_model().embed_documents(sections), dtype=np.float32).reshape(len(sections), -1)
+    vectors /= np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+    return sections, vectors
+
+
+def followup_messages(question, sections, summary, conversation=()):
+    # `conversation`: earlier turns as chat messages, between the instructions and the new question
+    return [
+        {"role": "system", "content": FOLLOWUP_SYSTEM_PROMPT},
+        *conversation,
+        {"role": "user", "content": FOLLOWUP_PROMPT.format(report_text="\n...\n".join(sections), summary=summary,
+                                                           question=question)}
+    ]
+
+
+def select_sections(question, report_text, summary, models, budget=PROMPT_TOKEN_BUDGET, k=REPORT_CONTEXT_K,
+                    conversation=()):
+    # Top-k sections by similarity to the question that fit the budget, in report order
+    import numpy as np
+    from clients import get_embedding_model
+
+    sections, vectors = report_sections(report_text)
+    if not sections:
+        return []
+    query = np.asarray(get_embedding_model().embed_query(question), dtype=np.float32)
+    query /= max(float(np.linalg.norm(query)), 1e-12)
+    chosen = []
+    for i in np.argsort(-(vectors @ query))[:k]:
+        candidate = sorted(chosen + [int(i)])
+        messages = followup_messages(question, [sections[j] for j in candidate], summary, conversation)
+        if count_message_tokens(messages, models) <= budget:
+            chosen = candidate
+    return [sections[j] for j in chosen]
+
+
+def ask_question(question, report_text, summary, timings=None, router=None, chat=None):
+    # `chat`: the report's ChatSession (chat_sessions.py), whose summary and latest turns go with the question
+    router = router or default_router()
+    timings = {} if timings is None else timings
+    models = [p.model for p in router.providers]
+    conversation = chat.context_messages(models) if chat is not None else []
+    with span("report_retrieval"):
+        sections = select_sections(question, report_text, summary, models, conversation=conversation)
+    messages = followup_messages(question, sections, summary, conversation)
+    timings["prompt_tokens"] = count_message_tokens(messages, models)
+    timings["full_report_tokens"] = count_message_tokens(followup_messages(question, [report_text], summary), models)
+    logger.info("Follow-up prompt: %d tokens with %d report section(s); whole report would be %d tokens",
+                timings["prompt_tokens"], len(sections), timings["full_report_tokens"])
+    yield from router.stream(messages, timings)
+
+
+def summarize(text, report_hash=None, timings=None, router=None, priority=PRIORITY_SUMMARY):
+    # Whole summary at once, through the report cache when the report hash is known
+    router = router or default_router()
+
+    def compute():
+        return "".join(generate_summary(text, timings, router, priority)).strip()
+
+    if report_hash is None:
+        return compute()
+    return get_report_cache().get_or_compute("summary", report_hash, summary_version(router), compute)
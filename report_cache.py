@@ -0,0 +1,78 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from functools import lru_cache
+
+
+REPORT_CACHE_PATH = os.getenv("REPORT_CACHE_PATH", "cache/report_cache.sqlite")
+REPORT_CACHE_MAX_BYTES = int(os.getenv("REPORT_CACHE_MAX_BYTES", str(256 * 1024 * 1024)))
+
+
+def content_hash(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+def version_hash(*parts):
+    # Short fingerprint of whatever produced a value (model, prompt, ranges, OCR settings)
+    return hashlib.sha256(json.dumps(parts, sort_keys=True, default=str).encode("utf-8")).hexdigest()[:16]
+
+
+class ReportCache:
+    # Disk-backed, process-wide cache for per-report results, keyed by the PDF's content hash
+    # plus a version of the code/prompt that produced the value. LRU-evicted above max_bytes.
+
+    def __init__(self, path=REPORT_CACHE_PATH, max_bytes=REPORT_CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("CREATE TABLE IF NOT EXISTS entries "
+                        "(key TEXT PRIMARY KEY, value TEXT, size INTEGER, last_used REAL)")
+        self.db.execute("CREATE INDEX IF NOT EXISTS entries_last_used ON entries (last_used)")
+        self.db.commit()
+
+    @staticmethod
+    def key(kind, digest, version):
+        return f"{kind}:{digest}:{version}"
+
+    def get(self, kind, digest, version):
+        key = self.key(kind, digest, version)
+        with self.lock:
+            row = self.db.execute("SELECT value FROM entries WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            self.db.execute("UPDATE entries SET last_used = ? WHERE key = ?", (time.time(), key))
+            self.db.commit()
+        return json.loads(row[0])
+
+    def put(self, kind, digest, version, value):
+        data = json.dumps(value)
+        size = len(data.encode("utf-8"))
+        if size > self.max_bytes:
+            return
+        with self.lock:
+            self.db.execute("INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?)",
+                            (self.key(kind, digest, version), data, size, time.time()))
+            total = self.db.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+            while total > self.max_bytes:
+                key, oldest = self.db.execute("SELECT key, size FROM entries ORDER BY last_used LIMIT 1").fetchone()
+                self.db.execute("DELETE FROM entries WHERE key = ?", (key,))
+                total -= oldest
+            self.db.commit()
+
+    def get_or_compute(self, kind, digest, version, compute):
+        value = self.get(kind, digest, version)
+        if value is None:
+            value = compute()
+            if value is not None:
+                self.put(kind, digest, version, value)
+        return value
+
+
+@lru_cache(maxsize=None)
+def get_report_cache():
+    return ReportCache()
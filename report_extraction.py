@@ -0,0 +1,140 @@
+import logging
+import multiprocessing
+import os
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+from functools import lru_cache
+
+import ocr_engine
+from metrics import count_error, observe_stage
+
+
+logger = logging.getLogger(__name__)
+
+OCR_WORKERS = int(os.getenv("OCR_WORKERS", str(os.cpu_count() or 1)))
+OCR_DPI = int(os.getenv("OCR_DPI", "200"))
+# Pages with fewer characters than this in their text layer are treated as scanned
+MIN_PAGE_CHARS = int(os.getenv("MIN_PAGE_CHARS", "20"))
+# Part of the report cache key: bump when extraction changes what it returns for the same PDF
+EXTRACTION_VERSION = ("page-hybrid-3", OCR_DPI, MIN_PAGE_CHARS) + ocr_engine.ocr_settings()
+# Pages are joined with a form feed, so long-report summarization can split on page boundaries
+PAGE_BREAK = "\f"
+
+
+def page_texts(pdf_bytes):
+    import fitz  # PyMuPDF
+
+    with fitz.open(stream=pdf_bytes, filetype="pdf") as doc:
+        return [page.get_text() for page in doc]
+
+
+def needs_ocr(text):
+    return len(text.strip()) < MIN_PAGE_CHARS
+
+
+def render_page(path, page_number, dpi, renderer):
+    # One page at a time, so a worker never holds more than a single page image
+    import fitz
+    from PIL import Image
+
+    if renderer == "poppler":
+        from pdf2image import convert_from_path
+
+        return convert_from_path(path, dpi=dpi, first_page=page_number + 1, last_page=page_number + 1)[0]
+    with fitz.open(path) as doc:
+        pixmap = doc[page_number].get_pixmap(dpi=dpi)
+        return Image.frombytes("RGB", (pixmap.width, pixmap.height), pixmap.samples)
+
+
+def ocr_page(path, page_number, dpi=OCR_DPI, renderer="fitz"):
+    # Runs in an OCR worker process; `dpi` is the first render's, ocr_engine may render again at another
+    try:
+        return ocr_engine.recognize(lambda page_dpi: render_page(path, page_number, page_dpi, renderer), dpi)
+    except Exception as e:
+        # Some pytesseract errors can't be unpickled and would break the whole pool
+        raise RuntimeError(f"{type(e).__name__}: {e}") from None
+
+
+def timed_ocr_page(path, page_number, dpi=OCR_DPI, renderer="fitz"):
+    # The duration travels back with the text: a pool worker's metrics would stay in the worker
+    started = time.perf_counter()
+    text = ocr_page(path, page_number, dpi, renderer)
+    return text, time.perf_counter() - started
+
+
+@lru_cache(maxsize=None)
+def get_ocr_pool():
+    # Shared by every session of the process; spawn, because forking the threaded Streamlit server is unsafe
+    return ProcessPoolExecutor(max_workers=OCR_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+
+
+def ocr_pages(path, page_numbers, renderer, inline=False):
+    # Yields (page_number, text, error) in completion order
+    if inline:
+        for page_number in page_numbers:
+            try:
+                text, seconds = timed_ocr_page(path, page_number, OCR_DPI, renderer)
+            except Exception as e:
+                count_error("ocr_page")
+                yield page_number, None, e
+                continue
+            observe_stage("ocr_page", seconds)
+            yield page_number, text, None
+        return
+    pool = get_ocr_pool()
+    futures = {pool.submit(timed_ocr_page, path, i, OCR_DPI, renderer): i for i in page_numbers}
+    for future in as_completed(futures):
+        try:
+            text, seconds = future.result()
+        except Exception as e:
+            if isinstance(e, BrokenProcessPool):
+                # A crashed worker breaks the pool for good; start a fresh one next time
+                get_ocr_pool.cache_clear()
+            count_error("ocr_page")
+            yield futures[future], None, e
+            continue
+        observe_stage("ocr_page", seconds)
+        yield futures[future], text, None
+
+
+def extract_text(pdf_bytes, progress=None, inline=False):
+    # Text layer where a page has one, OCR only for the pages that don't.
+    # `progress(done, total, page_number)` is called as each OCR'd page finishes.
+    # `inline` OCRs in the calling process, for callers that already parallelise across reports.
+    renderer = "fitz"
+    try:
+        texts = page_texts(pdf_bytes)
+    except Exception as e:
+        # PyMuPDF can't open it: let poppler render every page for OCR
+        logger.warning("Direct text extraction failed, OCR'ing every page: %s", e)
+        from pdf2image import pdfinfo_from_bytes
+
+        texts = [""] * pdfinfo_from_bytes(pdf_bytes)["Pages"]
+        renderer = "poppler"
+
+    scanned = [i for i, text in enumerate(texts) if needs_ocr(text)]
+    if not scanned:
+        return PAGE_BREAK.join(texts)
+
+    with tempfile.NamedTemporaryFile(suffix=".pdf", delete=False) as f:
+        f.write(pdf_bytes)
+        path = f.name
+    errors = []
+    try:
+        for done, (page_number, text, error) in enumerate(ocr_pages(path, scanned, renderer, inline), 1):
+            if error is None:
+                texts[page_number] = text if text.endswith("\n") else text + "\n"
+            else:
+                # One unreadable page shouldn't lose the rest of the report
+                logger.warning("OCR failed on page %d: %s", page_number + 1, error)
+                errors.append(error)
+            if progress:
+                progress(done, len(scanned), page_number)
+    finally:
+        os.remove(path)
+    text = PAGE_BREAK.join(texts)
+    if errors and not text.strip():
+        raise errors[0]
+    return text
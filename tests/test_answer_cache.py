@@ -0,0 +1,40 @@
+import pytest
+
+from answer_cache import is_context_dependent
+
+
+HISTORY = [("What is anemia?", "Anemia is a lack of healthy red blood cells...")]
+
+
+@pytest.mark.parametrize("query", [
+    "What about in children?",
+    "And the side effects?",
+    "How about during pregnancy?",
+    "Is it dangerous?",
+    "What causes it?",
+    "How are they treated?",
+    "Can you elaborate on the second point?",
+    "Is that condition hereditary, and should my siblings get tested as well?",
+    "Which of the medicines you mentioned is safest for someone with kidney disease?",
+    "Explain the previous answer in simpler terms, without the medical jargon please",
+])
+def test_follow_ups_depend_on_the_chat(query):
+    assert is_context_dependent(query, HISTORY)
+
+
+@pytest.mark.parametrize("query", [
+    "What are the symptoms of diabetes?",
+    "Is anemia dangerous?",
+    "How long does it take for iron supplements to raise hemoglobin levels?",
+    "What does it mean if my TSH is high but T4 is normal?",
+    "Why do they check creatinine before giving contrast dye for a CT scan?",
+    "Can high blood pressure damage the kidneys over time, and how is that prevented?",
+    "What is the normal range for fasting blood glucose?",
+    "Should I take more vitamin D in winter if I rarely go outside?",
+])
+def test_self_contained_questions_are_cacheable(query):
+    assert not is_context_dependent(query, HISTORY)
+
+
+def test_nothing_depends_on_an_empty_chat():
+    assert not is_context_dependent("Is it dangerous?", [])
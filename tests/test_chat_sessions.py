@@ -0,0 +1,188 @@
+import sqlite3
+
+import pytest
+
+import chat_sessions
+from chat_sessions import ChatSession, ChatStore, turn_messages
+from llm import Provider
+from token_count import count_message_tokens
+
+
+MODELS = ["test-model"]
+
+
+@pytest.fixture(autouse=True)
+def small_window(monkeypatch):
+    monkeypatch.setattr(chat_sessions, "CHAT_WINDOW_TURNS", 3)
+
+
+@pytest.fixture
+def store(tmp_path):
+    return ChatStore(str(tmp_path / "chat.sqlite"))
+
+
+def turn(i, words=1):
+    return f"question {i}" + " about anemia" * words, f"answer {i}" + " with iron" * words
+
+
+def session_with(store, count, words=1):
+    session = ChatSession.open(store=store)
+    for i in range(count):
+        session.append(*turn(i, words))
+    return session
+
+
+class SummaryRouter:
+    def __init__(self, summary="Summary of the first turns.", during=None):
+        self.providers = [Provider("test", None, MODELS[0])]
+        self.summary = summary
+        self.during = during
+        self.calls = 0
+
+    def stream(self, messages, timings=None, priority=None):
+        self.calls += 1
+        if self.during:
+            self.during()
+        yield self.summary
+
+
+# Slicing
+
+def test_only_the_window_is_held_in_memory(store):
+    session = session_with(store, 8)
+    assert len(session) == 8
+    assert session.window_start == 5
+    assert list(session.window) == [turn(i) for i in range(5, 8)]
+
+
+@pytest.mark.parametrize("start, stop", [(0, 8), (0, 3), (2, 7), (5, 8), (6, 7), (4, 5), (-2, None), (7, 3)])
+def test_slices_across_the_window_and_the_store(store, start, stop):
+    session = session_with(store, 8)
+    assert session[start:stop] == [turn(i) for i in range(8)][start:stop]
+
+
+def test_only_contiguous_slices(store):
+    session = session_with(store, 4)
+    with pytest.raises(TypeError):
+        session[1]
+    with pytest.raises(TypeError):
+        session[::2]
+
+
+def test_older_turns_page_back_from_the_window(store):
+    session = session_with(store, 8)
+    assert session.older_turns(1, page_turns=2) == (3, [turn(3), turn(4)])
+    assert session.older_turns(5, page_turns=2) == (0, [turn(i) for i in range(5)])
+
+
+def test_reopened_session_resumes_from_the_store(store):
+    session = session_with(store, 5)
+    reopened = ChatSession.open(session.session_id, store=store)
+    assert len(reopened) == 5
+    assert reopened[:] == [turn(i) for i in range(5)]
+    assert ChatSession.open(session.session_id, kind="report", store=store).session_id != session.session_id
+
+
+# Appending
+
+def test_concurrent_sessions_never_overwrite_a_turn(store):
+    first = session_with(store, 2)
+    second = ChatSession.open(first.session_id, store=store)
+    first.append("from the first tab", "a")
+    second.append("from the second tab", "b")
+    assert len(second) == 4
+    assert second[:] == [turn(0), turn(1), ("from the first tab", "a"), ("from the second tab", "b")]
+    assert list(second.window) == second[1:]
+    assert store.session(first.session_id)[1] == 4
+
+
+def test_a_taken_position_is_an_error(store):
+    session = session_with(store, 1)
+    with pytest.raises(sqlite3.IntegrityError):
+        with store.lock:
+            store.db.execute("INSERT INTO turns VALUES (?, 0, 'q', 'a')", (session.session_id,))
+    store.db.rollback()
+    assert session[:] == [turn(0)]
+
+
+def test_appending_to_a_deleted_session_fails(store):
+    session = session_with(store, 1)
+    store.delete(session.session_id)
+    with pytest.raises(KeyError):
+        store.append(session.session_id, "q", "a")
+
+
+def test_a_deleted_session_continues_as_a_new_one(store):
+    # Cleared in another tab, or pruned after CHAT_RETENTION_DAYS
+    session = session_with(store, 5)
+    session.summary, session.summarized = "Old summary.", 2
+    deleted = session.session_id
+    store.delete(deleted)
+    session.append(*turn(5))
+    assert session.session_id != deleted
+    assert (len(session), session.summary, session.summarized) == (1, "", 0)
+    assert session[:] == [turn(5)]
+    assert store.session(session.session_id) == ("chat", 1, "", 0)
+    assert ChatSession.open(session.session_id, store=store)[:] == [turn(5)]
+
+
+# Prompt history
+
+def test_context_keeps_the_newest_turns_within_the_budget(store):
+    session = session_with(store, 8, words=5)
+    budget = 150
+    messages = session.context_messages(MODELS, budget=budget)
+    kept = len(messages) // 2
+    assert 0 < kept < 8
+    assert messages == turn_messages([turn(i, 5) for i in range(8 - kept, 8)])
+    assert count_message_tokens(messages, MODELS) <= budget
+    assert count_message_tokens(turn_messages([turn(i, 5) for i in range(7 - kept, 8)]), MODELS) > budget
+
+
+def test_context_starts_with_the_summary_and_skips_summarized_turns(store):
+    session = session_with(store, 6)
+    session.summary, session.summarized = "The user has anemia.", 4
+    messages = session.context_messages(MODELS, budget=10000)
+    assert messages[0] == {"role": "system", "content": "Summary of the earlier conversation:\nThe user has anemia."}
+    assert messages[1:] == turn_messages([turn(4), turn(5)])
+
+
+# Folding
+
+def test_fold_summarizes_the_oldest_turns_until_half_the_budget_is_left(store):
+    session = session_with(store, 8, words=5)
+    budget = 300
+    session.fold(SummaryRouter(), budget=budget)
+    cut = session.summarized
+    assert 0 < cut < 8
+    assert count_message_tokens(turn_messages(session[cut:]), MODELS) <= budget // 2
+    assert count_message_tokens(turn_messages(session[cut - 1:]), MODELS) > budget // 2
+    assert session.summary == "Summary of the first turns."
+    assert store.session(session.session_id)[2:] == ("Summary of the first turns.", cut)
+    assert ChatSession.open(session.session_id, store=store).summarized == cut
+
+
+def test_fold_does_nothing_within_the_budget(store):
+    session = session_with(store, 2)
+    router = SummaryRouter()
+    assert session.maybe_fold(router, budget=10000) is None
+    session.fold(router, budget=10000)
+    assert router.calls == 0
+    assert session.summarized == 0
+
+
+def test_fold_runs_in_the_background_once_over_budget(store):
+    session = session_with(store, 8, words=5)
+    thread = session.maybe_fold(SummaryRouter(), budget=300)
+    thread.join(5)
+    assert session.summarized > 0
+
+
+def test_clear_during_a_fold_keeps_the_summary_out_of_the_new_session(store):
+    session = session_with(store, 8, words=5)
+    old_id = session.session_id
+    session.fold(SummaryRouter(during=session.clear), budget=300)
+    assert session.session_id != old_id
+    assert (len(session), session.summary, session.summarized) == (0, "", 0)
+    assert store.session(session.session_id)[2:] == ("", 0)
+    assert store.session(old_id) is None
@@ -0,0 +1,200 @@
+import hashlib
+import random
+
+import numpy as np
+import pytest
+
+import chunker
+from chunker import Deduplicator, chunk_text, count_tokens, strip_boilerplate
+
+
+@pytest.fixture(autouse=True)
+def character_tokens(monkeypatch):
+    # Token counts from characters (4 per token), whether or not the model's tokenizer is available
+    monkeypatch.setattr(chunker, "get_tokenizer", lambda model_name=None: None)
+
+
+def sentence(rng, words=12):
+    vocab = "blood cell count anemia iron fever kidney liver enzyme dose tablet patient symptom chronic".split()
+    return " ".join(rng.choice(vocab) for _ in range(words)).capitalize() + "."
+
+
+def paragraph(seed, words):
+    rng = random.Random(seed)
+    vocab = [f"term{i}" for i in range(400)]
+    return " ".join(rng.choice(vocab) for _ in range(words))
+
+
+# Boilerplate
+
+def test_repeated_headers_footers_and_page_numbers_are_stripped():
+    rng = random.Random(0)
+    bodies = [[sentence(rng) for _ in range(6)] for _ in range(6)]
+    pages = ["Harrison's Principles of Internal Medicine\n" + "\n".join(body) + f"\nCopyright 2018 McGraw-Hill\n{i + 1}"
+             for i, body in enumerate(bodies)]
+    cleaned, removed = strip_boilerplate(pages)
+    assert removed == 18
+    assert cleaned == ["\n".join(body) for body in bodies]
+
+
+def test_lines_repeated_on_few_pages_are_kept():
+    pages = ["Running title\nBody one.", "Running title\nBody two.", "Other\nBody three.", "Other\nBody four."]
+    cleaned, removed = strip_boilerplate(pages)
+    assert removed == 0
+    assert cleaned[0] == "Running title\nBody one."
+
+
+def test_repeated_lines_in_the_middle_of_a_page_are_kept():
+    middle = "\n".join(f"line {c}" for c in "abcdefgh")
+    pages = [f"top\n{middle}\nSee table 2 for doses\n{middle}\nbottom" for _ in range(5)]
+    cleaned, _ = strip_boilerplate(pages)
+    assert "See table 2 for doses" in cleaned[0]
+
+
+# Sentence packing
+
+def test_chunks_stay_within_the_token_budget():
+    rng = random.Random(0)
+    text = " ".join(sentence(rng) for _ in range(200))
+    chunks = chunk_text(text, max_tokens=64, overlap_tokens=16, min_tokens=1)
+    assert len(chunks) > 10
+    assert max(count_tokens(chunks)) <= 64
+
+
+def test_consecutive_chunks_overlap_by_whole_sentences():
+    rng = random.Random(1)
+    sentences = [sentence(rng, words=6) for _ in range(60)]
+    chunks = chunk_text(" ".join(sentences), max_tokens=64, overlap_tokens=24, min_tokens=1)
+    assert len(chunks) > 5
+    for previous, current in zip(chunks, chunks[1:]):
+        # The longest run of the previous chunk's last sentences that fits the overlap budget
+        carried = []
+        for text in reversed(previous.split(". ")):
+            text = text if text.endswith(".") else text + "."
+            if sum(count_tokens([text] + carried)) > 24:
+                break
+            carried.insert(0, text)
+        assert carried
+        assert current.startswith(" ".join(carried) + " ")
+
+
+def test_no_overlap_when_disabled():
+    rng = random.Random(2)
+    sentences = [sentence(rng) for _ in range(40)]
+    chunks = chunk_text(" ".join(sentences), max_tokens=64, overlap_tokens=0, min_tokens=1)
+    assert " ".join(chunks) == " ".join(sentences)
+
+
+def test_headings_start_a_new_chunk():
+    rng = random.Random(3)
+    text = "\n".join([sentence(rng), "2.1 IRON DEFICIENCY", sentence(rng), "CLINICAL FEATURES", sentence(rng)])
+    chunks = chunk_text(text, max_tokens=200, overlap_tokens=50, min_tokens=1)
+    assert len(chunks) == 3
+    assert chunks[1].startswith("2.1 IRON DEFICIENCY")
+    assert chunks[2].startswith("CLINICAL FEATURES")
+
+
+def test_overlong_sentences_are_split_into_word_windows():
+    text = " ".join(f"word{i}" for i in range(300))
+    chunks = chunk_text(text, max_tokens=50, overlap_tokens=0, min_tokens=1)
+    assert len(chunks) > 1
+    assert max(count_tokens(chunks)) <= 50
+    assert " ".join(chunks) == text
+
+
+def test_hyphenated_line_breaks_are_rejoined_and_short_chunks_dropped():
+    assert chunk_text("Iron deficiency is the commonest cause of ane-\nmia worldwide.", min_tokens=1) == [
+        "Iron deficiency is the commonest cause of anemia worldwide."]
+    assert chunk_text("12", min_tokens=8) == []
+
+
+# Deduplication
+
+def test_exact_duplicates_ignore_case_punctuation_and_spacing():
+    dedup = Deduplicator()
+    text = paragraph(0, 100)
+    assert dedup.check(text, "a") is None
+    assert dedup.check("  " + text.upper().replace(" ", " ,  "), "b") == ("exact", "a")
+    assert dedup.stats == {"unique": 1, "exact": 1, "near": 0}
+
+
+def test_near_duplicates_are_caught_and_different_text_is_not():
+    dedup = Deduplicator()
+    text = paragraph(0, 150)
+    words = text.split()
+    words[75] = "changed"
+    assert dedup.check(text, "a") is None
+    assert dedup.check(" ".join(words), "b") == ("near", "a")
+    assert dedup.check(paragraph(1, 150), "c") is None
+    assert dedup.stats == {"unique": 2, "exact": 0, "near": 1}
+
+
+def test_seeded_chunks_are_not_counted():
+    dedup = Deduplicator()
+    dedup.seed([("stored", paragraph(0, 100))])
+    assert dedup.stats == {"unique": 0, "exact": 0, "near": 0}
+    assert dedup.check(paragraph(0, 100), "new") == ("exact", "stored")
+
+
+def test_retained_chunks_only():
+    dedup = Deduplicator()
+    dedup.check(paragraph(0, 100), "a")
+    dedup.check(paragraph(1, 100), "b")
+    dedup.retain(["b"])
+    assert dedup.check(paragraph(0, 100), "c") is None
+    assert dedup.check(paragraph(1, 100), "d") == ("exact", "b")
+
+
+def test_saved_state_finds_the_same_duplicates(tmp_path):
+    path = str(tmp_path / "dedup.npz")
+    dedup = Deduplicator()
+    for i in range(20):
+        dedup.check(paragraph(i, 150), f"chunk-{i}")
+    dedup.retain([f"chunk-{i}" for i in range(1, 20)])
+    dedup.save(path)
+
+    loaded = Deduplicator.load(path)
+    assert loaded.ids == [f"chunk-{i}" for i in range(1, 20)]
+    words = paragraph(7, 150).split()
+    words[10] = "changed"
+    assert loaded.check(" ".join(words), "new-1") == ("near", "chunk-7")
+    assert loaded.check(paragraph(3, 150), "new-2") == ("exact", "chunk-3")
+    assert loaded.check(paragraph(0, 150), "new-3") is None
+    # Chunks added after loading are found too, and survive the next save
+    assert loaded.check(paragraph(0, 150), "new-4") == ("exact", "new-3")
+    loaded.save(path)
+    assert Deduplicator.load(path).check(paragraph(0, 150)) == ("exact", "new-3")
+
+
+def test_saved_keys_keep_trailing_nul_bytes(tmp_path):
+    # About one SHA-1 digest in 256 ends in \x00
+    text = next(f"dosage table {n}" for n in range(100000)
+                if hashlib.sha1(f"dosage table {n}".encode("utf-8")).digest().endswith(b"\x00"))
+    path = str(tmp_path / "dedup.npz")
+    dedup = Deduplicator()
+    dedup.check(text, "a")
+    dedup.check(paragraph(0, 100), "b")
+    dedup.save(path)
+    loaded = Deduplicator.load(path)
+    assert loaded.keys == dedup.keys
+    assert loaded.check(text, "c") == ("exact", "a")
+
+
+def test_state_saved_with_bytes_keys_is_not_loaded(tmp_path):
+    path = str(tmp_path / "dedup.npz")
+    dedup = Deduplicator()
+    dedup.check(paragraph(0, 100), "a")
+    dedup.save(path)
+    with np.load(path) as saved:
+        arrays = dict(saved)
+    arrays["keys"] = np.array([row.tobytes() for row in arrays["keys"]], dtype="S20")
+    with open(path, "wb") as f:
+        np.savez(f, **arrays)
+    assert Deduplicator.load(path) is None
+
+
+def test_state_saved_with_other_hash_settings_is_not_loaded(tmp_path):
+    path = str(tmp_path / "dedup.npz")
+    Deduplicator(permutations=32, bands=8).save(path)
+    assert Deduplicator.load(path) is None
+    assert Deduplicator.load(str(tmp_path / "missing.npz")) is None
@@ -0,0 +1,140 @@
+import numpy as np
+import pytest
+
+import embedding_cache
+from embedding_cache import CachedEmbeddings, EmbeddingCache
+
+
+def vector(text, dim=4):
+    return np.full(dim, sum(map(ord, text)), dtype=np.float32)
+
+
+@pytest.fixture
+def open_cache(tmp_path):
+    def open_cache(max_entries=3):
+        return EmbeddingCache("test-model", cache_dir=str(tmp_path), max_entries=max_entries)
+    return open_cache
+
+
+def put(cache, *texts):
+    cache.put_many("document", list(texts), [vector(text) for text in texts])
+
+
+def cached(cache, *texts):
+    found = cache.get_many("document", list(texts))
+    return {texts[i]: value for i, value in found.items()}
+
+
+def slots(cache):
+    return sorted(slot for (slot,) in cache.db.execute("SELECT slot FROM entries"))
+
+
+def test_hits_and_misses(open_cache):
+    cache = open_cache()
+    put(cache, "a", "b")
+    found = cached(cache, "a", "b", "c")
+    assert set(found) == {"a", "b"}
+    np.testing.assert_array_equal(found["a"], vector("a"))
+    assert (cache.hits, cache.misses) == (2, 1)
+    assert cached(cache, "a") and not cache.get_many("query", ["a"])
+
+
+def test_least_recently_used_entry_is_evicted(open_cache):
+    cache = open_cache()
+    put(cache, "a", "b", "c")
+    cached(cache, "a")  # recency only in memory; written before the eviction
+    put(cache, "d")
+    assert set(cached(cache, "a", "b", "c", "d")) == {"a", "c", "d"}
+    assert slots(cache) == [0, 1, 2]
+
+
+def test_re_put_of_a_stored_key_keeps_its_own_slot(open_cache):
+    cache = open_cache()
+    put(cache, "a", "b", "c")
+    put(cache, "a", "d")
+    found = cached(cache, "a", "b", "c", "d")
+    assert set(found) == {"a", "c", "d"}
+    for text, value in found.items():
+        np.testing.assert_array_equal(value, vector(text))
+    assert slots(cache) == [0, 1, 2]
+
+
+def test_a_batch_never_evicts_its_own_keys(open_cache):
+    cache = open_cache()
+    put(cache, "a", "b", "c")
+    put(cache, "d", "e", "f")
+    found = cached(cache, "a", "b", "c", "d", "e", "f")
+    assert set(found) == {"d", "e", "f"}
+    for text, value in found.items():
+        np.testing.assert_array_equal(value, vector(text))
+
+
+def test_batch_larger_than_the_cache_keeps_its_tail(open_cache):
+    cache = open_cache()
+    put(cache, "a", "b", "c", "d", "e")
+    assert set(cached(cache, "a", "b", "c", "d", "e")) == {"c", "d", "e"}
+
+
+def test_reopened_cache_keeps_vectors_and_recency(open_cache):
+    cache = open_cache()
+    put(cache, "a", "b", "c")
+    cached(cache, "a")
+    cache.flush()
+    reopened = open_cache()
+    np.testing.assert_array_equal(cached(reopened, "b")["b"], vector("b"))
+    reopened.flush()
+    put(reopened, "d")
+    assert set(cached(reopened, "a", "b", "c", "d")) == {"a", "b", "d"}
+
+
+def test_vector_evicted_by_another_process_during_a_read_is_a_miss(open_cache, monkeypatch):
+    reader, writer = open_cache(), open_cache()
+    put(writer, "a", "b", "c")
+    rows = reader._rows
+    calls = []
+
+    def evict_after_lookup(keys):
+        found = rows(keys)
+        if not calls:
+            calls.append(keys)
+            put(writer, "x", "y", "z")  # overwrites every slot between the lookup and the read
+        return found
+
+    monkeypatch.setattr(reader, "_rows", evict_after_lookup)
+    assert cached(reader, "a", "b") == {}
+    assert set(cached(reader, "x", "y")) == {"x", "y"}
+
+
+def test_placeholder_left_by_a_crashed_write_is_reused(open_cache):
+    cache = open_cache()
+    put(cache, "a")
+    key = cache.key("document", "b")
+    cache.db.execute("INSERT INTO entries VALUES (?, 1, 0)", (embedding_cache.PENDING + key,))
+    cache.db.execute("UPDATE meta SET value = 2 WHERE name = 'next_slot'")
+    cache.db.commit()
+    assert cached(cache, "b") == {}
+    put(cache, "b")
+    np.testing.assert_array_equal(cached(cache, "b")["b"], vector("b"))
+    assert slots(cache) == [0, 1]
+
+
+class CountingEmbeddings:
+    def __init__(self):
+        self.embedded = []
+
+    def embed_documents(self, texts):
+        self.embedded += texts
+        return [vector(text).tolist() for text in texts]
+
+    def embed_query(self, text):
+        self.embedded.append(text)
+        return vector(text).tolist()
+
+
+def test_cached_embeddings_only_embed_unseen_texts(open_cache):
+    model = CountingEmbeddings()
+    embeddings = CachedEmbeddings(model, open_cache(max_entries=10))
+    assert embeddings.embed_documents(["a", "b", "a"]) == [vector(t).tolist() for t in "aba"]
+    assert embeddings.embed_documents(["b", "c"]) == [vector(t).tolist() for t in "bc"]
+    assert embeddings.embed_query("a") == vector("a").tolist()
+    assert model.embedded == ["a", "b", "c", "a"]
@@ -0,0 +1,86 @@
+import pytest
+
+from lab_parser import flag_abnormalities, parse_lab_values
+
+
+def values(text):
+    return {result.test: result.value for result in parse_lab_values(text)}
+
+
+def test_longest_alias_wins():
+    text = "MCV 88 fL\nMCH 29.5 pg\nMCHC 33.1 g/dL\nMean Corpuscular Hemoglobin Concentration 34"
+    assert values(text) == {"MCV": 88, "MCH": 29.5, "MCHC": 34}
+    assert [r.test for r in parse_lab_values(text)] == ["MCV", "MCH", "MCHC", "MCHC"]
+
+
+def test_alias_inside_a_longer_name_is_not_another_test():
+    results = parse_lab_values("Mean Corpuscular Hemoglobin 27.0 pg\nRBC Distribution Width - CV 13.2 %")
+    assert [(r.test, r.value) for r in results] == [("MCH", 27.0), ("RBC Distribution Width - CV", 13.2)]
+
+
+@pytest.mark.parametrize("text", ["HbA1c 6.1 %", "PLTX 12", "ProRBC 5", "subHb 10"])
+def test_aliases_match_whole_words_only(text):
+    assert parse_lab_values(text) == []
+
+
+def test_units_scale_counts_to_per_microlitre():
+    results = {r.test: r for r in parse_lab_values(
+        "Platelet Count 2.5 lakhs/cumm\nTotal WBC Count 7.2 x10^3/µL\nHemoglobin 14.2 g/dL"
+    )}
+    assert results["Platelet Count"].value == 250000
+    assert results["Platelet Count"].unit == "/µL"
+    assert results["Total Leukocyte Count"].value == 7200
+    assert results["Hemoglobin"].unit == "g/dL"
+
+
+def test_thousands_separators():
+    assert values("Platelets: 1,50,000\nWBC 11,500 /cumm") == {"Platelet Count": 150000,
+                                                               "Total Leukocyte Count": 11500}
+
+
+def test_printed_reference_range_replaces_the_default():
+    result = parse_lab_values("Hemoglobin 12.5 g/dL 12.0 - 15.5")[0]
+    assert result.range == (12.0, 15.5)
+    assert result.status == "normal"
+
+
+@pytest.mark.parametrize("value, status", [("13.0", "normal"), ("18.0", "normal"), ("12.9", "low"), ("18.1", "high")])
+def test_range_boundaries_are_normal(value, status):
+    assert parse_lab_values(f"Hemoglobin {value}")[0].status == status
+
+
+def test_table_cells_and_flags_between_name_and_value():
+    text = "| Hemoglobin | L | 9.8 | g/dL |\nNeutrophils (segmented)\n82\n%"
+    results = parse_lab_values(text)
+    assert [(r.test, r.value, r.unit, r.status) for r in results] == [
+        ("Hemoglobin", 9.8, "g/dL", "low"), ("Neutrophils", 82, "%", "high")]
+
+
+def test_exact_duplicates_are_dropped():
+    assert len(parse_lab_values("Hb 14\nHemoglobin 14\nHb 15")) == 2
+
+
+def test_flag_abnormalities_keeps_only_out_of_range():
+    assert [r.test for r in flag_abnormalities("Hemoglobin 14\nPlatelet Count 90000")] == ["Platelet Count"]
+
+
+def test_absolute_counts_have_their_own_ranges():
+    results = parse_lab_values("Neutrophils 62 %\nAbsolute Neutrophils 3600 /cumm\nAEC 0.65 x10^3/µL\n"
+                               "ANC 1500")
+    assert [(r.test, r.value, r.range, r.status) for r in results] == [
+        ("Neutrophils", 62, (40, 70), "normal"),
+        ("Absolute Neutrophil Count", 3600, (2000, 7000), "normal"),
+        ("Absolute Eosinophil Count", 650, (20, 500), "high"),
+        ("Absolute Neutrophil Count", 1500, (2000, 7000), "low"),
+    ]
+
+
+@pytest.mark.parametrize("text", ["Lymphocytes 2100 cells/cumm", "Lymphocytes: 2100", "Lymphocytes 2.1 10^3/uL"])
+def test_count_under_a_percentage_name_is_an_absolute_count(text):
+    result = parse_lab_values(text)[0]
+    assert (result.test, result.value, result.status) == ("Absolute Lymphocyte Count", 2100, "normal")
+
+
+def test_percent_units_after_a_mass():
+    results = parse_lab_values("Hb: 14.1 gm%\nHemoglobin 9.2 g %")
+    assert [(r.value, r.unit, r.status) for r in results] == [(14.1, "gm%", "normal"), (9.2, "g%", "low")]
@@ -0,0 +1,55 @@
+import time
+
+from llm_router import ProviderHealth
+
+
+def opened(cooldown=0.0):
+    health = ProviderHealth(failure_threshold=2, cooldown=cooldown)
+    health.record_failure()
+    health.record_failure()
+    return health
+
+
+def test_closed_breaker_admits_everyone():
+    health = ProviderHealth(failure_threshold=2)
+    assert health.claim() == "closed"
+    assert health.claim() == "closed"
+    assert health.available()
+
+
+def test_open_breaker_waits_for_the_cooldown():
+    health = opened(cooldown=60)
+    assert not health.available()
+    assert health.claim() is None
+
+
+def test_half_open_admits_a_single_probe():
+    health = opened()
+    assert health.available()
+    assert health.claim() == "probe"
+    assert not health.available()
+    assert health.claim() is None
+
+
+def test_probe_success_closes_the_breaker():
+    health = opened()
+    health.claim()
+    health.record_success(0.5)
+    assert health.claim() == "closed"
+    assert health.snapshot()["state"] == "closed"
+
+
+def test_probe_failure_reopens_the_breaker():
+    health = opened(cooldown=0.05)
+    health.claim()
+    health.record_failure()
+    assert health.claim() is None
+    time.sleep(0.06)
+    assert health.claim() == "probe"
+
+
+def test_released_probe_lets_another_request_try():
+    health = opened()
+    health.claim()
+    health.release_probe()
+    assert health.claim() == "probe"
@@ -0,0 +1,136 @@
+import threading
+import time
+import types
+
+import pytest
+
+from llm import LLMError, Provider, rate_limit_delay
+from llm_scheduler import PRIORITY_BATCH, PRIORITY_INTERACTIVE, ProviderScheduler, RateLimited, TokenBucket
+
+
+class TooManyRequests(Exception):
+    status_code = 429
+
+    def __init__(self, retry_after=None):
+        super().__init__("429 Too Many Requests")
+        headers = {} if retry_after is None else {"retry-after": str(retry_after)}
+        self.response = types.SimpleNamespace(headers=headers)
+
+
+class FakeClient:
+    # Answers "ok" in one part, after raising the queued errors one call at a time
+    def __init__(self, *errors):
+        self.errors = list(errors)
+        self.calls = 0
+        self.chat = types.SimpleNamespace(completions=types.SimpleNamespace(create=self.create))
+
+    def create(self, **kwargs):
+        self.calls += 1
+        if self.errors:
+            raise self.errors.pop(0)
+        return types.SimpleNamespace(choices=[types.SimpleNamespace(message=types.SimpleNamespace(content="ok"))])
+
+
+MESSAGES = [{"role": "user", "content": "hi"}]
+
+
+def run(scheduler, client, deadline=None):
+    provider = Provider(scheduler.name, client, "test-model")
+    deadline_at = time.monotonic() + deadline if deadline is not None else None
+    return "".join(scheduler.stream(provider, MESSAGES, stream=False, deadline_at=deadline_at))
+
+
+def test_token_bucket_refills_per_minute():
+    bucket = TokenBucket(60)
+    now = bucket.updated
+    assert bucket.wait_time(60, now) == 0
+    bucket.take(60)
+    assert bucket.wait_time(1, now) == pytest.approx(1.0)
+    assert bucket.wait_time(1, now + 0.5) == pytest.approx(0.5)
+    assert bucket.wait_time(1, now + 5) == 0
+
+
+def test_token_bucket_lets_an_oversized_request_through_on_a_full_bucket():
+    bucket = TokenBucket(60)
+    now = bucket.updated
+    assert bucket.wait_time(100, now) == 0
+    bucket.take(100)
+    # In debt: the next request waits for the overdraft to be paid back as well
+    assert bucket.wait_time(1, now) == pytest.approx(41.0)
+
+
+def test_request_budget_is_enforced():
+    scheduler = ProviderScheduler("test", requests_per_minute=600)  # one request per 0.1s after the burst
+    scheduler.requests.level = 1
+    scheduler.acquire(10)
+    assert scheduler.acquire(10) == pytest.approx(0.1, abs=0.05)
+
+
+def test_waiting_requests_go_in_priority_order():
+    scheduler = ProviderScheduler("test", requests_per_minute=1200)  # one request per 50ms
+    scheduler.requests.level = 0
+    order = []
+
+    def request(label, priority):
+        scheduler.acquire(1, priority)
+        order.append(label)
+
+    threads = []
+    for label, priority in [("batch-1", PRIORITY_BATCH), ("batch-2", PRIORITY_BATCH),
+                            ("chat-1", PRIORITY_INTERACTIVE), ("chat-2", PRIORITY_INTERACTIVE)]:
+        threads.append(threading.Thread(target=request, args=(label, priority)))
+        threads[-1].start()
+        time.sleep(0.005)  # arrival order
+    for thread in threads:
+        thread.join(5)
+    assert order == ["chat-1", "chat-2", "batch-1", "batch-2"]
+
+
+def test_429_holds_the_queue_for_retry_after_and_retries():
+    scheduler = ProviderScheduler("test")
+    client = FakeClient(TooManyRequests(retry_after=0.2))
+    started = time.monotonic()
+    assert run(scheduler, client, deadline=5) == "ok"
+    assert client.calls == 2
+    assert time.monotonic() - started >= 0.2
+    assert scheduler.backoffs == 0  # reset by the success
+
+
+def test_429_without_retry_after_backs_off_exponentially(monkeypatch):
+    monkeypatch.setattr("llm_scheduler.LLM_BACKOFF_BASE", 0.01)
+    scheduler = ProviderScheduler("test")
+    client = FakeClient(TooManyRequests(), TooManyRequests(), TooManyRequests())
+    assert run(scheduler, client, deadline=5) == "ok"
+    assert client.calls == 4
+
+
+def test_other_errors_are_not_retried():
+    scheduler = ProviderScheduler("test")
+    client = FakeClient(ValueError("bad request"))
+    with pytest.raises(ValueError):
+        run(scheduler, client, deadline=5)
+    assert client.calls == 1
+
+
+def test_deadline_during_back_off_is_rate_limited():
+    scheduler = ProviderScheduler("test")
+    client = FakeClient(TooManyRequests(retry_after=30))
+    with pytest.raises(RateLimited) as raised:
+        run(scheduler, client, deadline=0.3)
+    assert isinstance(raised.value.error, TooManyRequests)
+    assert rate_limit_delay(LLMError([("test", raised.value)])) == 30
+
+
+def test_deadline_behind_another_requests_429_is_rate_limited():
+    scheduler = ProviderScheduler("test")
+    scheduler.back_off(30)
+    with pytest.raises(RateLimited):
+        scheduler.acquire(1, deadline_at=time.monotonic() + 0.2)
+
+
+def test_deadline_without_budget_is_a_plain_timeout():
+    scheduler = ProviderScheduler("test", requests_per_minute=1)
+    scheduler.requests.level = 0
+    with pytest.raises(TimeoutError) as raised:
+        scheduler.acquire(1, deadline_at=time.monotonic() + 0.2)
+    assert not isinstance(raised.value, RateLimited)
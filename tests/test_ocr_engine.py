@@ -0,0 +1,71 @@
+import numpy as np
+import pytest
+from PIL import Image
+
+import ocr_engine
+from ocr_engine import (PSM_AUTO, PSM_BLOCK, PSM_SPARSE, choose_dpi, choose_psm, despeckle, estimate_skew,
+                        line_height, otsu_threshold, prepare_page, rotate, text_lines)
+
+
+def page(lines=12, height=20, gap=20, width=800, columns=None):
+    # White page with black bars for text lines; `columns` splits every line into separated cells
+    gray = np.full((lines * (height + gap) + 2 * gap, width), 255, dtype=np.uint8)
+    for i in range(lines):
+        top = gap + i * (height + gap)
+        for start, end in columns or [(50, width - 50)]:
+            gray[top:top + height, start:end] = 0
+    return gray
+
+
+@pytest.mark.parametrize("level", [0, 128, 255])
+def test_single_grey_level_has_no_threshold(level):
+    assert otsu_threshold(np.full((50, 50), level, dtype=np.uint8)) == 0
+
+
+def test_blank_page_is_prepared_without_ink():
+    image, dpi, psm = prepare_page(lambda dpi: Image.new("L", (800, 1000), 255), 200)
+    assert dpi == 200
+    assert psm == PSM_SPARSE
+    assert image.min() == 255
+
+
+def test_otsu_separates_ink_from_paper():
+    gray = np.concatenate([np.full(1000, 240), np.full(200, 30)]).astype(np.uint8)
+    assert 30 <= otsu_threshold(gray) < 240
+
+
+def test_despeckle_drops_isolated_pixels_and_keeps_strokes():
+    ink = np.zeros((20, 20), dtype=bool)
+    ink[2, 2] = True
+    ink[10:13, 5:15] = True
+    cleaned = despeckle(ink)
+    assert not cleaned[2, 2]
+    assert cleaned[10:13, 5:15].all()
+
+
+@pytest.mark.parametrize("angle", [-3.0, -1.5, 2.0])
+def test_skew_is_measured(angle):
+    ink = rotate(page(), angle) < 128
+    assert estimate_skew(ink) == pytest.approx(-angle, abs=0.5)
+
+
+def test_lines_are_measured_along_the_skew():
+    ink = rotate(page(), 2.0) < 128
+    assert len(text_lines(ink, estimate_skew(ink))) == 12
+    assert line_height(text_lines(page() < 128)) == 20
+
+
+def test_dpi_brings_lines_to_the_target_height():
+    assert choose_dpi(16, 200, target=32) == 400
+    assert choose_dpi(64, 200, target=32, low=150) == 150
+    assert choose_dpi(30, 200, target=32) == 200  # within tolerance: no re-render
+    assert choose_dpi(None, 200) == 200
+
+
+def test_tables_are_read_row_by_row(monkeypatch):
+    monkeypatch.setattr(ocr_engine, "OCR_PSM", None)
+    table = page(columns=[(50, 250), (450, 550), (650, 750)]) < 128
+    prose = page() < 128
+    assert choose_psm(table, text_lines(table)) == PSM_BLOCK
+    assert choose_psm(prose, text_lines(prose)) == PSM_AUTO
+    assert choose_psm(prose[:60], text_lines(prose[:60])) == PSM_SPARSE
@@ -0,0 +1,48 @@
+import report_analysis
+from llm import Provider
+
+
+class EchoRouter:
+    # Answers every prompt with the text it was given, so notes never shrink; records the prompts
+    def __init__(self):
+        self.providers = [Provider("test", None, "test-model")]
+        self.prompts = []
+
+    def stream(self, messages, timings=None, priority=None):
+        prompt = messages[-1]["content"]
+        self.prompts.append(prompt)
+        yield prompt.split("\n\n")[-2][-200:]
+
+
+def kind(prompt):
+    for name in ("MAP_PROMPT", "MERGE_PROMPT", "REDUCE_PROMPT", "SUMMARY_PROMPT"):
+        if prompt.startswith(getattr(report_analysis, name).split("{")[0]):
+            return name
+
+
+def test_later_rounds_merge_notes_instead_of_mapping_them_again(monkeypatch):
+    monkeypatch.setattr(report_analysis, "LONG_REPORT_TOKENS", 300)
+    split = report_analysis.split_report
+    monkeypatch.setattr(report_analysis, "split_report", lambda text, models: split(text, models, max_tokens=250))
+    router = EchoRouter()
+    pages = [f"Page {i}: " + "Hemoglobin 13.5 g/dL. " * 40 for i in range(8)]
+    timings = {}
+    "".join(report_analysis.generate_summary(report_analysis.report_extraction.PAGE_BREAK.join(pages), timings,
+                                             router))
+
+    assert timings["mode"] == "map-reduce"
+    assert timings["rounds"] >= 2
+    kinds = [kind(prompt) for prompt in router.prompts]
+    maps = kinds.count("MAP_PROMPT")
+    assert maps == timings["parts"]
+    assert set(kinds[:maps]) == {"MAP_PROMPT"}
+    assert set(kinds[maps:-1]) == {"MERGE_PROMPT"}
+    assert kinds[-1] == "REDUCE_PROMPT"
+
+
+def test_short_report_is_summarized_in_one_call():
+    router = EchoRouter()
+    timings = {}
+    "".join(report_analysis.generate_summary("Hemoglobin 13.5 g/dL", timings, router))
+    assert timings["mode"] == "single"
+    assert [kind(prompt) for prompt in router.prompts] == ["SUMMARY_PROMPT"]
@@ -0,0 +1,95 @@
+import json
+
+import pytest
+
+import report_analysis
+from llm import Provider
+from report_cache import ReportCache, content_hash, version_hash
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return ReportCache(str(tmp_path / "reports.sqlite"))
+
+
+class Router:
+    def __init__(self, *models):
+        self.providers = [Provider(model, None, model) for model in models]
+
+
+def test_content_hash_depends_only_on_the_bytes():
+    assert content_hash(b"%PDF report") == content_hash(bytearray(b"%PDF report"))
+    assert content_hash(b"%PDF report") != content_hash(b"%PDF report ")
+
+
+def test_version_hash_changes_with_any_part():
+    base = version_hash("prompt", {"Hemoglobin": (13.0, 18.0)}, ["llama3"])
+    assert base == version_hash("prompt", {"Hemoglobin": [13.0, 18.0]}, ["llama3"])
+    assert base != version_hash("prompt ", {"Hemoglobin": (13.0, 18.0)}, ["llama3"])
+    assert base != version_hash("prompt", {"Hemoglobin": (12.0, 18.0)}, ["llama3"])
+    assert base != version_hash("prompt", {"Hemoglobin": (13.0, 18.0)}, ["deepseek"])
+    assert version_hash({"a": 1, "b": 2}) == version_hash({"b": 2, "a": 1})
+
+
+def test_entries_are_keyed_by_kind_hash_and_version(cache):
+    cache.put("text", "abc", "v1", "report text")
+    assert cache.get("text", "abc", "v1") == "report text"
+    assert cache.get("text", "abc", "v2") is None
+    assert cache.get("text", "abd", "v1") is None
+    assert cache.get("summary", "abc", "v1") is None
+
+
+def test_values_round_trip_as_json(cache):
+    flags = [{"test": "Hemoglobin", "value": 9.8, "unit": "g/dL", "range": [13.0, 18.0], "status": "low"}]
+    cache.put("flags", "abc", "v1", flags)
+    assert cache.get("flags", "abc", "v1") == flags
+
+
+def test_get_or_compute_caches_results_but_not_none(cache):
+    calls = []
+
+    def compute(value):
+        def run():
+            calls.append(value)
+            return value
+        return run
+
+    assert cache.get_or_compute("flags", "abc", "v1", compute([])) == []
+    assert cache.get_or_compute("flags", "abc", "v1", compute(["other"])) == []
+    assert cache.get_or_compute("summary", "abc", "v1", compute(None)) is None
+    assert cache.get_or_compute("summary", "abc", "v1", compute("later")) == "later"
+    assert calls == [[], None, "later"]
+
+
+def test_least_recently_used_entries_are_evicted(tmp_path):
+    value = "x" * 100
+    size = len(json.dumps(value))
+    cache = ReportCache(str(tmp_path / "reports.sqlite"), max_bytes=3 * size)
+    for digest in "abc":
+        cache.put("text", digest, "v1", value)
+    cache.get("text", "a", "v1")
+    cache.put("text", "d", "v1", value)
+    assert [cache.get("text", digest, "v1") is not None for digest in "abcd"] == [True, False, True, True]
+
+
+def test_values_larger_than_the_cache_are_not_stored(tmp_path):
+    cache = ReportCache(str(tmp_path / "reports.sqlite"), max_bytes=50)
+    cache.put("text", "a", "v1", "x" * 100)
+    assert cache.get("text", "a", "v1") is None
+
+
+def test_summary_version_follows_prompts_settings_and_models(monkeypatch):
+    base = report_analysis.summary_version(Router("llama3-70b-8192", "deepseek/deepseek-chat"))
+    assert base == report_analysis.summary_version(Router("llama3-70b-8192", "deepseek/deepseek-chat"))
+    assert base != report_analysis.summary_version(Router("llama3-70b-8192"))
+    for name, value in [("REDUCE_PROMPT", "Summarize:\n{text}"), ("MERGE_PROMPT", "Merge:\n{text}"),
+                        ("LONG_REPORT_TOKENS", 4000)]:
+        with monkeypatch.context() as patch:
+            patch.setattr(report_analysis, name, value)
+            assert report_analysis.summary_version(Router("llama3-70b-8192", "deepseek/deepseek-chat")) != base
+
+
+def test_flags_version_follows_the_parser():
+    lab_parser = report_analysis.lab_parser
+    assert report_analysis.FLAGS_VERSION == version_hash(lab_parser.PARSER_VERSION, lab_parser.LAB_TESTS, "records")
+    assert report_analysis.FLAGS_VERSION != version_hash("older-parser", lab_parser.LAB_TESTS, "records")
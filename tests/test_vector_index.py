@@ -0,0 +1,53 @@
+import faiss
+import numpy as np
+import pytest
+
+from vector_index import build_index, flat_vectors, index_config, is_exact, training_size
+
+
+def vectors(count, dim=16, seed=0):
+    return np.random.default_rng(seed).standard_normal((count, dim)).astype(np.float32)
+
+
+def reread(index, tmp_path):
+    # As memory_creation.py gets it back: without the IVF direct map
+    path = str(tmp_path / "index.faiss")
+    faiss.write_index(index, path)
+    return faiss.read_index(path)
+
+
+def test_training_size():
+    assert training_size(index_config("flat")) == 0
+    assert training_size(index_config("hnsw")) == 0
+    assert training_size(index_config("ivf")) == 1
+    assert training_size(index_config("ivfsq8", nlist=50)) == 50
+    assert training_size(index_config("ivfpq", pq_m=4)) == 256
+    assert training_size(index_config("ivfpq", pq_m=4, nlist=300)) == 300
+
+
+@pytest.mark.parametrize("config", [index_config("ivf"), index_config("ivf", nlist=20), index_config("ivfpq", pq_m=4)])
+def test_build_index_needs_training_vectors(config):
+    count = training_size(config) - 1
+    with pytest.raises(ValueError, match=f"needs at least {training_size(config)} vectors"):
+        build_index(vectors(count), config)
+
+
+@pytest.mark.parametrize("index_type", ["flat", "ivf", "hnsw"])
+def test_exact_indexes_give_their_vectors_back(index_type, tmp_path):
+    added = vectors(200)
+    index = reread(build_index(added, index_config(index_type)), tmp_path)
+    assert is_exact(index)
+    np.testing.assert_array_equal(flat_vectors(index), added)
+
+
+def test_quantized_indexes_are_not_exact(tmp_path):
+    assert not is_exact(reread(build_index(vectors(300), index_config("ivfsq8")), tmp_path))
+    # 4-bit PQ: the 8-bit codebooks of build_index take seconds to train
+    pq = faiss.index_factory(16, "IVF4,PQ4x4")
+    pq.train(vectors(300))
+    assert not is_exact(reread(pq, tmp_path))
+
+
+def test_empty_index():
+    assert flat_vectors(faiss.IndexFlatL2(16)).shape == (0, 16)
+    assert build_index(vectors(0), index_config("hnsw")).ntotal == 0
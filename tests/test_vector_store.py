@@ -0,0 +1,93 @@
+import os
+import types
+
+import faiss
+import numpy as np
+import pytest
+
+import vector_store
+from vector_index import index_config
+from vector_store import ChunkStore, MmapVectorStore, current_build, publish_build, save_store, store_stats, write_store
+
+
+class FakeEmbeddings:
+    def embed_query(self, text):
+        return [float(sum(map(ord, text))), 0.0]
+
+
+def fake_db(texts):
+    # What save_store reads from LangChain's FAISS
+    index = faiss.IndexFlatL2(2)
+    if texts:
+        index.add(np.array([FakeEmbeddings().embed_query(text) for text in texts], dtype=np.float32))
+    docs = {str(i): types.SimpleNamespace(page_content=text, metadata={}) for i, text in enumerate(texts)}
+    return types.SimpleNamespace(index=index, index_to_docstore_id={i: str(i) for i in range(len(texts))},
+                                 docstore=types.SimpleNamespace(search=docs.get))
+
+
+def builds(path):
+    return sorted(name for name in os.listdir(path) if name.startswith(vector_store.BUILD_PREFIX))
+
+
+def open_store(path):
+    return MmapVectorStore(str(path), FakeEmbeddings(), index_config())
+
+
+def test_save_publishes_a_new_build(tmp_path):
+    first = save_store(fake_db(["alpha", "beta"]), str(tmp_path))
+    assert current_build(str(tmp_path)) == first
+    assert store_stats(str(tmp_path))[0] == 2
+    second = save_store(fake_db(["gamma"]), str(tmp_path))
+    assert current_build(str(tmp_path)) == second
+    assert current_build(second) == second
+    assert [doc.page_content for doc in open_store(tmp_path).similarity_search("gamma", k=1)] == ["gamma"]
+    # Only the published build and the one before it are kept
+    third = save_store(fake_db(["delta"]), str(tmp_path))
+    assert builds(tmp_path) == sorted(os.path.basename(build) for build in (second, third))
+
+
+def test_open_store_survives_a_publish(tmp_path):
+    save_store(fake_db(["alpha", "beta"]), str(tmp_path))
+    store = open_store(tmp_path)
+    save_store(fake_db(["gamma"]), str(tmp_path))
+    save_store(fake_db(["delta"]), str(tmp_path))
+    # Its build directory is gone, but the files it mapped are still readable
+    assert [doc.page_content for doc in store.similarity_search("beta", k=1)] == ["beta"]
+
+
+def test_unpublished_build_is_invisible_and_cleaned_up(tmp_path):
+    published = save_store(fake_db(["alpha"]), str(tmp_path))
+    crashed = vector_store.new_build(str(tmp_path))
+    write_store(fake_db(["half", "written"]), crashed)
+    assert current_build(str(tmp_path)) == published
+    assert store_stats(str(tmp_path))[0] == 1
+    latest = save_store(fake_db(["beta"]), str(tmp_path))
+    assert builds(tmp_path) == sorted(os.path.basename(build) for build in (published, latest))
+
+
+def test_unversioned_store_is_read_and_migrated(tmp_path):
+    # The layout from before builds were versioned: files straight in the store directory
+    write_store(fake_db(["alpha", "beta"]), str(tmp_path))
+    (tmp_path / "manifest.json").write_text("{}")
+    assert current_build(str(tmp_path)) == str(tmp_path)
+    assert len(ChunkStore(str(tmp_path))) == 2
+    build = vector_store.new_build(str(tmp_path))
+    write_store(fake_db(["gamma"]), build)
+    publish_build(str(tmp_path), build)
+    assert sorted(os.listdir(tmp_path)) == sorted([vector_store.CURRENT_FILE, os.path.basename(build)])
+    assert ChunkStore(str(tmp_path)).text(0) == "gamma"
+
+
+def test_empty_store(tmp_path):
+    save_store(fake_db([]), str(tmp_path))
+    assert store_stats(str(tmp_path))[0] == 0
+    assert open_store(tmp_path).similarity_search("anything") == []
+
+
+def test_index_and_chunks_must_match(tmp_path):
+    build = save_store(fake_db(["alpha", "beta"]), str(tmp_path))
+    index = faiss.read_index(os.path.join(build, vector_store.INDEX_FILE))
+    index.add(np.zeros((1, 2), dtype=np.float32))
+    faiss.write_index(index, os.path.join(build, vector_store.INDEX_FILE))
+    with pytest.raises(ValueError, match="3 vectors but there are 2 chunks"):
+        open_store(tmp_path)
@@ -0,0 +1,53 @@
+import logging
+import math
+import os
+from functools import lru_cache
+
+
+logger = logging.getLogger(__name__)
+
+# Hugging Face tokenizer (hub id, or a path to a tokenizer.json) for each model in clients.LLM_PROVIDERS
+MODEL_TOKENIZERS = {
+    "llama3-70b-8192": "meta-llama/Meta-Llama-3-70B-Instruct",
+    "deepseek/deepseek-chat": "deepseek-ai/DeepSeek-V3",
+}
+# Use this tokenizer for every model instead, e.g. a local tokenizer.json when the hub is unreachable
+LLM_TOKENIZER = os.getenv("LLM_TOKENIZER")
+# Chat-template tokens around each message and before the reply (Llama 3: header ids, role, eot)
+MESSAGE_OVERHEAD = 5
+REPLY_OVERHEAD = 5
+# Characters per token when no tokenizer can be loaded; deliberately low, so estimates err large
+FALLBACK_CHARS_PER_TOKEN = 3
+
+
+@lru_cache(maxsize=None)
+def get_tokenizer(model):
+    name = LLM_TOKENIZER or MODEL_TOKENIZERS.get(model)
+    if not name:
+        logger.warning("No tokenizer configured for %s; estimating tokens from characters", model)
+        return None
+    try:
+        from tokenizers import Tokenizer
+
+        if os.path.isfile(name):
+            return Tokenizer.from_file(name)
+        # Gated repos (Llama) need HF_TOKEN
+        return Tokenizer.from_pretrained(name, token=os.getenv("HF_TOKEN"))
+    except Exception as e:
+        logger.warning("Could not load tokenizer %s for %s (%s); estimating tokens from characters", name, model, e)
+        return None
+
+
+def count_tokens(text, model):
+    tokenizer = get_tokenizer(model)
+    if tokenizer is None:
+        return math.ceil(len(text) / FALLBACK_CHARS_PER_TOKEN)
+    return len(tokenizer.encode(text, add_special_tokens=False).ids)
+
+
+def count_message_tokens(messages, models):
+    # Prompt size under the largest of the models' tokenizers, so a budget holds whichever provider answers
+    return max(
+        sum(count_tokens(message["content"], model) + MESSAGE_OVERHEAD for message in messages) + REPLY_OVERHEAD
+        for model in models
+    )
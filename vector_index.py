@@ -0,0 +1,107 @@
+import json
+import math
+import os
+
+import faiss
+import numpy as np
+
+
+INDEX_TYPES = ("flat", "ivf", "hnsw", "ivfpq", "ivfsq8", "ivfsq16")
+DEFAULT_INDEX = {"type": "flat", "nlist": None, "hnsw_m": 32, "pq_m": 48,
+                 "nprobe": 8, "ef_search": 64, "ef_construction": 80}
+
+
+def index_config(index_type="flat", **params):
+    if index_type not in INDEX_TYPES:
+        raise ValueError(f"Unknown index type {index_type!r}, expected one of {', '.join(INDEX_TYPES)}")
+    config = dict(DEFAULT_INDEX, type=index_type)
+    config.update({name: value for name, value in params.items() if value is not None})
+    return config
+
+
+def default_nlist(count):
+    # ~4*sqrt(n) lists, but keep at least 39 training points per list (faiss' own minimum)
+    return max(1, min(int(4 * math.sqrt(count)), count // 39))
+
+
+def factory_string(config, count):
+    nlist = config["nlist"] or default_nlist(count)
+    return {
+        "flat": "Flat",
+        "ivf": f"IVF{nlist},Flat",
+        "hnsw": f"HNSW{config['hnsw_m']}",
+        "ivfpq": f"IVF{nlist},PQ{config['pq_m']}",
+        "ivfsq8": f"IVF{nlist},SQ8",
+        "ivfsq16": f"IVF{nlist},SQfp16",
+    }[config["type"]]
+
+
+def training_size(config):
+    # Fewest vectors build_index() can train this index type on: one per IVF list, and 256 for the
+    # PQ codebooks (8-bit codes)
+    if config["type"] == "ivfpq":
+        return max(256, config["nlist"] or 1)
+    if config["type"].startswith("ivf"):
+        return config["nlist"] or 1
+    return 0
+
+
+def build_index(vectors, config):
+    # Vectors are added in order, so position i still maps to index_to_docstore_id[i]
+    vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+    count, dim = vectors.shape
+    if config["type"] == "ivfpq" and dim % config["pq_m"]:
+        raise ValueError(f"pq_m={config['pq_m']} must divide the embedding dimension {dim}")
+    if count < training_size(config):
+        raise ValueError(f"{config['type']} needs at least {training_size(config)} vectors to train, got {count}; "
+                         f"use flat")
+    index = faiss.index_factory(dim, factory_string(config, count))
+    if config["type"] == "hnsw":
+        index.hnsw.efConstruction = config["ef_construction"]
+    if not index.is_trained:
+        index.train(vectors)
+    index.add(vectors)
+    set_search_params(index, config)
+    return index
+
+
+def set_search_params(index, config):
+    params = faiss.ParameterSpace()
+    if isinstance(faiss.try_extract_index_ivf(index), faiss.IndexIVF):
+        params.set_index_parameter(index, "nprobe", config["nprobe"])
+    if hasattr(index, "hnsw"):
+        params.set_index_parameter(index, "efSearch", config["ef_search"])
+
+
+def flat_vectors(index):
+    if not index.ntotal:
+        return np.zeros((0, index.d), dtype=np.float32)
+    if isinstance(index, faiss.IndexIVF):
+        # reconstruct() on IVF needs the id -> list map, which isn't saved with the index
+        index.make_direct_map()
+    return index.reconstruct_n(0, index.ntotal)
+
+
+def is_flat(index):
+    return isinstance(index, faiss.IndexFlat)
+
+
+def is_exact(index):
+    # Flat, IVF-Flat and HNSW keep the vectors as added; PQ / SQ codes only approximate them
+    return isinstance(index, (faiss.IndexFlat, faiss.IndexIVFFlat, faiss.IndexHNSWFlat))
+
+
+# Search parameters for the serving side: the builder's settings, overridable from the environment
+def load_index_config(db_path):
+    from vector_store import current_build
+
+    config = dict(DEFAULT_INDEX)
+    manifest_path = os.path.join(current_build(db_path), "manifest.json")
+    if os.path.exists(manifest_path):
+        with open(manifest_path, "r", encoding="utf-8") as f:
+            config.update(json.load(f).get("index", {}))
+    if os.getenv("FAISS_NPROBE"):
+        config["nprobe"] = int(os.getenv("FAISS_NPROBE"))
+    if os.getenv("FAISS_EF_SEARCH"):
+        config["ef_search"] = int(os.getenv("FAISS_EF_SEARCH"))
+    return config
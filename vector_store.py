@@ -0,0 +1,176 @@
+import json
+import os
+import shutil
+import tempfile
+import time
+
+import faiss
+import numpy as np
+from langchain_core.documents import Document
+
+from vector_index import set_search_params
+
+
+# On-disk layout of vectorstore/db_faiss (no pickle anywhere):
+#   CURRENT            name of the published build directory, swapped with a single os.replace
+#   build-*/           one directory per build, never modified once published:
+#     index.faiss        FAISS index, opened with mmap on the serving side
+#     chunks.bin         UTF-8 chunk texts, back to back, in index order
+#     chunks.idx.npy     uint64 offsets into chunks.bin (n + 1 entries)
+#     chunks.meta.jsonl  {"id", "metadata"} per chunk, only read by memory_creation.py
+# Stores written before builds were versioned keep those files directly in db_faiss and are still read.
+CURRENT_FILE = "CURRENT"
+BUILD_PREFIX = "build-"
+INDEX_FILE = "index.faiss"
+TEXTS_FILE = "chunks.bin"
+OFFSETS_FILE = "chunks.idx.npy"
+META_FILE = "chunks.meta.jsonl"
+# Files of the unversioned layout (plus memory_creation.py's manifest and dedup state), removed on the first publish
+LEGACY_FILES = (INDEX_FILE, TEXTS_FILE, OFFSETS_FILE, META_FILE, "manifest.json", "dedup.npz", "index.pkl")
+
+
+def mmap_flags(index_type):
+    # IVF families map their inverted lists; flat and HNSW map the flat code storage
+    # (faiss rejects the combination of both flags for IVF)
+    if index_type.startswith("ivf"):
+        return faiss.IO_FLAG_READ_ONLY | faiss.IO_FLAG_MMAP
+    return faiss.IO_FLAG_READ_ONLY | faiss.IO_FLAG_MMAP_IFC
+
+
+def current_build(path):
+    # Directory holding the published build. Resolve it once and pass the result on: every file of a build
+    # then comes from the same build, even if a new one is published in between. A build directory resolves
+    # to itself.
+    try:
+        with open(os.path.join(path, CURRENT_FILE), "r", encoding="utf-8") as f:
+            return os.path.join(path, f.read().strip())
+    except FileNotFoundError:
+        return path
+
+
+def store_exists(path):
+    build = current_build(path)
+    return all(os.path.exists(os.path.join(build, name)) for name in (INDEX_FILE, TEXTS_FILE, OFFSETS_FILE, META_FILE))
+
+
+def store_stats(path):
+    # (chunks, bytes on disk) of a saved store, or None when there isn't one
+    build = current_build(path)
+    if not store_exists(build):
+        return None
+    chunks = len(np.load(os.path.join(build, OFFSETS_FILE), mmap_mode="r")) - 1
+    size = sum(os.path.getsize(os.path.join(build, name)) for name in (INDEX_FILE, TEXTS_FILE, OFFSETS_FILE, META_FILE))
+    return chunks, size
+
+
+def new_build(path):
+    # Empty, unpublished build directory; names sort by creation time
+    os.makedirs(path, exist_ok=True)
+    return tempfile.mkdtemp(prefix=BUILD_PREFIX + time.strftime("%Y%m%d-%H%M%S-"), dir=path)
+
+
+def write_store(db, build):
+    # Write a LangChain FAISS store into an unpublished build directory, in the mmap-friendly layout
+    offsets = np.zeros(db.index.ntotal + 1, dtype=np.uint64)
+    with open(os.path.join(build, TEXTS_FILE), "wb") as texts, \
+            open(os.path.join(build, META_FILE), "w", encoding="utf-8") as meta:
+        for i in range(db.index.ntotal):
+            chunk_id = db.index_to_docstore_id[i]
+            doc = db.docstore.search(chunk_id)
+            data = doc.page_content.encode("utf-8")
+            texts.write(data)
+            offsets[i + 1] = offsets[i] + len(data)
+            meta.write(json.dumps({"id": chunk_id, "metadata": doc.metadata}) + "\n")
+    with open(os.path.join(build, OFFSETS_FILE), "wb") as f:
+        np.save(f, offsets)
+    faiss.write_index(db.index, os.path.join(build, INDEX_FILE))
+
+
+def publish_build(path, build):
+    # Readers see either the previous build or this one, never a mix: the only write they can observe is
+    # the os.replace of CURRENT
+    previous = current_build(path)
+    pointer = os.path.join(path, CURRENT_FILE)
+    with open(pointer + ".tmp", "w", encoding="utf-8") as f:
+        f.write(os.path.basename(build))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(pointer + ".tmp", pointer)
+    # The previous build stays for readers that resolved CURRENT just before the swap; older ones, and
+    # builds that crashed before being published, go. Processes that already mmap'd a removed build keep
+    # their pages until they close them.
+    keep = {os.path.basename(build), os.path.basename(previous)}
+    for name in os.listdir(path):
+        if name.startswith(BUILD_PREFIX) and name not in keep:
+            shutil.rmtree(os.path.join(path, name), ignore_errors=True)
+    for name in LEGACY_FILES:
+        legacy = os.path.join(path, name)
+        if os.path.exists(legacy):
+            os.remove(legacy)
+
+
+def save_store(db, path):
+    build = new_build(path)
+    write_store(db, build)
+    publish_build(path, build)
+    return build
+
+
+def load_langchain_store(path, embeddings):
+    # Writable, fully loaded copy for memory_creation.py to edit
+    from langchain_community.docstore.in_memory import InMemoryDocstore
+    from langchain_community.vectorstores import FAISS
+
+    path = current_build(path)
+    index = faiss.read_index(os.path.join(path, INDEX_FILE))
+    chunks = ChunkStore(path)
+    docs = {}
+    index_to_docstore_id = {}
+    with open(os.path.join(path, META_FILE), "r", encoding="utf-8") as f:
+        for i, line in enumerate(f):
+            record = json.loads(line)
+            docs[record["id"]] = Document(id=record["id"], page_content=chunks.text(i), metadata=record["metadata"])
+            index_to_docstore_id[i] = record["id"]
+    return FAISS(embedding_function=embeddings, index=index,
+                 docstore=InMemoryDocstore(docs), index_to_docstore_id=index_to_docstore_id)
+
+
+class ChunkStore:
+    # Read-only chunk texts. Both files are mmap'd, so replicas on one host share pages via the OS cache
+
+    def __init__(self, path):
+        path = current_build(path)
+        self.offsets = np.load(os.path.join(path, OFFSETS_FILE), mmap_mode="r")
+        size = int(self.offsets[-1])
+        # np.memmap can't map an empty file
+        self.texts = np.memmap(os.path.join(path, TEXTS_FILE), dtype=np.uint8, mode="r") if size else b""
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def text(self, i):
+        start, end = int(self.offsets[i]), int(self.offsets[i + 1])
+        return bytes(self.texts[start:end]).decode("utf-8")
+
+
+class MmapVectorStore:
+    # Serving-side store: similarity_search() like LangChain's FAISS, without loading anything into the heap
+
+    def __init__(self, path, embeddings, config):
+        path = current_build(path)
+        self.embeddings = embeddings
+        self.index = faiss.read_index(os.path.join(path, INDEX_FILE), mmap_flags(config["type"]))
+        self.chunks = ChunkStore(path)
+        # A position past the chunk texts would fail at query time, or silently return the wrong chunk
+        if self.index.ntotal != len(self.chunks):
+            raise ValueError(f"{path}: index has {self.index.ntotal} vectors but there are {len(self.chunks)} chunks")
+        set_search_params(self.index, config)
+
+    def similarity_search_by_vector(self, embedding, k=4):
+        vector = np.asarray([embedding], dtype=np.float32)
+        _, positions = self.index.search(vector, k)
+        return [Document(page_content=self.chunks.text(int(i)), metadata={"position": int(i)})
+                for i in positions[0] if i >= 0]
+
+    def similarity_search(self, query, k=4):
+        return self.similarity_search_by_vector(self.embeddings.embed_query(query), k=k)